@@ -0,0 +1,120 @@
+# coding=utf-8
+import asyncio
+import logging
+
+__author__ = "DefaltSimon"
+# Read coalescing for the asyncio Redis clients
+
+log = logging.getLogger(__name__)
+log.setLevel(logging.INFO)
+
+# CONSTANTS
+
+# Only these are batched, everything else should go straight to the client
+READ_COMMANDS = {
+    "GET", "EXISTS", "TTL",
+    "HGET", "HMGET", "HGETALL", "HEXISTS", "HKEYS", "HLEN",
+    "SISMEMBER", "SMEMBERS", "SCARD",
+    "LRANGE", "LLEN",
+}
+
+# Flush at most this many commands in one pipeline
+MAX_BATCH_SIZE = 1000
+
+
+class CommandBatcher:
+    """
+    Collects read commands issued during one event loop iteration (or a short window)
+    and sends them as a single pipeline. Identical commands are only sent once and
+    every caller gets the same result.
+    """
+    __slots__ = ("redis", "window", "_pending", "_scheduled",
+                 "batches", "commands", "coalesced")
+
+    def __init__(self, redis_client, window: float=0):
+        self.redis = redis_client
+        # 0 flushes on the next loop iteration, anything else waits that many seconds
+        self.window = window
+
+        # (command, args): Future
+        self._pending = {}
+        self._scheduled = False
+
+        # Pipelines sent, commands sent and commands that were answered by another caller's command
+        self.batches = 0
+        self.commands = 0
+        self.coalesced = 0
+
+    async def load(self, command: str, *args):
+        """
+        Queues a read command and returns its (unparsed by decode) result
+        """
+        if command not in READ_COMMANDS:
+            raise ValueError("{} is not a batchable read command".format(command))
+
+        key = (command, args)
+
+        future = self._pending.get(key)
+        if future is not None:
+            self.coalesced += 1
+        else:
+            loop = asyncio.get_event_loop()
+            future = loop.create_future()
+            self._pending[key] = future
+
+            if not self._scheduled:
+                self._scheduled = True
+
+                if self.window:
+                    loop.call_later(self.window, self._flush)
+                else:
+                    loop.call_soon(self._flush)
+
+            if len(self._pending) >= MAX_BATCH_SIZE:
+                self._flush()
+
+        # One caller being cancelled shouldn't cancel the shared future
+        return await asyncio.shield(future)
+
+    def _flush(self):
+        if not self._pending:
+            self._scheduled = False
+            return
+
+        pending, self._pending = self._pending, {}
+        self._scheduled = False
+
+        asyncio.ensure_future(self._send(pending))
+
+    async def _send(self, pending: dict):
+        pipe = self.redis.pipeline(transaction=False)
+        for command, args in pending.keys():
+            pipe.execute_command(command, *args)
+
+        self.batches += 1
+        self.commands += len(pending)
+
+        try:
+            results = await pipe.execute(raise_on_error=False)
+        except Exception as e:
+            for future in pending.values():
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for future, result in zip(pending.values(), results):
+            if future.done():
+                continue
+
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    def get_stats(self) -> dict:
+        return {
+            "batches": self.batches,
+            "commands": self.commands,
+            "coalesced": self.coalesced,
+            "avg_batch": round(self.commands / self.batches, 1) if self.batches else 0,
+        }
@@ -0,0 +1,293 @@
+# coding=utf-8
+import hashlib
+import logging
+import os
+import re
+import struct
+import time
+import zlib
+
+from .confparser import get_settings_parser, DATA_DIR
+
+__author__ = "DefaltSimon"
+# Anonymized capture of incoming Discord events (replayed with utilities/replay_capture.py)
+
+log = logging.getLogger(__name__)
+log.setLevel(logging.INFO)
+
+# settings.ini
+par = get_settings_parser()
+
+# CONSTANTS
+
+MAGIC = b"NCAP"
+VERSION = 1
+
+# magic, version, wall clock time of the first event
+HEADER = struct.Struct("<4sBd")
+# event, microseconds since the previous event, guild, channel and user hashes,
+# content length, content class, mentions, command hash
+RECORD = struct.Struct("<BIQQQHBBI")
+
+DEFAULT_DIRECTORY = os.path.join(DATA_DIR, "captures")
+# Stops capturing when the file reaches this size ([Capture] max_mb)
+DEFAULT_MAX_MB = 512
+WRITE_BUFFER = 64 * 1024
+
+# Deltas and lengths are clamped to what fits into their fields
+MAX_DELTA = 2 ** 32 - 1
+MAX_LENGTH = 2 ** 16 - 1
+MAX_MENTIONS = 255
+
+# Events are stored by their index, only append to this list
+EVENTS = [
+    "on_message", "on_message_edit", "on_message_delete", "on_reaction_add",
+    "on_member_join", "on_member_remove", "on_member_update", "on_member_ban", "on_member_unban",
+    "on_guild_join", "on_guild_remove",
+    "on_channel_create", "on_channel_delete", "on_channel_update",
+]
+EVENT_CODES = {name: code for code, name in enumerate(EVENTS)}
+
+# Content classes
+CLASS_NONE = 0      # not a message event
+CLASS_TEXT = 1
+CLASS_COMMAND = 2   # command of one of the plugins (command hash is set)
+CLASS_LINK = 3
+CLASS_INVITE = 4
+CLASS_MENTIONS = 5  # mostly mentions
+CLASS_EMPTY = 6     # no text (attachments, embeds)
+CLASS_BOT = 7       # sent by a bot
+
+CONTENT_CLASSES = {
+    CLASS_NONE: "none",
+    CLASS_TEXT: "text",
+    CLASS_COMMAND: "command",
+    CLASS_LINK: "link",
+    CLASS_INVITE: "invite",
+    CLASS_MENTIONS: "mentions",
+    CLASS_EMPTY: "empty",
+    CLASS_BOT: "bot",
+}
+
+# Prefixes are guessed from the message (custom prefixes are short and not alphanumeric)
+MAX_PREFIX = 5
+
+invite_regex = re.compile(r"(discord\.gg/|discordapp\.com/invite/|discord\.com/invite/)\S+")
+link_regex = re.compile(r"https?://\S+")
+mention_regex = re.compile(r"<@[!&]?\d+>|<#\d+>")
+
+
+def command_hash(command: str) -> int:
+    return zlib.crc32(command.encode())
+
+
+def classify(content: str, router=None) -> tuple:
+    """
+    Returns (content class, command hash) for a message's content.
+    The router (core/router.py) finds plugin commands, the actual prefix isn't known here.
+    """
+    if not content:
+        return CLASS_EMPTY, 0
+
+    if router is not None:
+        prefix_length = 0
+        while prefix_length < min(MAX_PREFIX, len(content)) and not content[prefix_length].isalnum():
+            prefix_length += 1
+
+        found = router.match(content, content[:prefix_length] or None)
+        if found is not None:
+            return CLASS_COMMAND, command_hash(found[0])
+
+    if invite_regex.search(content):
+        return CLASS_INVITE, 0
+    if link_regex.search(content):
+        return CLASS_LINK, 0
+
+    mentions = mention_regex.findall(content)
+    if mentions and sum(len(a) for a in mentions) * 2 >= len(content):
+        return CLASS_MENTIONS, 0
+
+    return CLASS_TEXT, 0
+
+
+class Record:
+    __slots__ = ("event", "delta", "guild", "channel", "user", "length", "content_class", "mentions", "command")
+
+    def __init__(self, event: str, delta: int, guild: int, channel: int, user: int,
+                 length: int, content_class: int, mentions: int, command: int):
+        self.event = event
+        # Microseconds since the previous record
+        self.delta = delta
+
+        # Anonymized ids (0 if the event doesn't have one)
+        self.guild = guild
+        self.channel = channel
+        self.user = user
+
+        self.length = length
+        self.content_class = content_class
+        self.mentions = mentions
+        # command_hash() of the command key, 0 when not a command
+        self.command = command
+
+    def __repr__(self):
+        return "<Record {} +{}us {}>".format(self.event, self.delta, CONTENT_CLASSES.get(self.content_class))
+
+
+class TrafficRecorder:
+    """
+    Appends incoming events to a compact binary file. Ids are hashed with a key that only exists
+    in memory, and message content is reduced to its length and class.
+    Disabled unless [Capture] enabled = true, record() returns right away in that case.
+    """
+    def __init__(self, path: str=None, max_bytes: int=DEFAULT_MAX_MB * 1024 * 1024, router_getter=None):
+        self.path = path
+        self.max_bytes = max_bytes
+        # Called for every message, so plugin reloads get the current router
+        self.router_getter = router_getter
+
+        self.enabled = path is not None
+        self.written = 0
+        self.records = 0
+
+        self._file = None
+        self._last = None
+        self._key = os.urandom(16)
+
+    @classmethod
+    def from_settings(cls, router_getter=None) -> "TrafficRecorder":
+        if not par.getboolean("Capture", "enabled", fallback=False):
+            return cls()
+
+        directory = par.get("Capture", "directory", fallback=None) or DEFAULT_DIRECTORY
+        os.makedirs(directory, exist_ok=True)
+
+        path = os.path.join(directory, "capture-{}.ncap".format(time.strftime("%Y%m%d-%H%M%S")))
+        max_mb = par.getint("Capture", "max_mb", fallback=DEFAULT_MAX_MB)
+
+        log.info("Capturing events to {}".format(path))
+        return cls(path, max_mb * 1024 * 1024, router_getter)
+
+    def _hash(self, snowflake) -> int:
+        if snowflake is None:
+            return 0
+
+        return int.from_bytes(hashlib.blake2b(snowflake.to_bytes(8, "little"), digest_size=8, key=self._key).digest(),
+                              "little")
+
+    def _open(self, now: float):
+        self._file = open(self.path, "wb", buffering=WRITE_BUFFER)
+        self._file.write(HEADER.pack(MAGIC, VERSION, now))
+        self.written = HEADER.size
+
+    def record(self, event: str, *args):
+        if not self.enabled:
+            return
+
+        code = EVENT_CODES.get(event)
+        if code is None:
+            return
+
+        now = time.time()
+        if self._file is None:
+            self._open(now)
+            self._last = now
+
+        delta = min(int((now - self._last) * 1000000), MAX_DELTA)
+        self._last = now
+
+        guild, channel, user, message = _unpack(event, args)
+
+        if message is not None:
+            content = message.content or ""
+            length = min(len(content), MAX_LENGTH)
+            mentions = min(len(message.raw_mentions) + len(message.raw_role_mentions), MAX_MENTIONS)
+
+            if message.author.bot:
+                content_class, command = CLASS_BOT, 0
+            else:
+                router = self.router_getter() if self.router_getter else None
+                content_class, command = classify(content, router)
+        else:
+            length = mentions = command = 0
+            content_class = CLASS_NONE
+
+        self._file.write(RECORD.pack(code, delta, self._hash(guild), self._hash(channel), self._hash(user),
+                                     length, content_class, mentions, command))
+        self.written += RECORD.size
+        self.records += 1
+
+        if self.written >= self.max_bytes:
+            log.warning("Capture reached {} bytes, stopping".format(self.written))
+            self.close()
+
+    def close(self):
+        self.enabled = False
+
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+            log.info("Capture closed: {} events in {}".format(self.records, self.path))
+
+
+def _id(obj):
+    return getattr(obj, "id", None)
+
+
+def _unpack(event: str, args: tuple) -> tuple:
+    """
+    Returns the (guild id, channel id, user id, message) an event is about
+    """
+    first = args[0] if args else None
+
+    if event in ("on_message", "on_message_delete", "on_message_edit"):
+        # on_message_edit(before, after) is stored with the new content
+        message = args[-1]
+        return _id(message.guild), _id(message.channel), _id(message.author), message
+
+    if event == "on_reaction_add":
+        reaction, user = args
+        return _id(reaction.message.guild), _id(reaction.message.channel), _id(user), None
+
+    if event in ("on_member_ban", "on_member_unban"):
+        guild, user = args
+        return _id(guild), None, _id(user), None
+
+    if event.startswith("on_member"):
+        return _id(first.guild), None, _id(first), None
+
+    if event.startswith("on_guild"):
+        return _id(first), None, None, None
+
+    if event.startswith("on_channel"):
+        return _id(getattr(first, "guild", None)), _id(first), None, None
+
+    return None, None, None, None
+
+
+def read_capture(path: str):
+    """
+    Returns (start time, generator of Records) for a capture file
+    """
+    file = open(path, "rb")
+
+    magic, version, started = HEADER.unpack(file.read(HEADER.size))
+    if magic != MAGIC:
+        file.close()
+        raise ValueError("{} is not a capture file".format(path))
+    if version != VERSION:
+        file.close()
+        raise ValueError("unsupported capture version: {}".format(version))
+
+    def records():
+        with file:
+            data = file.read()
+            # The last record may be incomplete if the bot didn't shut down cleanly
+            data = data[:len(data) - len(data) % RECORD.size]
+
+            for values in RECORD.iter_unpack(data):
+                code, *fields = values
+                yield Record(EVENTS[code], *fields)
+
+    return started, records()
@@ -0,0 +1,440 @@
+# coding=utf-8
+import asyncio
+import itertools
+import json
+import logging
+import os
+import signal
+import time
+
+from .confparser import get_settings_parser
+
+__author__ = "DefaltSimon"
+# Multi-process shard clusters: worker info, IPC client and the supervisor (see launcher.py)
+
+log = logging.getLogger(__name__)
+log.setLevel(logging.INFO)
+
+# settings.ini
+par = get_settings_parser()
+
+# CONSTANTS
+
+# Passed to workers by the supervisor
+ENV_CLUSTER_ID = "NANO_CLUSTER_ID"
+ENV_CLUSTERS = "NANO_CLUSTERS"
+ENV_SHARD_IDS = "NANO_SHARD_IDS"
+ENV_SHARD_COUNT = "NANO_SHARD_COUNT"
+ENV_IPC_PORT = "NANO_IPC_PORT"
+ENV_IPC_TOKEN = "NANO_IPC_TOKEN"
+
+IPC_HOST = "127.0.0.1"
+DEFAULT_IPC_PORT = 7010
+# Lines longer than this are rejected (bytes)
+IPC_LINE_LIMIT = 2 ** 20
+
+# Seconds to wait for every cluster to answer a query
+QUERY_TIMEOUT = 5
+RECONNECT_DELAY = 2
+
+# Worker restarts back off exponentially, a worker that stayed up for STABLE_AFTER seconds starts over
+RESTART_BACKOFF_START = 1
+RESTART_BACKOFF_MAX = 60
+STABLE_AFTER = 60
+# Seconds a worker gets to shut down cleanly before it's killed
+STOP_TIMEOUT = 20
+
+# Supervisor actions workers can request
+ACTION_SHUTDOWN = "shutdown"
+ACTION_RESTART = "restart"
+
+
+def shard_ranges(shard_count: int, clusters: int) -> list:
+    """
+    Splits shards into contiguous ranges, one per cluster (earlier clusters get the remainder)
+    """
+    clusters = max(1, min(clusters, shard_count))
+    size, extra = divmod(shard_count, clusters)
+
+    ranges = []
+    start = 0
+    for cluster_id in range(clusters):
+        end = start + size + (1 if cluster_id < extra else 0)
+        ranges.append(list(range(start, end)))
+        start = end
+
+    return ranges
+
+
+def shard_for_guild(guild_id: int, shard_count: int) -> int:
+    # Discord's formula
+    return (int(guild_id) >> 22) % shard_count
+
+
+def _encode(message: dict) -> bytes:
+    return json.dumps(message, separators=(",", ":")).encode() + b"\n"
+
+
+async def _read(reader: asyncio.StreamReader):
+    line = await reader.readline()
+    if not line:
+        return None
+
+    return json.loads(line)
+
+
+class ClusterInfo:
+    """
+    What a worker process is responsible for
+    """
+    __slots__ = ("cluster_id", "clusters", "shard_ids", "shard_count")
+
+    def __init__(self, cluster_id: int, clusters: int, shard_ids: list, shard_count: int):
+        self.cluster_id = cluster_id
+        self.clusters = clusters
+        self.shard_ids = shard_ids
+        self.shard_count = shard_count
+
+    def __repr__(self):
+        return "<ClusterInfo {}/{} shards {}-{} of {}>".format(self.cluster_id, self.clusters, self.shard_ids[0],
+                                                               self.shard_ids[-1], self.shard_count)
+
+    @classmethod
+    def from_environment(cls):
+        """
+        Returns the ClusterInfo the supervisor passed in, None when Nano runs on its own
+        """
+        if ENV_CLUSTER_ID not in os.environ:
+            return None
+
+        return cls(int(os.environ[ENV_CLUSTER_ID]),
+                   int(os.environ[ENV_CLUSTERS]),
+                   [int(a) for a in os.environ[ENV_SHARD_IDS].split(",")],
+                   int(os.environ[ENV_SHARD_COUNT]))
+
+    def owns_guild(self, guild_id: int) -> bool:
+        return shard_for_guild(guild_id, self.shard_count) in self.shard_ids
+
+
+class ClusterClient:
+    """
+    Worker side of the IPC channel. Plugins register named handlers, query() runs one on every cluster
+    (this one included) and returns {cluster id: result}.
+    """
+    def __init__(self, info: ClusterInfo, loop):
+        self.info = info
+        self.loop = loop
+
+        self.port = int(os.environ.get(ENV_IPC_PORT, DEFAULT_IPC_PORT))
+        self.token = os.environ.get(ENV_IPC_TOKEN, "")
+
+        # name: coroutine function taking keyword arguments, returns something json can encode
+        self.handlers = {}
+        # Called when the supervisor asks this worker to stop
+        self.on_stop = None
+
+        self._writer = None
+        self._pending = {}
+        self._ids = itertools.count()
+        self.running = False
+
+    @property
+    def connected(self) -> bool:
+        return self._writer is not None
+
+    def register(self, name: str, handler):
+        self.handlers[name] = handler
+
+    async def _run_handler(self, name: str, args: dict):
+        handler = self.handlers.get(name)
+        if handler is None:
+            return {"error": "no handler for {}".format(name)}
+
+        try:
+            return {"data": await handler(**args)}
+        except Exception as e:
+            log.exception("Cluster query {} failed".format(name))
+            return {"error": "{}: {}".format(type(e).__name__, e)}
+
+    async def _send(self, message: dict):
+        self._writer.write(_encode(message))
+        await self._writer.drain()
+
+    async def _answer(self, request: dict):
+        result = await self._run_handler(request["name"], request.get("args", {}))
+        result.update(op="response", id=request["id"])
+
+        if self.connected:
+            await self._send(result)
+
+    async def run(self):
+        """
+        Background task: stays connected to the supervisor and answers its requests
+        """
+        self.running = True
+
+        while self.running:
+            try:
+                reader, self._writer = await asyncio.open_connection(IPC_HOST, self.port, limit=IPC_LINE_LIMIT)
+                await self._send({"op": "hello", "cluster": self.info.cluster_id, "token": self.token})
+                log.info("Connected to the cluster supervisor as cluster {}".format(self.info.cluster_id))
+
+                while True:
+                    message = await _read(reader)
+                    if message is None:
+                        break
+
+                    op = message.get("op")
+                    if op == "request":
+                        self.loop.create_task(self._answer(message))
+                    elif op == "result":
+                        future = self._pending.pop(message["id"], None)
+                        if future is not None and not future.done():
+                            future.set_result(message["results"])
+                    elif op == "stop" and self.on_stop is not None:
+                        self.loop.create_task(self.on_stop())
+
+            except (OSError, ValueError) as e:
+                log.warning("Cluster IPC connection failed: {}".format(e))
+
+            self._writer = None
+            for future in self._pending.values():
+                if not future.done():
+                    future.set_result(None)
+            self._pending = {}
+
+            await asyncio.sleep(RECONNECT_DELAY)
+
+    async def query(self, name: str, **args) -> dict:
+        """
+        Runs a handler on every cluster. Clusters that fail or time out are missing from the result,
+        without a supervisor only this cluster answers.
+        """
+        results = None
+
+        if self.connected:
+            query_id = next(self._ids)
+            future = self.loop.create_future()
+            self._pending[query_id] = future
+
+            await self._send({"op": "query", "id": query_id, "name": name, "args": args})
+
+            try:
+                results = await asyncio.wait_for(future, QUERY_TIMEOUT + 1)
+            except asyncio.TimeoutError:
+                self._pending.pop(query_id, None)
+
+        if results is None:
+            results = {str(self.info.cluster_id): await self._run_handler(name, args)}
+
+        return {int(cluster_id): result["data"] for cluster_id, result in results.items() if "data" in result}
+
+    async def request(self, action: str):
+        """
+        Asks the supervisor to shut down or restart every cluster
+        """
+        if self.connected:
+            await self._send({"op": "control", "action": action})
+
+
+class Worker:
+    __slots__ = ("cluster_id", "shard_ids", "process", "writer", "started", "restarts", "restarting")
+
+    def __init__(self, cluster_id: int, shard_ids: list):
+        self.cluster_id = cluster_id
+        self.shard_ids = shard_ids
+
+        self.process = None
+        self.writer = None
+        self.started = None
+        self.restarts = 0
+        # Stopped by a restart request, not a crash
+        self.restarting = False
+
+
+class ClusterSupervisor:
+    """
+    Runs one Nano process per shard range, restarts the ones that exit unexpectedly
+    and relays queries between them.
+    """
+    def __init__(self, loop, command: list, shard_count: int, clusters: int, port: int=DEFAULT_IPC_PORT):
+        self.loop = loop
+        self.command = command
+        self.shard_count = shard_count
+        self.port = port
+
+        self.token = os.urandom(16).hex()
+        self.workers = [Worker(cluster_id, shard_ids)
+                        for cluster_id, shard_ids in enumerate(shard_ranges(shard_count, clusters))]
+
+        # query id: {cluster id: future}
+        self._pending = {}
+        self._ids = itertools.count()
+
+        self.stopping = False
+        self._stopped = asyncio.Event()
+
+    def _environment(self, worker: Worker) -> dict:
+        env = dict(os.environ)
+        env.update({
+            ENV_CLUSTER_ID: str(worker.cluster_id),
+            ENV_CLUSTERS: str(len(self.workers)),
+            ENV_SHARD_IDS: ",".join(str(a) for a in worker.shard_ids),
+            ENV_SHARD_COUNT: str(self.shard_count),
+            ENV_IPC_PORT: str(self.port),
+            ENV_IPC_TOKEN: self.token,
+        })
+
+        return env
+
+    async def _keep_alive(self, worker: Worker):
+        backoff = RESTART_BACKOFF_START
+
+        while not self.stopping:
+            worker.process = await asyncio.create_subprocess_exec(*self.command, env=self._environment(worker))
+            worker.started = time.monotonic()
+            log.info("Started cluster {} (pid {}, shards {}-{})".format(
+                worker.cluster_id, worker.process.pid, worker.shard_ids[0], worker.shard_ids[-1]))
+
+            code = await worker.process.wait()
+            worker.writer = None
+            if self.stopping:
+                break
+
+            if worker.restarting:
+                worker.restarting = False
+                log.info("Cluster {} stopped for a restart".format(worker.cluster_id))
+                continue
+
+            if time.monotonic() - worker.started > STABLE_AFTER:
+                backoff = RESTART_BACKOFF_START
+
+            worker.restarts += 1
+            log.warning("Cluster {} exited with code {}, restarting in {}s".format(worker.cluster_id, code, backoff))
+
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, RESTART_BACKOFF_MAX)
+
+    async def _stop_worker(self, worker: Worker):
+        process = worker.process
+        if process is None or process.returncode is not None:
+            return
+
+        # Let the worker save its state first
+        if worker.writer is not None:
+            try:
+                worker.writer.write(_encode({"op": "stop"}))
+                await worker.writer.drain()
+            except OSError:
+                pass
+        else:
+            process.terminate()
+
+        try:
+            await asyncio.wait_for(process.wait(), STOP_TIMEOUT)
+        except asyncio.TimeoutError:
+            log.warning("Cluster {} didn't stop in time, killing it".format(worker.cluster_id))
+            process.kill()
+
+    async def stop(self):
+        self.stopping = True
+        await asyncio.gather(*[self._stop_worker(worker) for worker in self.workers])
+        self._stopped.set()
+
+    async def restart(self):
+        # _keep_alive starts them again
+        for worker in self.workers:
+            worker.restarting = worker.process is not None and worker.process.returncode is None
+            await self._stop_worker(worker)
+
+    async def _fan_out(self, origin: Worker, message: dict):
+        query_id = next(self._ids)
+        futures = {}
+
+        for worker in self.workers:
+            if worker.writer is None:
+                continue
+
+            futures[worker.cluster_id] = self.loop.create_future()
+            worker.writer.write(_encode({"op": "request", "id": query_id, "name": message["name"],
+                                         "args": message.get("args", {})}))
+
+        self._pending[query_id] = futures
+
+        done, _ = await asyncio.wait(futures.values(), timeout=QUERY_TIMEOUT)
+        del self._pending[query_id]
+
+        results = {cluster_id: future.result() for cluster_id, future in futures.items() if future in done}
+
+        if origin.writer is not None:
+            origin.writer.write(_encode({"op": "result", "id": message["id"], "results": results}))
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        worker = None
+        try:
+            hello = await _read(reader)
+            if not hello or hello.get("op") != "hello" or hello.get("token") != self.token:
+                return
+
+            worker = self.workers[int(hello["cluster"])]
+            worker.writer = writer
+
+            while True:
+                message = await _read(reader)
+                if message is None:
+                    break
+
+                op = message.get("op")
+                if op == "query":
+                    self.loop.create_task(self._fan_out(worker, message))
+                elif op == "response":
+                    future = self._pending.get(message["id"], {}).get(worker.cluster_id)
+                    if future is not None and not future.done():
+                        future.set_result(message)
+                elif op == "control":
+                    action = message.get("action")
+                    log.info("Cluster {} requested {}".format(worker.cluster_id, action))
+
+                    if action == ACTION_SHUTDOWN:
+                        self.loop.create_task(self.stop())
+                    elif action == ACTION_RESTART:
+                        self.loop.create_task(self.restart())
+
+        except (OSError, ValueError, KeyError, IndexError) as e:
+            log.warning("IPC connection error: {}".format(e))
+        finally:
+            if worker is not None and worker.writer is writer:
+                worker.writer = None
+            writer.close()
+
+    async def run(self):
+        server = await asyncio.start_server(self._serve, IPC_HOST, self.port, limit=IPC_LINE_LIMIT)
+        log.info("Cluster supervisor listening on {}:{} ({} clusters, {} shards)".format(
+            IPC_HOST, self.port, len(self.workers), self.shard_count))
+
+        if os.name != "nt":
+            for sig in (signal.SIGINT, signal.SIGTERM):
+                self.loop.add_signal_handler(sig, lambda: self.loop.create_task(self.stop()))
+
+        for worker in self.workers:
+            self.loop.create_task(self._keep_alive(worker))
+
+        await self._stopped.wait()
+
+        server.close()
+        await server.wait_closed()
+        log.info("All clusters stopped")
+
+
+def get_cluster_settings() -> tuple:
+    """
+    Returns (clusters, shard count or None for Discord's recommendation, ipc port) from [Cluster]
+    """
+    clusters = par.getint("Cluster", "clusters", fallback=1)
+
+    shard_count = par.get("Cluster", "shard_count", fallback="auto").strip()
+    shard_count = None if shard_count in ("", "auto") else int(shard_count)
+
+    port = par.getint("Cluster", "ipc_port", fallback=DEFAULT_IPC_PORT)
+
+    return clusters, shard_count, port
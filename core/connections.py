@@ -0,0 +1,374 @@
+# coding=utf-8
+import asyncio
+import logging
+import os
+import time
+
+import redis
+
+try:
+    import redis.asyncio as aioredis
+except ImportError:
+    aioredis = None
+
+from .confparser import get_settings_parser
+from .metrics import LatencyRegistry, clock
+from .utils import Singleton
+
+__author__ = "DefaltSimon"
+# Redis connection pools, health checks and per-namespace metrics
+
+log = logging.getLogger(__name__)
+log.setLevel(logging.INFO)
+
+# settings.ini
+par = get_settings_parser()
+
+# CONSTANTS
+
+# Redis instances and their settings.ini sections
+DATA = "data"
+CACHE = "cache"
+
+SECTIONS = {
+    DATA: "Redis",
+    CACHE: "RedisCache",
+}
+
+# Pool sizes, override with max_connections in the instance's section
+DEFAULT_MAX_CONNECTIONS = {
+    DATA: 50,
+    CACHE: 20,
+}
+# Seconds to wait for a free connection when the pool is exhausted (pool_timeout)
+DEFAULT_POOL_TIMEOUT = 5
+
+# Namespace the core handlers are counted under
+CORE_NAMESPACE = "core"
+
+# Health checks (seconds)
+HEALTH_INTERVAL = 15
+PING_TIMEOUT = 3
+BACKOFF_START = 0.5
+BACKOFF_MAX = 30
+
+
+def get_credentials(instance: str=DATA) -> tuple:
+    section = SECTIONS[instance]
+
+    if instance == DATA and par.get(section, "setup", fallback=None) == "environment":
+        return os.environ["REDIS_HOST"], os.environ["REDIS_PORT"], os.environ["REDIS_PASS"]
+
+    # Fallback to defaults
+    redis_ip = par.get(section, "ip", fallback=None) or "127.0.0.1"
+    redis_port = par.get(section, "port", fallback=None) or 6379
+    redis_pass = par.get(section, "password", fallback=None) or None
+
+    return redis_ip, redis_port, redis_pass
+
+
+def _connection_count(pool) -> int:
+    # Not part of redis-py's API, only used for reporting
+    created = getattr(pool, "_connections", None)
+    if created is not None:
+        return len(created)
+
+    return len(getattr(pool, "_available_connections", ())) + len(getattr(pool, "_in_use_connections", ()))
+
+
+class CommandMetrics:
+    """
+    Commands sent and round trip latency for every (namespace, instance) pair.
+    A pipeline is one round trip, but every command in it is counted.
+    """
+    __slots__ = ("latency", "commands")
+
+    def __init__(self):
+        self.latency = LatencyRegistry()
+        # (namespace, instance): amount of commands
+        self.commands = {}
+
+    def record(self, namespace: str, instance: str, elapsed_ns: int, commands: int=1, failed: bool=False):
+        key = (namespace, instance)
+        self.commands[key] = self.commands.get(key, 0) + commands
+
+        self.latency.get(namespace, instance).record(elapsed_ns, failed)
+
+    def busiest(self, amount: int=10) -> list:
+        """
+        Returns a list of (namespace, instance, commands, latency summary) sorted by the amount of commands
+        """
+        items = sorted(self.commands.items(), key=lambda a: a[1], reverse=True)[:amount]
+        return [(namespace, instance, commands, self.latency.get(namespace, instance).to_dict())
+                for (namespace, instance), commands in items]
+
+    def reset(self):
+        self.commands = {}
+        self.latency.reset()
+
+
+class Meter:
+    __slots__ = ("metrics", "namespace", "instance")
+
+    def __init__(self, metrics: CommandMetrics, namespace: str, instance: str):
+        self.metrics = metrics
+        self.namespace = namespace
+        self.instance = instance
+
+    def record(self, elapsed_ns: int, commands: int=1, failed: bool=False):
+        self.metrics.record(self.namespace, self.instance, elapsed_ns, commands, failed)
+
+
+class MeteredPipeline(redis.client.Pipeline):
+    def __init__(self, meter: Meter, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.meter = meter
+
+    def execute(self, raise_on_error=True):
+        commands = len(self.command_stack)
+        failed = True
+        start = clock()
+
+        try:
+            result = super().execute(raise_on_error)
+            failed = False
+            return result
+        finally:
+            if commands:
+                self.meter.record(clock() - start, commands, failed)
+
+
+class MeteredRedis(redis.StrictRedis):
+    """
+    StrictRedis that records every command with its Meter
+    """
+    def __init__(self, meter: Meter, **kwargs):
+        super().__init__(**kwargs)
+        self.meter = meter
+
+    def execute_command(self, *args, **options):
+        failed = True
+        start = clock()
+
+        try:
+            result = super().execute_command(*args, **options)
+            failed = False
+            return result
+        finally:
+            self.meter.record(clock() - start, 1, failed)
+
+    def pipeline(self, transaction=True, shard_hint=None):
+        return MeteredPipeline(self.meter, self.connection_pool, self.response_callbacks, transaction, shard_hint)
+
+
+if aioredis is not None:
+    class MeteredAsyncPipeline(aioredis.client.Pipeline):
+        def __init__(self, meter: Meter, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.meter = meter
+
+        async def execute(self, raise_on_error=True):
+            commands = len(self.command_stack)
+            failed = True
+            start = clock()
+
+            try:
+                result = await super().execute(raise_on_error)
+                failed = False
+                return result
+            finally:
+                if commands:
+                    self.meter.record(clock() - start, commands, failed)
+
+    class MeteredAsyncRedis(aioredis.StrictRedis):
+        """
+        asyncio version of MeteredRedis
+        """
+        def __init__(self, meter: Meter, **kwargs):
+            super().__init__(**kwargs)
+            self.meter = meter
+
+        async def execute_command(self, *args, **options):
+            failed = True
+            start = clock()
+
+            try:
+                result = await super().execute_command(*args, **options)
+                failed = False
+                return result
+            finally:
+                self.meter.record(clock() - start, 1, failed)
+
+        def pipeline(self, transaction=True, shard_hint=None):
+            return MeteredAsyncPipeline(self.meter, self.connection_pool, self.response_callbacks,
+                                        transaction, shard_hint)
+
+
+class ConnectionManager(metaclass=Singleton):
+    """
+    Owns one bounded connection pool per Redis instance (one blocking, one asyncio) and hands out
+    clients that count commands per namespace. Pool sizes come from settings.ini (max_connections, pool_timeout).
+    """
+    def __init__(self):
+        # instance: BlockingConnectionPool
+        self.pools = {}
+        self.async_pools = {}
+
+        self.metrics = CommandMetrics()
+
+        # instance: dict(healthy, failures, latency, last_check, last_error)
+        self.health = {}
+        self.monitoring = False
+
+    def _pool_options(self, instance: str) -> dict:
+        section = SECTIONS[instance]
+        redis_ip, redis_port, redis_pass = get_credentials(instance)
+
+        return {
+            "host": redis_ip,
+            "port": redis_port,
+            "password": redis_pass,
+            "db": 0,
+            "max_connections": par.getint(section, "max_connections", fallback=DEFAULT_MAX_CONNECTIONS[instance]),
+            "timeout": par.getfloat(section, "pool_timeout", fallback=DEFAULT_POOL_TIMEOUT),
+        }
+
+    def get_pool(self, instance: str=DATA):
+        pool = self.pools.get(instance)
+
+        if pool is None:
+            options = self._pool_options(instance)
+            pool = redis.BlockingConnectionPool(**options)
+            self.pools[instance] = pool
+
+            log.info("Created ConnectionPool for {}:{} ({}, max {} connections)".format(
+                options["host"], options["port"], instance, options["max_connections"]))
+
+        return pool
+
+    def get_async_pool(self, instance: str=DATA):
+        if aioredis is None:
+            raise RuntimeError("redis.asyncio is not available, install redis>=4.2")
+
+        pool = self.async_pools.get(instance)
+
+        if pool is None:
+            options = self._pool_options(instance)
+            pool = aioredis.BlockingConnectionPool(**options)
+            self.async_pools[instance] = pool
+
+            log.info("Created asyncio ConnectionPool for {}:{} ({}, max {} connections)".format(
+                options["host"], options["port"], instance, options["max_connections"]))
+
+        return pool
+
+    def client(self, namespace: str=CORE_NAMESPACE, instance: str=DATA) -> MeteredRedis:
+        return MeteredRedis(Meter(self.metrics, namespace, instance), connection_pool=self.get_pool(instance))
+
+    def async_client(self, namespace: str=CORE_NAMESPACE, instance: str=DATA) -> "MeteredAsyncRedis":
+        return MeteredAsyncRedis(Meter(self.metrics, namespace, instance), connection_pool=self.get_async_pool(instance))
+
+    # HEALTH
+    def _mark(self, instance: str, latency: float=None, error: Exception=None):
+        state = self.health.setdefault(instance, {"healthy": True, "failures": 0, "latency": None,
+                                                  "last_check": None, "last_error": None})
+        state["last_check"] = time.time()
+
+        if error is None:
+            if not state["healthy"]:
+                log.info("Redis ({}) is reachable again".format(instance))
+
+            state.update(healthy=True, failures=0, latency=latency)
+        else:
+            state.update(healthy=False, failures=state["failures"] + 1, last_error=str(error))
+
+        return state
+
+    def wait_until_healthy(self, instance: str=DATA):
+        """
+        Blocks until the instance answers a PING, retrying with exponential backoff.
+        Only meant for startup, before the event loop runs.
+        """
+        client = redis.StrictRedis(connection_pool=self.get_pool(instance))
+        backoff = BACKOFF_START
+
+        while True:
+            start = time.monotonic()
+            try:
+                client.ping()
+            except redis.ConnectionError as e:
+                self._mark(instance, error=e)
+
+                log.error("Could not connect to redis ({})! Check settings.ini and your redis server".format(instance))
+                log.error("Retrying in {} sec...".format(backoff))
+
+                # Must be blocking
+                time.sleep(backoff)
+                backoff = min(backoff * 2, BACKOFF_MAX)
+            else:
+                self._mark(instance, latency=time.monotonic() - start)
+                return
+
+    async def ping(self, instance: str=DATA) -> bool:
+        """
+        Pings the instance over the asyncio pool and records the result, never blocks the loop
+        """
+        client = aioredis.StrictRedis(connection_pool=self.get_async_pool(instance))
+        start = time.monotonic()
+
+        try:
+            await asyncio.wait_for(client.ping(), PING_TIMEOUT)
+        except (aioredis.RedisError, asyncio.TimeoutError, OSError) as e:
+            self._mark(instance, error=e)
+            return False
+
+        self._mark(instance, latency=time.monotonic() - start)
+        return True
+
+    async def wait_until_healthy_async(self, instance: str=DATA):
+        backoff = BACKOFF_START
+
+        while not await self.ping(instance):
+            log.error("Could not connect to redis ({})! Check settings.ini and your redis server".format(instance))
+            log.error("Retrying in {} sec...".format(backoff))
+
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, BACKOFF_MAX)
+
+    async def monitor(self, interval: float=HEALTH_INTERVAL):
+        """
+        Background task: pings every instance in use, backing off exponentially while one is down
+        """
+        if self.monitoring:
+            return
+        self.monitoring = True
+
+        backoff = BACKOFF_START
+
+        while self.monitoring:
+            instances = set(self.pools) | set(self.async_pools)
+            results = await asyncio.gather(*[self.ping(instance) for instance in instances])
+
+            if all(results):
+                backoff = BACKOFF_START
+                await asyncio.sleep(interval)
+            else:
+                down = [instance for instance, ok in zip(instances, results) if not ok]
+                log.warning("Redis health check failed for {}, next check in {} sec".format(", ".join(down), backoff))
+
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, BACKOFF_MAX)
+
+    def stop(self):
+        self.monitoring = False
+
+    def get_pool_stats(self) -> dict:
+        stats = {}
+        for flavour, pools in (("blocking", self.pools), ("asyncio", self.async_pools)):
+            for instance, pool in pools.items():
+                stats["{} ({})".format(instance, flavour)] = {
+                    "connections": _connection_count(pool),
+                    "max": pool.max_connections,
+                }
+
+        return stats
@@ -0,0 +1,180 @@
+# coding=utf-8
+import logging
+from inspect import signature, Parameter
+
+__author__ = "DefaltSimon"
+# Event context and dispatch pipeline for Nano
+
+log = logging.getLogger(__name__)
+log.setLevel(logging.INFO)
+
+# CONSTANTS
+
+# Name of the keyword argument that context-aware callbacks accept
+CONTEXT_PARAMETER = "ctx"
+
+# Legacy response commands (see EventContext.apply_response)
+RESP_RETURN = "return"
+RESP_ADD_VAR = "add_var"
+RESP_SHUTDOWN = "shutdown"
+
+# Placeholder for a command owner that hasn't been looked up yet
+UNRESOLVED = object()
+
+
+class EventContext:
+    """
+    Carries state between plugins for a single dispatched event.
+
+    Plugins that accept a "ctx" keyword argument get this object directly and can set
+    its attributes (or set stop to True to stop the event). Other plugins get the set
+    fields as keyword arguments, like before.
+    """
+    __slots__ = ("event", "prefix", "lang", "settings", "stop", "shutdown", "extra", "owner")
+
+    # Fields that are passed to legacy callbacks as keyword arguments
+    typed_fields = ("prefix", "lang", "settings")
+
+    def __init__(self, event: str, extra: dict=None):
+        self.event = event
+
+        self.prefix = None
+        self.lang = None
+        self.settings = None
+
+        self.stop = False
+        self.shutdown = False
+
+        # Anything that doesn't have a typed field
+        self.extra = extra or {}
+
+        # Plugin that owns the command in the message (see core/router.py)
+        self.owner = UNRESOLVED
+
+    def update(self, **fields):
+        for k, v in fields.items():
+            if k in self.typed_fields:
+                setattr(self, k, v)
+            else:
+                self.extra[k] = v
+
+    def as_kwargs(self) -> dict:
+        kwargs = dict(self.extra)
+
+        if self.prefix is not None:
+            kwargs["prefix"] = self.prefix
+        if self.lang is not None:
+            kwargs["lang"] = self.lang
+        if self.settings is not None:
+            kwargs["settings"] = self.settings
+
+        return kwargs
+
+    def apply_response(self, resp):
+        """
+        Compatibility shim for the old string protocol:
+            "return" - stops the event
+            ("add_var", dict) - adds variables to the context
+            "shutdown" - shuts Nano down
+        Multiple commands can be returned in a list.
+        """
+        if type(resp) is not list:
+            resp = (resp, )
+
+        for cmd in resp:
+            # Parse additional variables
+            if type(cmd) in (tuple, list, set):
+                # Unpacks parameters
+                cmd, arguments, *_ = cmd
+            else:
+                arguments = ()
+
+            if cmd == RESP_RETURN:
+                self.stop = True
+                return
+
+            elif cmd == RESP_ADD_VAR:
+                # Arguments must be a dict
+                if type(arguments) is tuple:
+                    arguments = arguments[0]
+
+                self.update(**arguments)
+
+            elif cmd == RESP_SHUTDOWN:
+                self.shutdown = True
+                self.stop = True
+                return
+
+
+class PipelineStage:
+    """
+    A single compiled callback in an event pipeline
+    """
+    __slots__ = ("plugin", "callback", "importance", "routed", "gating", "takes_context", "histogram")
+
+    def __init__(self, plugin: str, callback, importance: int, routed: bool=False, gating: bool=False,
+                 histogram=None):
+        self.plugin = plugin
+        self.callback = callback
+        self.importance = importance
+        self.routed = routed
+        self.gating = gating
+        self.takes_context = accepts_context(callback)
+
+        # LatencyHistogram for this plugin and event (see core/metrics.py)
+        self.histogram = histogram
+
+    def __repr__(self):
+        return "<PipelineStage {}.{} ({}{})>".format(self.plugin, self.callback.__name__,
+                                                    self.importance, ", gating" if self.gating else "")
+
+
+class Pipeline:
+    """
+    Compiled callbacks for one event.
+
+    Gating stages (declared in NanoPlugin.gating) may stop or annotate the event and are awaited
+    one after another. Terminal stages run concurrently once every gating stage has passed.
+    """
+    __slots__ = ("gating", "terminal")
+
+    def __init__(self, gating: tuple=(), terminal: tuple=()):
+        self.gating = gating
+        self.terminal = terminal
+
+    def __bool__(self):
+        return bool(self.gating or self.terminal)
+
+    def __iter__(self):
+        yield from self.gating
+        yield from self.terminal
+
+
+def accepts_context(callback) -> bool:
+    try:
+        param = signature(callback).parameters.get(CONTEXT_PARAMETER)
+    except (TypeError, ValueError):
+        return False
+
+    return param is not None and param.kind in (Parameter.KEYWORD_ONLY, Parameter.POSITIONAL_OR_KEYWORD)
+
+
+def compile_pipelines(stages: list) -> dict:
+    """
+    Orders a list of PipelineStages by importance and groups them by event
+
+    :param stages: list of (event name, PipelineStage)
+    :return: dict of event name: Pipeline
+    """
+    grouped = {}
+    for ev_name, stage in stages:
+        grouped.setdefault(ev_name, []).append(stage)
+
+    pipelines = {}
+    for ev_name, unordered in grouped.items():
+        ordered = sorted(unordered, key=lambda a: a.importance)
+
+        pipelines[ev_name] = Pipeline(tuple(a for a in ordered if a.gating),
+                                      tuple(a for a in ordered if not a.gating))
+
+    return pipelines
@@ -0,0 +1,213 @@
+# coding=utf-8
+import logging
+import time
+
+__author__ = "DefaltSimon"
+# Bounded, expiring in-memory maps for per-user state
+
+log = logging.getLogger(__name__)
+log.setLevel(logging.INFO)
+
+# CONSTANTS
+
+# Seconds covered by one slot of the timing wheel
+DEFAULT_RESOLUTION = 1
+
+
+class ExpiringMap:
+    """
+    Dict-like map whose entries expire `ttl` seconds after they were last read or written
+    (up to one `resolution` later, never earlier), with an optional hard cap on the number of entries.
+
+    Entries live in parallel lists (keys, values, deadlines) and are addressed by slot; freed slots are reused.
+    Expiry uses a timing wheel: every slot is filed under the wheel position of its deadline (in ticks of
+    `resolution` seconds) and each tick only looks at the slots filed under it. Reads and writes only move the
+    deadline, the slot is filed again when its old position comes up, so every operation is O(1) (amortized).
+    When the cap is reached, the entry closest to expiry (the least recently used one, up to one tick) is evicted.
+    """
+    __slots__ = ("ttl", "resolution", "max_size", "clock",
+                 "index", "keys", "values", "deadlines", "filed", "free",
+                 "wheel", "tick", "ttl_ticks",
+                 "expired", "evicted")
+
+    def __init__(self, ttl: float, max_size: int=None, resolution: float=DEFAULT_RESOLUTION, clock=time.monotonic):
+        self.ttl = ttl
+        self.resolution = resolution
+        self.max_size = max_size
+        self.clock = clock
+
+        # key: slot
+        self.index = {}
+        self.keys = []
+        self.values = []
+        # Tick at which the entry expires and the wheel position it is filed under
+        self.deadlines = []
+        self.filed = []
+        self.free = []
+
+        # Ticks from the current one to the deadline. The current tick has partly passed,
+        # so one more is added to make sure entries live for at least ttl seconds.
+        self.ttl_ticks = max(1, int(-(-ttl // resolution))) + 1
+        # One more position than that, so a deadline never wraps around onto the current tick
+        self.wheel = [set() for _ in range(self.ttl_ticks + 1)]
+        self.tick = int(clock() // resolution)
+
+        self.expired = 0
+        self.evicted = 0
+
+    def _advance(self) -> int:
+        """
+        Expires everything whose deadline has passed and returns the current tick
+        """
+        now = int(self.clock() // self.resolution)
+        if now <= self.tick:
+            return self.tick
+
+        # After a full revolution every entry is expired
+        if now - self.tick >= len(self.wheel):
+            self.expired += len(self.index)
+            self.clear()
+            self.tick = now
+            return now
+
+        wheel = self.wheel
+        size = len(wheel)
+        deadlines = self.deadlines
+
+        for tick in range(self.tick + 1, now + 1):
+            position = tick % size
+            bucket = wheel[position]
+            if not bucket:
+                continue
+
+            wheel[position] = set()
+            for slot in bucket:
+                deadline = deadlines[slot]
+                if deadline > tick:
+                    # Touched since it was filed
+                    self._file(slot, deadline % size)
+                else:
+                    self._release(slot)
+                    self.expired += 1
+
+        self.tick = now
+        return now
+
+    def _file(self, slot: int, position: int):
+        self.wheel[position].add(slot)
+        self.filed[slot] = position
+
+    def _release(self, slot: int):
+        del self.index[self.keys[slot]]
+        self.keys[slot] = None
+        self.values[slot] = None
+        self.free.append(slot)
+
+    def _evict(self):
+        """
+        Drops the entry closest to expiry
+        """
+        wheel = self.wheel
+        size = len(wheel)
+        deadlines = self.deadlines
+
+        for tick in range(self.tick + 1, self.tick + size + 1):
+            bucket = wheel[tick % size]
+
+            while bucket:
+                slot = bucket.pop()
+                deadline = deadlines[slot]
+
+                if deadline > tick:
+                    self._file(slot, deadline % size)
+                else:
+                    self._release(slot)
+                    self.evicted += 1
+                    return
+
+    def get(self, key, default=None):
+        tick = self._advance()
+
+        slot = self.index.get(key)
+        if slot is None:
+            return default
+
+        self.deadlines[slot] = tick + self.ttl_ticks
+        return self.values[slot]
+
+    def set(self, key, value):
+        tick = self._advance()
+        deadline = tick + self.ttl_ticks
+
+        slot = self.index.get(key)
+        if slot is not None:
+            self.values[slot] = value
+            self.deadlines[slot] = deadline
+            return
+
+        if self.max_size is not None and len(self.index) >= self.max_size:
+            self._evict()
+
+        if self.free:
+            slot = self.free.pop()
+            self.keys[slot] = key
+            self.values[slot] = value
+            self.deadlines[slot] = deadline
+        else:
+            slot = len(self.keys)
+            self.keys.append(key)
+            self.values.append(value)
+            self.deadlines.append(deadline)
+            self.filed.append(0)
+
+        self.index[key] = slot
+        self._file(slot, deadline % len(self.wheel))
+
+    def pop(self, key, default=None):
+        self._advance()
+
+        slot = self.index.get(key)
+        if slot is None:
+            return default
+
+        value = self.values[slot]
+        self.wheel[self.filed[slot]].discard(slot)
+        self._release(slot)
+        return value
+
+    def clear(self):
+        self.index = {}
+        self.keys = []
+        self.values = []
+        self.deadlines = []
+        self.filed = []
+        self.free = []
+        self.wheel = [set() for _ in range(len(self.wheel))]
+
+    def __getitem__(self, key):
+        value = self.get(key, self)
+        if value is self:
+            raise KeyError(key)
+
+        return value
+
+    def __setitem__(self, key, value):
+        self.set(key, value)
+
+    def __contains__(self, key) -> bool:
+        return self.get(key, self) is not self
+
+    def __len__(self) -> int:
+        self._advance()
+        return len(self.index)
+
+    def get_stats(self) -> dict:
+        self._advance()
+
+        return {
+            "entries": len(self.index),
+            "max_size": self.max_size,
+            "slots": len(self.keys),
+            "expired": self.expired,
+            "evicted": self.evicted,
+        }
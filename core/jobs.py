@@ -0,0 +1,223 @@
+# coding=utf-8
+import asyncio
+import logging
+import os
+import socket
+import time
+
+from redis import RedisError
+
+from .cluster import shard_for_guild
+from .connections import ConnectionManager, DATA
+from .localstore import get_backend, LOCAL_BACKENDS
+
+__author__ = "DefaltSimon"
+# Background jobs that run once per deployment instead of once per process
+
+log = logging.getLogger(__name__)
+log.setLevel(logging.INFO)
+
+# CONSTANTS
+
+# Holds the token of the process running leader jobs
+LEADER_KEY = "jobs:leader"
+# Seconds the lock is held for without a renewal
+LEASE = 30
+RENEW_EVERY = 10
+# Crashed jobs are started again after this many seconds
+RETRY_DELAY = 30
+
+# Runs in a single process: the one holding the leader lock
+SCOPE_LEADER = "leader"
+# Runs in every process, each one only handles items of its own shards (see JobCoordinator.owns)
+SCOPE_PARTITIONED = "partitioned"
+
+# Renew or release the lock only if this process still holds it
+_RENEW = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("pexpire", KEYS[1], ARGV[2])
+end
+return 0
+"""
+_RELEASE = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
+
+
+class Job:
+    __slots__ = ("name", "factory", "scope", "task", "started", "crashes", "last_error")
+
+    def __init__(self, name: str, factory, scope: str):
+        self.name = name
+        # Coroutine function, called without arguments every time the job starts
+        self.factory = factory
+        self.scope = scope
+
+        self.task = None
+        self.started = None
+        self.crashes = 0
+        self.last_error = None
+
+    @property
+    def running(self) -> bool:
+        return self.task is not None and not self.task.done()
+
+
+class JobCoordinator:
+    """
+    Starts the background loops plugins register and makes sure each piece of work happens once,
+    no matter how many processes run (see launcher.py).
+
+    Leader jobs run in the process that holds a Redis lock, which is renewed every RENEW_EVERY seconds
+    and expires LEASE seconds after its holder stops renewing it. Partitioned jobs run everywhere and
+    skip items whose guild (or user) isn't on the process's shards.
+    With the sqlite or memory backend there is only one node, the first cluster (or the only process) leads.
+    """
+    def __init__(self, loop, cluster_info=None):
+        self.loop = loop
+        self.cluster = cluster_info
+
+        # name: Job
+        self.jobs = {}
+
+        self.local = get_backend() in LOCAL_BACKENDS
+        self.redis = None if self.local else ConnectionManager().async_client("jobs", DATA)
+        self.token = "{}:{}:{}".format(socket.gethostname(), os.getpid(), os.urandom(4).hex())
+
+        self.is_leader = False
+        # When the lease runs out unless renewed (monotonic time)
+        self.lease_until = 0
+        self.running = False
+
+    def owns(self, snowflake) -> bool:
+        """
+        Whether items of this guild (or user) are handled by this process
+        """
+        if self.cluster is None or snowflake is None:
+            return True
+
+        return shard_for_guild(snowflake, self.cluster.shard_count) in self.cluster.shard_ids
+
+    def leader(self, name: str, factory):
+        self._register(Job(name, factory, SCOPE_LEADER))
+
+    def partitioned(self, name: str, factory):
+        self._register(Job(name, factory, SCOPE_PARTITIONED))
+
+    def _register(self, job: Job):
+        # Plugin reloads replace their jobs
+        old = self.jobs.get(job.name)
+        if old is not None:
+            self._stop(old)
+
+        self.jobs[job.name] = job
+        if self.running and self._eligible(job):
+            self._start(job)
+
+    def _eligible(self, job: Job) -> bool:
+        return job.scope == SCOPE_PARTITIONED or self.is_leader
+
+    def _start(self, job: Job):
+        job.started = time.time()
+        job.task = self.loop.create_task(self._supervise(job))
+
+    @staticmethod
+    def _stop(job: Job):
+        if job.task is not None:
+            job.task.cancel()
+            job.task = None
+
+    async def _supervise(self, job: Job):
+        while True:
+            try:
+                await job.factory()
+                log.info("Job {} finished".format(job.name))
+                return
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                job.crashes += 1
+                job.last_error = "{}: {}".format(type(e).__name__, e)
+                log.exception("Job {} crashed, restarting in {}s".format(job.name, RETRY_DELAY))
+
+            await asyncio.sleep(RETRY_DELAY)
+
+    def _set_leader(self, leader: bool):
+        if leader == self.is_leader:
+            return
+
+        self.is_leader = leader
+        log.info("{} leader jobs".format("Running" if leader else "Stopped"))
+
+        for job in self.jobs.values():
+            if job.scope != SCOPE_LEADER:
+                continue
+
+            if leader:
+                self._start(job)
+            else:
+                self._stop(job)
+
+    async def _hold_lease(self) -> bool:
+        lease_ms = int(LEASE * 1000)
+
+        if self.is_leader:
+            return bool(await self.redis.eval(_RENEW, 1, LEADER_KEY, self.token, lease_ms))
+
+        return bool(await self.redis.set(LEADER_KEY, self.token, nx=True, px=lease_ms))
+
+    async def run(self):
+        """
+        Background task: starts the jobs and keeps the leader lock
+        """
+        self.running = True
+
+        for job in self.jobs.values():
+            if job.scope == SCOPE_PARTITIONED:
+                self._start(job)
+
+        if self.local:
+            self._set_leader(self.cluster is None or self.cluster.cluster_id == 0)
+            return
+
+        while self.running:
+            started = time.monotonic()
+
+            try:
+                leader = await asyncio.wait_for(self._hold_lease(), RENEW_EVERY)
+                if leader:
+                    self.lease_until = started + LEASE
+            except (RedisError, asyncio.TimeoutError, OSError) as e:
+                log.warning("Could not renew the leader lock: {}".format(e))
+                # Someone else may take over once the lease expires
+                leader = self.is_leader and time.monotonic() < self.lease_until - RENEW_EVERY
+
+            self._set_leader(leader)
+            await asyncio.sleep(RENEW_EVERY)
+
+    async def close(self):
+        self.running = False
+
+        for job in self.jobs.values():
+            self._stop(job)
+
+        if self.is_leader and not self.local:
+            try:
+                await self.redis.eval(_RELEASE, 1, LEADER_KEY, self.token)
+            except (RedisError, OSError):
+                pass
+
+        self.is_leader = False
+
+    def get_stats(self) -> list:
+        return [{
+            "name": job.name,
+            "scope": job.scope,
+            "running": job.running,
+            "started": job.started,
+            "crashes": job.crashes,
+            "last_error": job.last_error,
+        } for job in self.jobs.values()]
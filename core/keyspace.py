@@ -0,0 +1,283 @@
+# coding=utf-8
+import logging
+from hashlib import sha1
+from json import dumps, loads
+
+from .schema import SERVER_SCHEMA
+
+__author__ = "DefaltSimon"
+# Redis key layouts for guild settings
+
+log = logging.getLogger(__name__)
+log.setLevel(logging.INFO)
+
+# CONSTANTS
+
+LAYOUT_LEGACY = "legacy"
+LAYOUT_COMPACT = "compact"
+
+LEGACY_PREFIX = "server:"
+# Compact layout: settings of many guilds share one hash, srv:{guild id % buckets} -> {guild id: record}
+COMPACT_PREFIX = "srv:"
+# ~100 guilds per bucket at 100k guilds keeps buckets under hash-max-listpack-entries (128)
+DEFAULT_BUCKETS = 1024
+# Buckets are only listpack-encoded while every record fits in hash-max-listpack-value bytes
+# (hash-max-ziplist-value before Redis 7). The default of 64 is shorter than any record: even a minimal one
+# is ~80 bytes, typical ones 150-200, so redis.conf has to raise it to at least this (see data/redis.conf.example).
+# Buckets holding a longer record (long welcome or ban messages) turn into hashtables, which still works,
+# but only saves the per-key overhead. utilities/migrate_keyspace.py reports both.
+COMPACT_VALUE_BYTES = 512
+
+# Booleans are packed into the "flags" field of a compact record (never reorder, only append)
+# filterwords/filterspam/filterinvite are the old names from server_defaults
+FLAG_FIELDS = ("wordfilter", "spamfilter", "invitefilter", "sleeping", "filterwords", "filterspam", "filterinvite")
+FLAGS = "flags"
+
+# Field value that removes the field in COMPACT_UPDATE_SCRIPT
+DELETE_VALUE = "\x00"
+
+# KEYS: srv:bucket, server:id  ARGV: guild id
+# Returns the compact record or, for guilds that weren't migrated yet, the legacy hash
+COMPACT_READ_SCRIPT = """
+local raw = redis.call("HGET", KEYS[1], ARGV[1])
+if raw then
+    return raw
+end
+return redis.call("HGETALL", KEYS[2])
+"""
+
+# KEYS: srv:bucket, server:id  ARGV: guild id, field, value, field, value, ...
+# Applies the changes to the compact record. Guilds that still have a legacy hash are
+# migrated first, so calling it without any fields just migrates the guild.
+COMPACT_UPDATE_SCRIPT = """
+local flag_bits = {%(flag_bits)s}
+
+-- Plain arithmetic, flags only has a few bits
+local function set_flag(flags, bit_value, enabled)
+    local is_set = math.floor(flags / bit_value) %% 2 == 1
+    if enabled and not is_set then
+        return flags + bit_value
+    elseif not enabled and is_set then
+        return flags - bit_value
+    end
+    return flags
+end
+
+local record
+local raw = redis.call("HGET", KEYS[1], ARGV[1])
+if raw then
+    record = cjson.decode(raw)
+else
+    local legacy = redis.call("HGETALL", KEYS[2])
+    if #legacy == 0 and #ARGV == 1 then
+        return 0
+    end
+
+    record = {flags = 0}
+    for i = 1, #legacy, 2 do
+        local bit_value = flag_bits[legacy[i]]
+        if bit_value then
+            record.flags = set_flag(record.flags, bit_value, legacy[i + 1] == "True")
+        else
+            record[legacy[i]] = legacy[i + 1]
+        end
+    end
+
+    if #legacy > 0 then
+        redis.call("UNLINK", KEYS[2])
+    end
+end
+
+local changed = 0
+for i = 2, #ARGV, 2 do
+    local field, value = ARGV[i], ARGV[i + 1]
+    local bit_value = flag_bits[field]
+
+    if bit_value then
+        record.flags = set_flag(record.flags, bit_value, value == "True")
+    elseif value == "%(delete)s" then
+        if record[field] ~= nil then
+            changed = changed + 1
+        end
+        record[field] = nil
+    else
+        if record[field] == nil then
+            changed = changed + 1
+        end
+        record[field] = value
+    end
+end
+
+redis.call("HSET", KEYS[1], ARGV[1], cjson.encode(record))
+return changed
+""" % {
+    "flag_bits": ", ".join("{} = {}".format(name, 1 << index) for index, name in enumerate(FLAG_FIELDS)),
+    # Escaped, the script source itself shouldn't contain a NUL byte
+    "delete": "\\0",
+}
+
+# Scripts are sent with EVALSHA, Redis' script cache is keyed by the SHA1 of the source
+COMPACT_READ_SHA = sha1(COMPACT_READ_SCRIPT.encode()).hexdigest()
+COMPACT_UPDATE_SHA = sha1(COMPACT_UPDATE_SCRIPT.encode()).hexdigest()
+# sha: source
+SCRIPTS = {
+    COMPACT_READ_SHA: COMPACT_READ_SCRIPT,
+    COMPACT_UPDATE_SHA: COMPACT_UPDATE_SCRIPT,
+}
+
+
+def with_source(command: tuple) -> tuple:
+    """
+    Turns an EVALSHA command into EVAL with the script's source, for when Redis answers NOSCRIPT
+    (its script cache is emptied on restarts). EVAL caches the script again.
+    """
+    if command[0] != "EVALSHA":
+        return command
+
+    return ("EVAL", SCRIPTS[command[1]], *command[2:])
+
+
+def _flatten(mapping: dict) -> list:
+    # Every value is stored as a string, bools as "True"/"False" like the old redis client did
+    flat = []
+    for k, v in mapping.items():
+        flat.append(k)
+        flat.append(str(v))
+
+    return flat
+
+
+class LegacyLayout:
+    """
+    One hash per guild: server:{id}
+
+    Layouts only build commands (tuples for execute_command), so the blocking and the asyncio
+    handler share them.
+    """
+    __slots__ = ()
+
+    name = LAYOUT_LEGACY
+    compact = False
+    # Sources to SCRIPT LOAD on connect
+    scripts = ()
+
+    @staticmethod
+    def legacy_key(guild_id) -> str:
+        return LEGACY_PREFIX + str(guild_id)
+
+    def settings_key(self, guild_id) -> str:
+        return self.legacy_key(guild_id)
+
+    def read(self, guild_id) -> tuple:
+        return "HGETALL", self.settings_key(guild_id)
+
+    def parse(self, raw) -> dict:
+        if not raw:
+            return {}
+
+        # EVALSHA returns HGETALL as a flat [field, value, ...] list, Schema.hash handles both
+        return SERVER_SCHEMA.hash(raw)
+
+    def update(self, guild_id, mapping: dict) -> tuple:
+        return ("HSET", self.settings_key(guild_id), *_flatten(mapping))
+
+    def delete_fields(self, guild_id, *fields) -> tuple:
+        return ("HDEL", self.settings_key(guild_id), *fields)
+
+    def replace(self, guild_id, mapping: dict) -> list:
+        key = self.settings_key(guild_id)
+        return [("DEL", key), ("HSET", key, *_flatten(mapping))]
+
+    def remove(self, guild_id) -> tuple:
+        return "UNLINK", self.settings_key(guild_id)
+
+
+class CompactLayout(LegacyLayout):
+    """
+    Guild settings live in bucket hashes (srv:{id % buckets}) as compact JSON records
+    with booleans packed into one flags field, which saves the per-key overhead of one hash per guild.
+    Buckets only stay listpack-encoded (and much smaller) if hash-max-listpack-value is raised
+    to COMPACT_VALUE_BYTES, Redis' default of 64 bytes is shorter than any record.
+
+    Guilds that still have a legacy server:{id} hash are read from it and migrated
+    on their first write (see utilities/migrate_keyspace.py for migrating everything).
+    Both scripts are sent with EVALSHA, handlers run them through execute_layout/run_commands
+    (core/serverhandler.py), which fall back to EVAL when Redis doesn't have them cached.
+    """
+    __slots__ = ("buckets", )
+
+    name = LAYOUT_COMPACT
+    compact = True
+    scripts = (COMPACT_READ_SCRIPT, COMPACT_UPDATE_SCRIPT)
+
+    def __init__(self, buckets: int=DEFAULT_BUCKETS):
+        self.buckets = int(buckets)
+
+    def settings_key(self, guild_id) -> str:
+        return COMPACT_PREFIX + str(int(guild_id) % self.buckets)
+
+    def read(self, guild_id) -> tuple:
+        return "EVALSHA", COMPACT_READ_SHA, 2, self.settings_key(guild_id), self.legacy_key(guild_id), str(guild_id)
+
+    def parse(self, raw) -> dict:
+        if not raw:
+            return {}
+
+        # Legacy hash of a guild that wasn't migrated yet
+        if isinstance(raw, (list, dict)):
+            return super().parse(raw)
+
+        record = loads(raw)
+        flags = int(record.pop(FLAGS, 0))
+
+        for index, name in enumerate(FLAG_FIELDS):
+            record[name] = bool(flags & (1 << index))
+
+        return SERVER_SCHEMA.hash(record)
+
+    @staticmethod
+    def encode(mapping: dict) -> str:
+        record = {}
+        flags = 0
+
+        for k, v in mapping.items():
+            if k in FLAG_FIELDS:
+                if str(v) == "True":
+                    flags |= 1 << FLAG_FIELDS.index(k)
+            elif v is not None:
+                record[k] = str(v)
+
+        record[FLAGS] = flags
+        return dumps(record, separators=(",", ":"), ensure_ascii=False)
+
+    def update(self, guild_id, mapping: dict) -> tuple:
+        return ("EVALSHA", COMPACT_UPDATE_SHA, 2, self.settings_key(guild_id), self.legacy_key(guild_id),
+                str(guild_id), *_flatten(mapping))
+
+    def delete_fields(self, guild_id, *fields) -> tuple:
+        flat = []
+        for field in fields:
+            flat.append(field)
+            flat.append(DELETE_VALUE)
+
+        return ("EVALSHA", COMPACT_UPDATE_SHA, 2, self.settings_key(guild_id), self.legacy_key(guild_id),
+                str(guild_id), *flat)
+
+    def migrate(self, guild_id) -> tuple:
+        return self.update(guild_id, {})
+
+    def replace(self, guild_id, mapping: dict) -> list:
+        return [("UNLINK", self.legacy_key(guild_id)),
+                ("HSET", self.settings_key(guild_id), str(guild_id), self.encode(mapping))]
+
+    def remove(self, guild_id) -> tuple:
+        return "HDEL", self.settings_key(guild_id), str(guild_id)
+
+
+def make_layout(name: str=LAYOUT_LEGACY, buckets: int=DEFAULT_BUCKETS) -> LegacyLayout:
+    if name == LAYOUT_COMPACT:
+        return CompactLayout(buckets)
+    elif name in (LAYOUT_LEGACY, None, ""):
+        return LegacyLayout()
+
+    raise ValueError("unknown keyspace layout: {}".format(name))
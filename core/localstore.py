@@ -0,0 +1,874 @@
+# coding=utf-8
+import logging
+import os
+import random
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+from redis.exceptions import DataError, ResponseError
+
+from .confparser import get_settings_parser, DATA_DIR
+from .connections import DATA, CACHE
+
+__author__ = "DefaltSimon"
+# Embedded SQLite storage with the redis-py client interface
+
+log = logging.getLogger(__name__)
+log.setLevel(logging.INFO)
+
+# settings.ini
+par = get_settings_parser()
+
+# CONSTANTS
+
+BACKEND_REDIS = "redis"
+BACKEND_SQLITE = "sqlite"
+# The sqlite backend without files, nothing survives a restart (benchmarks, offline runs)
+BACKEND_MEMORY = "memory"
+LOCAL_BACKENDS = (BACKEND_SQLITE, BACKEND_MEMORY)
+
+MEMORY_PATH = ":memory:"
+
+# [Storage] data_path/cache_path
+DEFAULT_PATHS = {
+    DATA: os.path.join(DATA_DIR, "nano.db"),
+    CACHE: os.path.join(DATA_DIR, "cache.db"),
+}
+
+# Seconds to wait for another process holding the write lock
+BUSY_TIMEOUT = 5
+# Keys returned by one SCAN call when no COUNT is given (same as Redis)
+SCAN_COUNT = 10
+
+PRAGMAS = (
+    # Readers don't block the writer and commits only append to the log
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    # Reads go through a memory map instead of read() calls
+    "PRAGMA mmap_size=268435456",
+    "PRAGMA temp_store=MEMORY",
+)
+
+# Every key has a row in keys, its contents live in the table of its type
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS keys (
+    id INTEGER PRIMARY KEY,
+    key TEXT NOT NULL UNIQUE,
+    type TEXT NOT NULL,
+    expires REAL
+);
+CREATE INDEX IF NOT EXISTS keys_expires ON keys (expires) WHERE expires IS NOT NULL;
+
+CREATE TABLE IF NOT EXISTS strings (key TEXT PRIMARY KEY, value BLOB NOT NULL) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS hashes (
+    key TEXT NOT NULL, field BLOB NOT NULL, value BLOB NOT NULL, PRIMARY KEY (key, field)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS sets (key TEXT NOT NULL, member BLOB NOT NULL, PRIMARY KEY (key, member)) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS lists (
+    key TEXT NOT NULL, position INTEGER NOT NULL, value BLOB NOT NULL, PRIMARY KEY (key, position)
+) WITHOUT ROWID;
+"""
+
+TYPE_TABLES = {
+    "string": "strings",
+    "hash": "hashes",
+    "set": "sets",
+    "list": "lists",
+}
+
+WRONGTYPE = "WRONGTYPE Operation against a key holding the wrong kind of value"
+
+
+def get_backend() -> str:
+    backend = par.get("Storage", "backend", fallback=None) or BACKEND_REDIS
+
+    if backend not in (BACKEND_REDIS, *LOCAL_BACKENDS):
+        raise ValueError("unknown storage backend: {}".format(backend))
+
+    return backend
+
+
+def _key(name) -> str:
+    if isinstance(name, bytes):
+        return name.decode()
+
+    return str(name)
+
+
+def _encode(value) -> bytes:
+    # Same rules as redis-py: bytes, str, int and float only
+    if isinstance(value, bytes):
+        return value
+    if isinstance(value, str):
+        return value.encode()
+    if isinstance(value, int) and not isinstance(value, bool):
+        return str(value).encode()
+    if isinstance(value, float):
+        return repr(value).encode()
+
+    raise DataError("Invalid input of type: '{}'. Convert to a bytes, string, int or float first."
+                    .format(type(value).__name__))
+
+
+def _list_or_args(keys, args) -> list:
+    if isinstance(keys, (list, tuple)):
+        return list(keys) + list(args)
+
+    return [keys, *args]
+
+
+class SQLiteRedis:
+    """
+    The part of the redis-py StrictRedis interface Nano uses, on an embedded SQLite database.
+    Replies have the same types as redis-py's (undecoded bytes), so the handlers and schemas work unchanged.
+
+    Expired keys are removed when they are accessed and on purge_expired().
+    Pub/sub is not supported, publish() reaches no one.
+    """
+    def __init__(self, path: str):
+        self.path = path
+
+        # isolation_level=None: autocommit, transactions are started explicitly
+        self._conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT, isolation_level=None, check_same_thread=False)
+        for pragma in PRAGMAS:
+            self._conn.execute(pragma)
+        self._conn.executescript(SCHEMA)
+
+        self._lock = threading.RLock()
+        self._depth = 0
+
+        self.purge_expired()
+
+    @contextmanager
+    def _transaction(self):
+        with self._lock:
+            # Nested (pipelines): the outermost transaction commits
+            if self._depth:
+                self._depth += 1
+                try:
+                    yield
+                finally:
+                    self._depth -= 1
+                return
+
+            self._conn.execute("BEGIN IMMEDIATE")
+            self._depth = 1
+            try:
+                yield
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            else:
+                self._conn.execute("COMMIT")
+            finally:
+                self._depth = 0
+
+    def _one(self, query: str, args: tuple=()):
+        return self._conn.execute(query, args).fetchone()
+
+    def _all(self, query: str, args: tuple=()) -> list:
+        return self._conn.execute(query, args).fetchall()
+
+    # KEYS
+    def _type(self, key: str):
+        row = self._one("SELECT type, expires FROM keys WHERE key = ?", (key, ))
+        if row is None:
+            return None
+
+        if row[1] is not None and row[1] <= time.time():
+            with self._transaction():
+                self._remove(key, row[0])
+            return None
+
+        return row[0]
+
+    def _check(self, key: str, expected: str) -> bool:
+        """
+        Returns True if the key exists, raises WRONGTYPE if it holds something else
+        """
+        typ = self._type(key)
+        if typ is None:
+            return False
+        if typ != expected:
+            raise ResponseError(WRONGTYPE)
+
+        return True
+
+    def _create(self, key: str, typ: str):
+        # Only call in a transaction
+        if not self._check(key, typ):
+            self._conn.execute("INSERT INTO keys (key, type) VALUES (?, ?)", (key, typ))
+
+    def _remove(self, key: str, typ: str):
+        self._conn.execute("DELETE FROM keys WHERE key = ?", (key, ))
+        self._conn.execute("DELETE FROM {} WHERE key = ?".format(TYPE_TABLES[typ]), (key, ))
+
+    def _remove_if_empty(self, key: str, typ: str):
+        table = TYPE_TABLES[typ]
+        if self._one("SELECT 1 FROM {} WHERE key = ? LIMIT 1".format(table), (key, )) is None:
+            self._conn.execute("DELETE FROM keys WHERE key = ?", (key, ))
+
+    def delete(self, *names) -> int:
+        deleted = 0
+
+        with self._transaction():
+            for name in names:
+                key = _key(name)
+                typ = self._type(key)
+
+                if typ is not None:
+                    self._remove(key, typ)
+                    deleted += 1
+
+        return deleted
+
+    # Freeing memory in the background means nothing here
+    unlink = delete
+
+    def exists(self, *names) -> int:
+        with self._lock:
+            return sum(1 for name in names if self._type(_key(name)) is not None)
+
+    def type(self, name) -> bytes:
+        with self._lock:
+            return (self._type(_key(name)) or "none").encode()
+
+    def expire(self, name, time_) -> bool:
+        key = _key(name)
+
+        with self._transaction():
+            if self._type(key) is None:
+                return False
+
+            self._conn.execute("UPDATE keys SET expires = ? WHERE key = ?", (time.time() + int(time_), key))
+            return True
+
+    def persist(self, name) -> bool:
+        with self._transaction():
+            cursor = self._conn.execute("UPDATE keys SET expires = NULL WHERE key = ? AND expires IS NOT NULL",
+                                        (_key(name), ))
+            return cursor.rowcount > 0
+
+    def ttl(self, name) -> int:
+        key = _key(name)
+
+        with self._lock:
+            if self._type(key) is None:
+                return -2
+
+            expires = self._one("SELECT expires FROM keys WHERE key = ?", (key, ))[0]
+            if expires is None:
+                return -1
+
+            return int(expires - time.time() + 0.5)
+
+    def scan(self, cursor=0, match=None, count=None, **_) -> tuple:
+        """
+        The cursor is the row id of the last returned key, so keys that exist for the whole
+        iteration are returned exactly once (like Redis)
+        """
+        count = count or SCAN_COUNT
+
+        with self._lock:
+            rows = self._all("SELECT id, key FROM keys WHERE id > ? AND key GLOB ? "
+                             "AND (expires IS NULL OR expires > ?) ORDER BY id LIMIT ?",
+                             (int(cursor), _key(match or "*"), time.time(), count))
+
+        if len(rows) < count:
+            return 0, [key.encode() for _, key in rows]
+
+        return rows[-1][0], [key.encode() for _, key in rows]
+
+    def scan_iter(self, match=None, count=None, **_):
+        cursor = "0"
+        while cursor != 0:
+            cursor, keys = self.scan(cursor or 0, match=match, count=count)
+            yield from keys
+
+    def keys(self, pattern="*") -> list:
+        with self._lock:
+            rows = self._all("SELECT key FROM keys WHERE key GLOB ? AND (expires IS NULL OR expires > ?)",
+                             (_key(pattern), time.time()))
+
+        return [key.encode() for key, in rows]
+
+    def dbsize(self) -> int:
+        with self._lock:
+            return self._one("SELECT COUNT(*) FROM keys WHERE expires IS NULL OR expires > ?", (time.time(), ))[0]
+
+    def purge_expired(self) -> int:
+        with self._transaction():
+            expired = self._all("SELECT key, type FROM keys WHERE expires IS NOT NULL AND expires <= ?",
+                                (time.time(), ))
+            for key, typ in expired:
+                self._remove(key, typ)
+
+        return len(expired)
+
+    def flushdb(self) -> bool:
+        with self._transaction():
+            for table in ("keys", *TYPE_TABLES.values()):
+                self._conn.execute("DELETE FROM {}".format(table))
+
+        return True
+
+    # STRINGS
+    def get(self, name):
+        key = _key(name)
+
+        with self._lock:
+            if not self._check(key, "string"):
+                return None
+
+            return self._one("SELECT value FROM strings WHERE key = ?", (key, ))[0]
+
+    def set(self, name, value, ex=None, px=None, nx=False, xx=False, keepttl=False, **_):
+        key = _key(name)
+        value = _encode(value)
+
+        with self._transaction():
+            typ = self._type(key)
+
+            if (nx and typ is not None) or (xx and typ is None):
+                return None
+
+            expires = None
+            if typ is not None:
+                if keepttl:
+                    expires = self._one("SELECT expires FROM keys WHERE key = ?", (key, ))[0]
+                # SET replaces a key of any type
+                self._remove(key, typ)
+
+            if ex is not None:
+                expires = time.time() + int(ex)
+            elif px is not None:
+                expires = time.time() + int(px) / 1000
+
+            self._conn.execute("INSERT INTO keys (key, type, expires) VALUES (?, 'string', ?)", (key, expires))
+            self._conn.execute("INSERT INTO strings (key, value) VALUES (?, ?)", (key, value))
+
+        return True
+
+    # HASHES
+    def hget(self, name, key):
+        name = _key(name)
+
+        with self._lock:
+            if not self._check(name, "hash"):
+                return None
+
+            row = self._one("SELECT value FROM hashes WHERE key = ? AND field = ?", (name, _encode(key)))
+            return row[0] if row else None
+
+    def hmget(self, name, keys, *args) -> list:
+        fields = [_encode(a) for a in _list_or_args(keys, args)]
+        name = _key(name)
+
+        with self._lock:
+            if not self._check(name, "hash"):
+                return [None] * len(fields)
+
+            values = dict(self._all("SELECT field, value FROM hashes WHERE key = ? AND field IN ({})"
+                                    .format(",".join("?" * len(fields))), (name, *fields)))
+
+        return [values.get(field) for field in fields]
+
+    def hgetall(self, name) -> dict:
+        name = _key(name)
+
+        with self._lock:
+            if not self._check(name, "hash"):
+                return {}
+
+            return dict(self._all("SELECT field, value FROM hashes WHERE key = ?", (name, )))
+
+    def hkeys(self, name) -> list:
+        name = _key(name)
+
+        with self._lock:
+            if not self._check(name, "hash"):
+                return []
+
+            return [field for field, in self._all("SELECT field FROM hashes WHERE key = ?", (name, ))]
+
+    def hvals(self, name) -> list:
+        return list(self.hgetall(name).values())
+
+    def hlen(self, name) -> int:
+        name = _key(name)
+
+        with self._lock:
+            if not self._check(name, "hash"):
+                return 0
+
+            return self._one("SELECT COUNT(*) FROM hashes WHERE key = ?", (name, ))[0]
+
+    def hexists(self, name, key) -> bool:
+        return self.hget(name, key) is not None
+
+    def hset(self, name, key=None, value=None, mapping=None, items=None) -> int:
+        pairs = []
+        if key is not None:
+            pairs.append((key, value))
+        if items:
+            pairs.extend(zip(items[::2], items[1::2]))
+        if mapping:
+            pairs.extend(mapping.items())
+
+        if not pairs:
+            raise DataError("'hset' with no key value pairs")
+
+        name = _key(name)
+        pairs = [(_encode(k), _encode(v)) for k, v in pairs]
+
+        with self._transaction():
+            self._create(name, "hash")
+
+            added = 0
+            for field, field_value in pairs:
+                cursor = self._conn.execute("UPDATE hashes SET value = ? WHERE key = ? AND field = ?",
+                                            (field_value, name, field))
+                if not cursor.rowcount:
+                    self._conn.execute("INSERT INTO hashes (key, field, value) VALUES (?, ?, ?)",
+                                       (name, field, field_value))
+                    added += 1
+
+        return added
+
+    def hmset(self, name, mapping: dict) -> bool:
+        self.hset(name, mapping=mapping)
+        return True
+
+    def hdel(self, name, *keys) -> int:
+        name = _key(name)
+
+        with self._transaction():
+            if not self._check(name, "hash"):
+                return 0
+
+            deleted = 0
+            for field in keys:
+                deleted += self._conn.execute("DELETE FROM hashes WHERE key = ? AND field = ?",
+                                              (name, _encode(field))).rowcount
+
+            self._remove_if_empty(name, "hash")
+
+        return deleted
+
+    def hincrby(self, name, key, amount=1) -> int:
+        with self._transaction():
+            try:
+                value = int(self.hget(name, key) or 0) + int(amount)
+            except ValueError:
+                raise ResponseError("ERR hash value is not an integer")
+
+            self.hset(name, key, value)
+
+        return value
+
+    # SETS
+    def sadd(self, name, *values) -> int:
+        name = _key(name)
+
+        with self._transaction():
+            self._create(name, "set")
+
+            added = 0
+            for value in values:
+                added += self._conn.execute("INSERT OR IGNORE INTO sets (key, member) VALUES (?, ?)",
+                                            (name, _encode(value))).rowcount
+
+        return added
+
+    def srem(self, name, *values) -> int:
+        name = _key(name)
+
+        with self._transaction():
+            if not self._check(name, "set"):
+                return 0
+
+            removed = 0
+            for value in values:
+                removed += self._conn.execute("DELETE FROM sets WHERE key = ? AND member = ?",
+                                              (name, _encode(value))).rowcount
+
+            self._remove_if_empty(name, "set")
+
+        return removed
+
+    def smembers(self, name) -> set:
+        name = _key(name)
+
+        with self._lock:
+            if not self._check(name, "set"):
+                return set()
+
+            return {member for member, in self._all("SELECT member FROM sets WHERE key = ?", (name, ))}
+
+    def sismember(self, name, value) -> int:
+        name = _key(name)
+
+        with self._lock:
+            if not self._check(name, "set"):
+                return 0
+
+            return int(self._one("SELECT 1 FROM sets WHERE key = ? AND member = ?", (name, _encode(value))) is not None)
+
+    def scard(self, name) -> int:
+        name = _key(name)
+
+        with self._lock:
+            if not self._check(name, "set"):
+                return 0
+
+            return self._one("SELECT COUNT(*) FROM sets WHERE key = ?", (name, ))[0]
+
+    def srandmember(self, name, number=None):
+        members = list(self.smembers(name))
+
+        if number is None:
+            return random.choice(members) if members else None
+
+        number = int(number)
+        if number >= 0:
+            return random.sample(members, min(number, len(members)))
+
+        # Negative counts may repeat members
+        return [random.choice(members) for _ in range(-number)] if members else []
+
+    def sscan(self, name, cursor=0, match=None, count=None) -> tuple:
+        # The cursor is an offset, members are ordered
+        name = _key(name)
+        count = count or SCAN_COUNT
+        cursor = int(cursor)
+
+        with self._lock:
+            if not self._check(name, "set"):
+                return 0, []
+
+            rows = self._all("SELECT member FROM sets WHERE key = ? ORDER BY member LIMIT ? OFFSET ?",
+                             (name, count, cursor))
+
+        members = [member for member, in rows]
+        if match is not None:
+            pattern = _key(match)
+            members = [a for a in members if self._glob(a, pattern)]
+
+        return (0 if len(rows) < count else cursor + len(rows)), members
+
+    def sscan_iter(self, name, match=None, count=None):
+        cursor = "0"
+        while cursor != 0:
+            cursor, members = self.sscan(name, cursor or 0, match=match, count=count)
+            yield from members
+
+    def _glob(self, value: bytes, pattern: str) -> bool:
+        return self._one("SELECT ? GLOB ?", (value.decode(errors="replace"), pattern))[0] == 1
+
+    # LISTS
+    def _push(self, name, values, head: bool) -> int:
+        name = _key(name)
+
+        with self._transaction():
+            self._create(name, "list")
+
+            edge = self._one("SELECT {}(position) FROM lists WHERE key = ?".format("MIN" if head else "MAX"),
+                             (name, ))[0]
+            position = edge if edge is not None else 0
+
+            for value in values:
+                position = position - 1 if head else position + 1
+                self._conn.execute("INSERT INTO lists (key, position, value) VALUES (?, ?, ?)",
+                                   (name, position, _encode(value)))
+
+            return self._one("SELECT COUNT(*) FROM lists WHERE key = ?", (name, ))[0]
+
+    def lpush(self, name, *values) -> int:
+        return self._push(name, values, head=True)
+
+    def rpush(self, name, *values) -> int:
+        return self._push(name, values, head=False)
+
+    def llen(self, name) -> int:
+        name = _key(name)
+
+        with self._lock:
+            if not self._check(name, "list"):
+                return 0
+
+            return self._one("SELECT COUNT(*) FROM lists WHERE key = ?", (name, ))[0]
+
+    def lrange(self, name, start, end) -> list:
+        name = _key(name)
+        start, end = int(start), int(end)
+
+        with self._lock:
+            if not self._check(name, "list"):
+                return []
+
+            length = self._one("SELECT COUNT(*) FROM lists WHERE key = ?", (name, ))[0]
+
+            # Redis indexes: negative counts from the end, end is inclusive
+            if start < 0:
+                start = max(length + start, 0)
+            if end < 0:
+                end = length + end
+            end = min(end, length - 1)
+
+            if start > end:
+                return []
+
+            rows = self._all("SELECT value FROM lists WHERE key = ? ORDER BY position LIMIT ? OFFSET ?",
+                             (name, end - start + 1, start))
+
+        return [value for value, in rows]
+
+    def lrem(self, name, count, value) -> int:
+        name = _key(name)
+        count = int(count)
+
+        with self._transaction():
+            if not self._check(name, "list"):
+                return 0
+
+            order = "DESC" if count < 0 else "ASC"
+            limit = abs(count) or -1
+
+            positions = self._all("SELECT position FROM lists WHERE key = ? AND value = ? ORDER BY position {} LIMIT ?"
+                                  .format(order), (name, _encode(value), limit))
+            for position, in positions:
+                self._conn.execute("DELETE FROM lists WHERE key = ? AND position = ?", (name, position))
+
+            self._remove_if_empty(name, "list")
+
+        return len(positions)
+
+    def _pop(self, name, head: bool):
+        name = _key(name)
+
+        with self._transaction():
+            if not self._check(name, "list"):
+                return None
+
+            position, value = self._one("SELECT position, value FROM lists WHERE key = ? ORDER BY position {} LIMIT 1"
+                                        .format("ASC" if head else "DESC"), (name, ))
+            self._conn.execute("DELETE FROM lists WHERE key = ? AND position = ?", (name, position))
+            self._remove_if_empty(name, "list")
+
+        return value
+
+    def lpop(self, name):
+        return self._pop(name, head=True)
+
+    def rpop(self, name):
+        return self._pop(name, head=False)
+
+    # SERVER
+    def ping(self) -> bool:
+        return True
+
+    def publish(self, channel, message) -> int:
+        # No subscribers, every process has its own caches
+        return 0
+
+    def bgsave(self) -> bool:
+        # Moves the write-ahead log into the database file
+        with self._lock:
+            self._conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+        return True
+
+    def info(self, section=None) -> dict:
+        size = os.path.getsize(self.path) if os.path.isfile(self.path) else 0
+
+        return {
+            "backend": BACKEND_SQLITE,
+            "sqlite_version": sqlite3.sqlite_version,
+            "path": self.path,
+            "keys": self.dbsize(),
+            "used_memory": size,
+            "used_memory_human": "{:.2f}M".format(size / 1024 / 1024),
+        }
+
+    def pipeline(self, transaction=True, shard_hint=None) -> "SQLitePipeline":
+        return SQLitePipeline(self)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    # Commands by name, for execute_command and pipelines
+    def execute_command(self, *args, **options):
+        command = _key(args[0]).upper()
+        args = args[1:]
+
+        if command == "HSET":
+            return self.hset(args[0], items=list(args[1:]))
+        if command == "SET":
+            return self._set_command(*args)
+
+        method = COMMANDS.get(command)
+        if method is None:
+            raise ResponseError("ERR unknown command '{}' (not supported by the sqlite backend)".format(command))
+
+        return method(self, *args)
+
+    def _set_command(self, name, value, *options):
+        options = [_key(a).upper() for a in options]
+        kwargs = {"nx": "NX" in options, "xx": "XX" in options, "keepttl": "KEEPTTL" in options}
+
+        if "EX" in options:
+            kwargs["ex"] = options[options.index("EX") + 1]
+        if "PX" in options:
+            kwargs["px"] = options[options.index("PX") + 1]
+
+        return self.set(name, value, **kwargs)
+
+
+# Commands whose arguments are in the same order as the method's
+COMMANDS = {
+    "GET": SQLiteRedis.get,
+    "DEL": SQLiteRedis.delete,
+    "UNLINK": SQLiteRedis.unlink,
+    "EXISTS": SQLiteRedis.exists,
+    "TYPE": SQLiteRedis.type,
+    "EXPIRE": SQLiteRedis.expire,
+    "TTL": SQLiteRedis.ttl,
+    "PERSIST": SQLiteRedis.persist,
+    "DBSIZE": SQLiteRedis.dbsize,
+    "HGET": SQLiteRedis.hget,
+    "HMGET": SQLiteRedis.hmget,
+    "HGETALL": SQLiteRedis.hgetall,
+    "HKEYS": SQLiteRedis.hkeys,
+    "HVALS": SQLiteRedis.hvals,
+    "HLEN": SQLiteRedis.hlen,
+    "HEXISTS": SQLiteRedis.hexists,
+    "HDEL": SQLiteRedis.hdel,
+    "HINCRBY": SQLiteRedis.hincrby,
+    "SADD": SQLiteRedis.sadd,
+    "SREM": SQLiteRedis.srem,
+    "SMEMBERS": SQLiteRedis.smembers,
+    "SISMEMBER": SQLiteRedis.sismember,
+    "SCARD": SQLiteRedis.scard,
+    "SRANDMEMBER": SQLiteRedis.srandmember,
+    "LPUSH": SQLiteRedis.lpush,
+    "RPUSH": SQLiteRedis.rpush,
+    "LLEN": SQLiteRedis.llen,
+    "LRANGE": SQLiteRedis.lrange,
+    "LREM": SQLiteRedis.lrem,
+    "LPOP": SQLiteRedis.lpop,
+    "RPOP": SQLiteRedis.rpop,
+    "PING": SQLiteRedis.ping,
+    "PUBLISH": SQLiteRedis.publish,
+}
+
+
+class SQLitePipeline:
+    """
+    Queues commands and runs them in one transaction on execute()
+    """
+    def __init__(self, store: SQLiteRedis):
+        self.store = store
+        self.command_stack = []
+
+    def __getattr__(self, name):
+        method = getattr(self.store, name)
+
+        def queue(*args, **kwargs):
+            self.command_stack.append((method, args, kwargs))
+            return self
+
+        return queue
+
+    def __len__(self):
+        return len(self.command_stack)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.reset()
+
+    def execute_command(self, *args, **options):
+        self.command_stack.append((self.store.execute_command, args, options))
+        return self
+
+    def execute(self, raise_on_error=True) -> list:
+        stack, self.command_stack = self.command_stack, []
+
+        results = []
+        with self.store._transaction():
+            for method, args, kwargs in stack:
+                try:
+                    results.append(method(*args, **kwargs))
+                except ResponseError as e:
+                    if raise_on_error:
+                        raise
+                    results.append(e)
+
+        return results
+
+    def reset(self):
+        self.command_stack = []
+
+
+class AsyncSQLitePipeline(SQLitePipeline):
+    async def execute(self, raise_on_error=True) -> list:
+        return super().execute(raise_on_error)
+
+
+class AsyncSQLiteRedis:
+    """
+    asyncio interface for SQLiteRedis. Commands run inline, they take microseconds.
+    """
+    def __init__(self, store: SQLiteRedis):
+        self.store = store
+
+    def __getattr__(self, name):
+        method = getattr(self.store, name)
+
+        async def command(*args, **kwargs):
+            return method(*args, **kwargs)
+
+        # Only build the wrapper once
+        setattr(self, name, command)
+        return command
+
+    def pipeline(self, transaction=True, shard_hint=None) -> AsyncSQLitePipeline:
+        return AsyncSQLitePipeline(self.store)
+
+    async def scan_iter(self, match=None, count=None, **_):
+        for key in self.store.scan_iter(match=match, count=count):
+            yield key
+
+    async def sscan_iter(self, name, match=None, count=None):
+        for member in self.store.sscan_iter(name, match=match, count=count):
+            yield member
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def open_store(instance: str=DATA) -> SQLiteRedis:
+    """
+    Returns the process-wide SQLiteRedis for an instance (data or cache), opening it on first use
+    """
+    with _stores_lock:
+        store = _stores.get(instance)
+
+        if store is None:
+            if get_backend() == BACKEND_MEMORY:
+                path = MEMORY_PATH
+            else:
+                option = "{}_path".format(instance)
+                path = par.get("Storage", option, fallback=None) or DEFAULT_PATHS[instance]
+
+            store = SQLiteRedis(path)
+            _stores[instance] = store
+
+            log.info("Opened sqlite {} store at {}".format(instance, path))
+
+        return store
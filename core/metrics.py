@@ -0,0 +1,165 @@
+# coding=utf-8
+import logging
+import time
+
+__author__ = "DefaltSimon"
+# Latency metrics for Nano
+
+log = logging.getLogger(__name__)
+log.setLevel(logging.INFO)
+
+# CONSTANTS
+
+# Every power of two is split into 2 ** SUB_BUCKET_BITS buckets (~12% precision, like HDR histograms)
+SUB_BUCKET_BITS = 3
+SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+# Values are recorded in microseconds, 2 ** 36 us is about 19 hours
+MAX_SHIFT = 36
+
+BUCKET_COUNT = (MAX_SHIFT + 2) * SUB_BUCKETS
+
+# Nanosecond clock, re-exported so the dispatcher reads the same one
+# (time.perf_counter_ns only exists on Python 3.7+)
+if hasattr(time, "perf_counter_ns"):
+    clock = time.perf_counter_ns
+else:
+    def clock() -> int:
+        return int(time.perf_counter() * 1e9)
+
+
+def bucket_index(value: int) -> int:
+    """
+    Returns the bucket for a value (in microseconds)
+    Values under 2 * SUB_BUCKETS get their own bucket, after that buckets grow exponentially.
+    """
+    shift = value.bit_length() - (SUB_BUCKET_BITS + 1)
+    if shift <= 0:
+        return value
+
+    return min(shift * SUB_BUCKETS + (value >> shift), BUCKET_COUNT - 1)
+
+
+def bucket_bounds(index: int) -> tuple:
+    """
+    Returns the (lowest, highest) value that ends up in the bucket
+    """
+    shift = max(0, index // SUB_BUCKETS - 1)
+    low = (index - shift * SUB_BUCKETS) << shift
+
+    return low, low + (1 << shift) - 1
+
+
+class LatencyHistogram:
+    """
+    Log-bucketed latency histogram. Buckets are allocated once, recording is a few integer operations.
+    """
+    __slots__ = ("buckets", "calls", "errors", "total", "max")
+
+    def __init__(self):
+        self.buckets = [0] * BUCKET_COUNT
+
+        self.calls = 0
+        self.errors = 0
+        self.total = 0
+        self.max = 0
+
+    def record(self, elapsed_ns: int, failed: bool=False):
+        value = elapsed_ns // 1000
+
+        self.buckets[bucket_index(value)] += 1
+        self.calls += 1
+        self.total += value
+
+        if value > self.max:
+            self.max = value
+        if failed:
+            self.errors += 1
+
+    def reset(self):
+        self.buckets = [0] * BUCKET_COUNT
+
+        self.calls = 0
+        self.errors = 0
+        self.total = 0
+        self.max = 0
+
+    def percentile(self, percent: float) -> int:
+        """
+        Returns the upper bound of the bucket that contains the percentile (in microseconds)
+        """
+        if not self.calls:
+            return 0
+
+        # Rank of the wanted sample (1-based)
+        rank = max(1, int(self.calls * percent / 100 + 0.5))
+
+        seen = 0
+        for index, count in enumerate(self.buckets):
+            seen += count
+
+            if seen >= rank:
+                return min(bucket_bounds(index)[1], self.max)
+
+        return self.max
+
+    def mean(self) -> float:
+        return self.total / self.calls if self.calls else 0
+
+    def to_dict(self) -> dict:
+        """
+        Summary in microseconds
+        """
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "mean": round(self.mean(), 1),
+            "p50": self.percentile(50),
+            "p95": self.percentile(95),
+            "p99": self.percentile(99),
+            "max": self.max,
+        }
+
+
+class LatencyRegistry:
+    """
+    Holds a LatencyHistogram for every (plugin, event) pair
+    Histograms survive plugin reloads, so the numbers keep adding up.
+    """
+    __slots__ = ("histograms", )
+
+    def __init__(self):
+        self.histograms = {}
+
+    def get(self, plugin: str, event: str) -> LatencyHistogram:
+        key = (plugin, event)
+
+        hist = self.histograms.get(key)
+        if hist is None:
+            hist = LatencyHistogram()
+            self.histograms[key] = hist
+
+        return hist
+
+    def reset(self):
+        for hist in self.histograms.values():
+            hist.reset()
+
+    def to_dict(self) -> dict:
+        """
+        Machine-readable dump: {plugin: {event: summary}}
+        """
+        dump = {}
+        for (plugin, event), hist in self.histograms.items():
+            dump.setdefault(plugin, {})[event] = hist.to_dict()
+
+        return dump
+
+    def slowest(self, amount: int=10, key: str="p99") -> list:
+        """
+        Returns a list of (plugin, event, summary) sorted by the given summary key
+        """
+        summaries = [(plugin, event, hist.to_dict()) for (plugin, event), hist in self.histograms.items()
+                     if hist.calls]
+        summaries.sort(key=lambda a: a[2][key], reverse=True)
+
+        return summaries[:amount]
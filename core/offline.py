@@ -0,0 +1,355 @@
+# coding=utf-8
+import inspect
+import itertools
+import logging
+from collections import deque
+from datetime import datetime
+
+import discord
+
+from .confparser import get_settings_parser
+
+__author__ = "DefaltSimon"
+# Offline stand-ins for discord objects (utilities/bench_plugins.py, utilities/replay_capture.py)
+
+log = logging.getLogger(__name__)
+log.setLevel(logging.INFO)
+
+# settings.ini
+par = get_settings_parser()
+
+# CONSTANTS
+
+# Bot owner and dev server when settings.ini leaves them empty
+OWNER_ID = 1
+
+# Ids handed out to stand-ins
+FIRST_ID = 10 ** 15
+# Messages the outbox keeps for inspection (all are counted)
+OUTBOX_SIZE = 200
+
+_CACHED = getattr(discord.utils, "CachedSlotProperty", ())
+_ids = itertools.count(FIRST_ID)
+
+
+def next_id() -> int:
+    return next(_ids)
+
+
+def _offline(cls):
+    """
+    Replaces the properties and slots discord.py declares with plain class attributes,
+    so stand-ins can set them directly instead of going through a ConnectionState
+    """
+    for base in cls.__mro__[1:]:
+        for name, value in vars(base).items():
+            if name.startswith("__") or name in vars(cls):
+                continue
+
+            if inspect.isdatadescriptor(value) or isinstance(value, _CACHED):
+                setattr(cls, name, None)
+
+    return cls
+
+
+class Outbox:
+    """
+    Everything the stand-ins would have sent to Discord
+    """
+    __slots__ = ("count", "reactions", "deleted", "messages")
+
+    def __init__(self):
+        self.count = 0
+        self.reactions = 0
+        self.deleted = 0
+        self.messages = deque(maxlen=OUTBOX_SIZE)
+
+    def record(self, message: "OfflineMessage"):
+        self.count += 1
+        self.messages.append(message)
+
+    def reset(self):
+        self.__init__()
+
+
+outbox = Outbox()
+
+
+@_offline
+class OfflineRole(discord.Role):
+    def __init__(self, name: str, guild: "OfflineGuild", role_id: int=None, position: int=0):
+        self.id = role_id or next_id()
+        self.name = name
+        self.guild = guild
+        self.position = position
+
+        self.mention = "<@&{}>".format(self.id)
+        self.permissions = discord.Permissions.none()
+        self.colour = self.color = discord.Colour.default()
+        self.hoist = self.managed = self.mentionable = False
+
+
+@_offline
+class OfflineMember(discord.Member):
+    def __init__(self, name: str, guild: "OfflineGuild", member_id: int=None, roles: list=None,
+                 bot: bool=False, admin: bool=False):
+        self.id = member_id or next_id()
+        self.name = self.display_name = name
+        self.nick = None
+        self.discriminator = "0001"
+        self.bot = bot
+        self.system = False
+
+        self.guild = guild
+        self.roles = [guild.default_role] + (roles or [])
+        self.top_role = self.roles[-1]
+        self.guild_permissions = discord.Permissions.all() if admin else discord.Permissions.none()
+
+        self.mention = "<@{}>".format(self.id)
+        self.avatar = None
+        self.avatar_url = self.default_avatar_url = ""
+        self.created_at = self.joined_at = datetime.utcnow()
+        self.status = discord.Status.online
+        self.activity = None
+        self.activities = ()
+        self.voice = None
+
+    async def add_roles(self, *roles, **_):
+        self.roles.extend(role for role in roles if role not in self.roles)
+
+    async def remove_roles(self, *roles, **_):
+        self.roles = [role for role in self.roles if role not in roles]
+
+    async def send(self, content=None, **kwargs):
+        return _send(self, content, **kwargs)
+
+
+@_offline
+class OfflineClientUser(discord.ClientUser):
+    def __init__(self, name: str, user_id: int=None):
+        self.id = user_id or next_id()
+        self.name = self.display_name = name
+        self.discriminator = "0001"
+        self.bot = True
+        self.system = False
+
+        self.mention = "<@{}>".format(self.id)
+        self.avatar = None
+        self.avatar_url = self.default_avatar_url = ""
+        self.created_at = datetime.utcnow()
+
+
+@_offline
+class OfflineTextChannel(discord.TextChannel):
+    def __init__(self, name: str, guild: "OfflineGuild", channel_id: int=None, position: int=0):
+        self.id = channel_id or next_id()
+        self.name = name
+        self.guild = guild
+        self.position = position
+
+        self.mention = "<#{}>".format(self.id)
+        self.topic = None
+        self.nsfw = False
+        self.category = self.category_id = None
+        self.slowmode_delay = 0
+        self.created_at = datetime.utcnow()
+
+    def permissions_for(self, member):
+        return member.guild_permissions
+
+    async def send(self, content=None, **kwargs):
+        return _send(self, content, **kwargs)
+
+    async def trigger_typing(self):
+        pass
+
+    async def purge(self, **_):
+        return []
+
+
+@_offline
+class OfflineGuild(discord.Guild):
+    """
+    A guild with roles, text channels and members that only exist in this process.
+    The bot itself is a member (guild.me).
+    """
+    def __init__(self, name: str, guild_id: int=None, bot_user: OfflineClientUser=None):
+        self.id = guild_id or next_id()
+        self.name = name
+        self.shard_id = 0
+        self.unavailable = False
+
+        self.icon = None
+        self.icon_url = ""
+        self.created_at = datetime.utcnow()
+        self.verification_level = discord.VerificationLevel.none
+        # "europe" only exists in newer discord.py versions
+        self.region = getattr(discord.VoiceRegion, "europe", discord.VoiceRegion.eu_west)
+
+        self.default_role = OfflineRole("@everyone", self, role_id=self.id)
+        self.roles = [self.default_role]
+        self.channels = self.text_channels = []
+        self.voice_channels = []
+        self.categories = []
+        self.members = []
+        self.member_count = 0
+        self.emojis = ()
+
+        bot_user = bot_user or OfflineClientUser("Nano")
+        self.me = self.add_member(bot_user.name, member_id=bot_user.id, bot=True)
+        self.owner = self.add_member("owner")
+        self.owner_id = self.owner.id
+
+    def add_role(self, name: str, **kwargs) -> OfflineRole:
+        role = OfflineRole(name, self, position=len(self.roles), **kwargs)
+        self.roles.append(role)
+
+        return role
+
+    def add_channel(self, name: str, **kwargs) -> OfflineTextChannel:
+        channel = OfflineTextChannel(name, self, position=len(self.channels), **kwargs)
+        self.channels.append(channel)
+
+        return channel
+
+    def add_member(self, name: str, **kwargs) -> OfflineMember:
+        member = OfflineMember(name, self, **kwargs)
+        self.members.append(member)
+        self.member_count = len(self.members)
+
+        return member
+
+    def get_member(self, user_id: int):
+        return discord.utils.get(self.members, id=user_id)
+
+    def get_channel(self, channel_id: int):
+        return discord.utils.get(self.channels, id=channel_id)
+
+    def get_role(self, role_id: int):
+        return discord.utils.get(self.roles, id=role_id)
+
+    async def create_role(self, name: str="new role", **_) -> OfflineRole:
+        return self.add_role(name)
+
+    async def bans(self) -> list:
+        return []
+
+    async def ban(self, *_, **__):
+        pass
+
+    async def unban(self, *_, **__):
+        pass
+
+    async def kick(self, *_, **__):
+        pass
+
+
+@_offline
+class OfflineMessage(discord.Message):
+    def __init__(self, content: str, channel: OfflineTextChannel, author, mentions: list=None,
+                 role_mentions: list=None, channel_mentions: list=None, embed=None):
+        self.id = next_id()
+        self.content = self.clean_content = self.system_content = content or ""
+        self.channel = channel
+        self.guild = channel.guild
+        self.author = author
+
+        self.mentions = mentions or []
+        self.role_mentions = role_mentions or []
+        self.channel_mentions = channel_mentions or []
+        self.raw_mentions = [a.id for a in self.mentions]
+        self.raw_role_mentions = [a.id for a in self.role_mentions]
+        self.raw_channel_mentions = [a.id for a in self.channel_mentions]
+        self.mention_everyone = "@everyone" in self.content
+
+        self.embeds = [embed] if embed else []
+        self.attachments = []
+        self.reactions = []
+        self.pinned = self.tts = False
+        self.type = discord.MessageType.default
+        self.created_at = datetime.utcnow()
+        self.edited_at = None
+        self.webhook_id = None
+
+    async def add_reaction(self, emoji):
+        outbox.reactions += 1
+        self.reactions.append(emoji)
+
+    async def clear_reactions(self):
+        self.reactions = []
+
+    async def delete(self, **_):
+        outbox.deleted += 1
+
+    async def edit(self, content=None, embed=None, **_):
+        if content is not None:
+            self.content = content
+        if embed is not None:
+            self.embeds = [embed]
+
+    async def pin(self):
+        self.pinned = True
+
+
+@_offline
+class OfflineReaction(discord.Reaction):
+    def __init__(self, message: OfflineMessage, emoji: str, count: int=1):
+        self.message = message
+        self.emoji = emoji
+        self.count = count
+        self.me = False
+
+
+def _send(destination, content=None, embed=None, **_) -> OfflineMessage:
+    guild = getattr(destination, "guild", None)
+    author = guild.me if guild else None
+
+    message = OfflineMessage(str(content) if content is not None else "", destination, author, embed=embed)
+    outbox.record(message)
+
+    return message
+
+
+def use_offline_settings():
+    """
+    Points Nano at the in-memory storage backend. Must run before nano.py is imported.
+    """
+    if not par.has_section("Storage"):
+        par.add_section("Storage")
+    par.set("Storage", "backend", "memory")
+
+    for section, option in (("Settings", "ownerid"), ("Dev", "server")):
+        if not par.get(section, option, fallback="").strip():
+            par.set(section, option, str(OWNER_ID))
+
+
+def setup_guild(handler, client: discord.Client, guild: OfflineGuild, prefix: str=None, filters: bool=True):
+    """
+    Stores the guild like on_guild_join would and lets the client find it
+    """
+    register_guild(client, guild)
+    handler.server_setup(guild)
+
+    if prefix is not None:
+        handler.update_var(guild.id, "prefix", prefix)
+
+    if filters:
+        for setting in ("word filter", "spam filter", "invite filter"):
+            handler.update_moderation_settings(guild.id, setting, True)
+
+
+def connect_offline(client: discord.Client, name: str="Nano") -> OfflineClientUser:
+    """
+    Gives the (never connected) client a user, so plugins can compare authors and mentions to it
+    """
+    user = OfflineClientUser(name)
+    client._connection.user = user
+
+    return user
+
+
+def register_guild(client: discord.Client, guild: OfflineGuild):
+    """
+    Makes client.get_guild and friends find the guild
+    """
+    client._connection._add_guild(guild)
@@ -0,0 +1,154 @@
+# coding=utf-8
+import logging
+
+from .templates import compile_template
+
+__author__ = "DefaltSimon"
+# Command router for Nano
+
+log = logging.getLogger(__name__)
+log.setLevel(logging.INFO)
+
+# CONSTANTS
+
+# Command keys starting with this are resolved with the server prefix (_ping -> !ping)
+PREFIX_PLACEHOLDER = "_"
+
+# Marks a node that completes a command: maps to (command key, plugin name)
+_END = None
+
+
+class CommandRouter:
+    """
+    Prefix trie over every plugin's "commands" dict.
+
+    Commands that start with _ live in a separate trie (without the _), because
+    the prefix is only known per-message. Lookups walk each trie once over the message
+    and return the longest command that the message starts with.
+    """
+    __slots__ = ("_prefixed", "_literal", "_owners")
+
+    def __init__(self):
+        self._prefixed = {}
+        self._literal = {}
+        self._owners = {}
+
+    def __len__(self):
+        return len(self._owners)
+
+    def __iter__(self):
+        # Command keys (_ping, nano.info, ...)
+        return iter(self._owners)
+
+    @classmethod
+    def from_plugins(cls, plugins: dict) -> "CommandRouter":
+        """
+        Builds a router from Nano.plugins (name: PluginObject)
+        """
+        router = cls()
+
+        for name, plugin in plugins.items():
+            commands = getattr(plugin.plugin, "commands", None)
+            if not commands:
+                continue
+
+            for command in commands.keys():
+                router.add(command, name)
+
+        log.info("Command router built: {} commands".format(len(router)))
+        return router
+
+    def add(self, command: str, owner: str):
+        if command in self._owners and self._owners[command] != owner:
+            log.warning("Command {} is registered by both {} and {}, using the latter"
+                        .format(command, self._owners[command], owner))
+
+        if command.startswith(PREFIX_PLACEHOLDER):
+            node = self._prefixed
+            text = command[len(PREFIX_PLACEHOLDER):]
+        else:
+            node = self._literal
+            text = command
+
+        for char in text:
+            node = node.setdefault(char, {})
+
+        node[_END] = (command, owner)
+        self._owners[command] = owner
+
+    @staticmethod
+    def _walk(node: dict, text: str, start: int=0):
+        # Returns the deepest terminal node along the text and the length it covers
+        found = None
+        length = 0
+
+        end = node.get(_END)
+        if end is not None:
+            found = end
+
+        for index in range(start, len(text)):
+            node = node.get(text[index])
+            if node is None:
+                break
+
+            end = node.get(_END)
+            if end is not None:
+                found = end
+                length = index + 1 - start
+
+        return found, length
+
+    def match(self, content: str, prefix: str=None):
+        """
+        Returns the longest matching (command key, plugin name) or None
+
+        :param content: message content
+        :param prefix: server prefix, None to only match literal commands (nano.*)
+        """
+        found, length = self._walk(self._literal, content)
+
+        if prefix and content.startswith(prefix):
+            p_found, p_length = self._walk(self._prefixed, content, len(prefix))
+
+            if p_found is not None and (found is None or len(prefix) + p_length > length):
+                found = p_found
+
+        return found
+
+    def get_owner(self, content: str, prefix: str=None):
+        """
+        Returns the name of the plugin that owns the command in content or None
+        """
+        found = self.match(content, prefix)
+        return found[1] if found else None
+
+    def is_command(self, content: str, prefix: str=None) -> bool:
+        return self.match(content, prefix) is not None
+
+
+class TriggerMatcher:
+    """
+    Prefix trie over a guild's custom commands (trigger: response).
+    Responses are compiled when the matcher is built, match returns the CompiledTemplate
+    of the longest trigger that the message starts with.
+    """
+    __slots__ = ("_root", "size")
+
+    def __init__(self, commands: dict):
+        self._root = {}
+        self.size = 0
+
+        for trigger, response in commands.items():
+            node = self._root
+            for char in str(trigger):
+                node = node.setdefault(char, {})
+
+            node[_END] = compile_template(response)
+            self.size += 1
+
+    def __len__(self):
+        return self.size
+
+    def match(self, content: str):
+        found, _ = CommandRouter._walk(self._root, content)
+        return found
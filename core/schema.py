@@ -0,0 +1,185 @@
+# coding=utf-8
+import logging
+
+from .utils import decode
+
+__author__ = "DefaltSimon"
+# Typed decoding of Redis replies
+
+log = logging.getLogger(__name__)
+log.setLevel(logging.INFO)
+
+
+# Converters
+# Every converter takes one reply value (bytes, or str/bool from a compact record) and returns the typed value.
+# None (a missing field) never reaches a converter.
+
+def to_str(value):
+    if value.__class__ is bytes:
+        return value.decode()
+
+    return value
+
+
+def to_optional_str(value):
+    value = to_str(value)
+    return None if value == "None" else value
+
+
+def to_int(value) -> int:
+    # int() accepts bytes directly
+    return int(value)
+
+
+def to_optional_int(value):
+    if value in ("", b"", "None", b"None"):
+        return None
+
+    return int(value)
+
+
+def to_channel(value):
+    # Channel id, older servers may still have a channel name stored
+    value = to_optional_str(value)
+    if value is not None and value.isdigit():
+        return int(value)
+
+    return value
+
+
+def to_float(value) -> float:
+    return float(value)
+
+
+def to_bool(value) -> bool:
+    return value is True or value == b"True" or value == "True"
+
+
+class Schema:
+    """
+    Declares the type of every field in one key family (or plugin namespace).
+
+    :param fields: dict(field name: converter)
+    :param default: converter for fields that aren't listed
+    :param key: converter for hash field names (user ids, ...)
+    :param member: converter for set and list members and plain string values
+    """
+    __slots__ = ("name", "fields", "default", "key", "member")
+
+    def __init__(self, name: str, fields: dict=None, default=to_str, key=to_str, member=to_str):
+        self.name = name
+        self.fields = fields or {}
+        self.default = default
+        self.key = key
+        self.member = member
+
+    def field(self, name, value):
+        """
+        Decodes one hash field (or plain string key) by name
+        """
+        if value is None:
+            return None
+
+        return self.fields.get(name, self.default)(value)
+
+    def hash(self, raw) -> dict:
+        """
+        Decodes a HGETALL reply (dict or flat [field, value, ...] list)
+        """
+        if not raw:
+            return {}
+
+        items = zip(raw[::2], raw[1::2]) if isinstance(raw, list) else raw.items()
+        fields, default, key = self.fields, self.default, self.key
+
+        decoded = {}
+        for name, value in items:
+            name = key(name)
+            decoded[name] = fields.get(name, default)(value)
+
+        return decoded
+
+    def members(self, raw):
+        """
+        Decodes a SMEMBERS/LRANGE/HKEYS reply, sets stay sets
+        """
+        if raw is None:
+            return None
+
+        member = self.member
+        if isinstance(raw, set):
+            return {member(a) for a in raw}
+
+        return [member(a) for a in raw]
+
+    def value(self, raw):
+        if raw is None:
+            return None
+
+        return self.member(raw)
+
+
+class UntypedSchema(Schema):
+    """
+    Falls back to decode() for plugin namespaces that didn't declare a schema
+    """
+    __slots__ = ()
+
+    def __init__(self, name: str=None):
+        super().__init__(name)
+
+    def field(self, name, value):
+        return decode(value)
+
+    def hash(self, raw) -> dict:
+        if isinstance(raw, list):
+            raw = dict(zip(raw[::2], raw[1::2]))
+
+        return decode(raw) or {}
+
+    def members(self, raw):
+        return decode(raw)
+
+    def value(self, raw):
+        return decode(raw)
+
+
+# Core key families
+
+# server:{id} (or a compact record, see core/keyspace.py)
+# filterwords/filterspam/filterinvite are the names server_defaults uses, the rest of the code reads wordfilter/...
+SERVER_SCHEMA = Schema("server", {
+    "name": to_str,
+    "owner": to_optional_int,
+    "prefix": to_str,
+    "lang": to_str,
+    "sleeping": to_bool,
+    "wordfilter": to_bool,
+    "spamfilter": to_bool,
+    "invitefilter": to_bool,
+    "filterwords": to_bool,
+    "filterspam": to_bool,
+    "filterinvite": to_bool,
+    "welcomemsg": to_optional_str,
+    "kickmsg": to_optional_str,
+    "banmsg": to_optional_str,
+    "leavemsg": to_optional_str,
+    "logchannel": to_channel,
+    "dchan": to_channel,
+})
+
+# commands:{id} -> {trigger: response}, triggers like "1337" stay strings
+COMMANDS_SCHEMA = Schema("commands")
+
+# mutes:{id} and blacklist:{id} are sets of user/channel ids, sr:{id} is a set of role names
+MUTES_SCHEMA = Schema("mutes", member=to_int)
+BLACKLIST_SCHEMA = Schema("blacklist", member=to_int)
+SELFROLES_SCHEMA = Schema("sr")
+# words:{id} is a set of the guild's own banned words (on top of plugins/banned_words.txt)
+WORDS_SCHEMA = Schema("words")
+
+# stats -> {stat type: counter}
+STATS_SCHEMA = Schema("stats", default=to_int, member=to_int)
+
+# moderation:{guild id}:{user id} -> "kick"/"ban"/"softban" (shared by the admin and server plugins)
+MODERATION_SCHEMA = Schema("moderation")
@@ -1,11 +1,24 @@
 # coding=utf-8
+import asyncio
 import redis
 import logging
 import time
-import os
+
+try:
+    import redis.asyncio as aioredis
+except ImportError:
+    aioredis = None
 
 from discord import Member, Guild
-from .utils import Singleton, decode, bin2bool, SecurityError
+from .utils import Singleton, decode, bin2bool, chunks, SecurityError
+from .batching import CommandBatcher, READ_COMMANDS
+from .router import TriggerMatcher
+from .schema import Schema, UntypedSchema, COMMANDS_SCHEMA, MUTES_SCHEMA, BLACKLIST_SCHEMA, SELFROLES_SCHEMA, \
+    WORDS_SCHEMA
+from .connections import ConnectionManager, get_credentials, DATA, CACHE, CORE_NAMESPACE
+from .localstore import get_backend, open_store, AsyncSQLiteRedis, LOCAL_BACKENDS
+from .keyspace import make_layout, with_source, LAYOUT_COMPACT, LAYOUT_LEGACY, DEFAULT_BUCKETS, LEGACY_PREFIX, \
+    COMPACT_PREFIX
 from .confparser import get_settings_parser, get_config_parser
 
 __author__ = "DefaltSimon"
@@ -67,56 +80,50 @@ def validate_input(fn):
 class ServerHandler:
     @staticmethod
     def get_redis_credentials() -> tuple:
-        setup_type = 1 if par.get("Redis", "setup") == "environment" else 2
-
-        if setup_type == 1:
-            redis_ip = os.environ["REDIS_HOST"]
-            redis_port = os.environ["REDIS_PORT"]
-            redis_pass = os.environ["REDIS_PASS"]
-
-        else:
-            redis_ip = par.get("Redis", "ip", fallback=None)
-            redis_port = par.get("Redis", "port", fallback=None)
-            redis_pass = par.get("Redis", "password", fallback=None)
-
-            # Fallback to defaults
-            if not redis_ip:
-                redis_ip = "127.0.0.1"
-            if not redis_port:
-                redis_port = 6379
-            if not redis_pass:
-                redis_pass = None
-
-        return redis_ip, redis_port, redis_pass
+        return get_credentials(DATA)
 
     @staticmethod
     def get_cache_credentials() -> tuple:
-        redis_ip = par.get("RedisCache", "ip")
-        redis_port = par.get("RedisCache", "port")
-        redis_pass = par.get("RedisCache", "password")
-
-        # Fallback to defaults
-        if not redis_ip:
-            redis_ip = "127.0.0.1"
-        if not redis_port:
-            redis_port = 6379
-        if not redis_pass:
-            redis_pass = None
+        return get_credentials(CACHE)
 
-        return redis_ip, redis_port, redis_pass
+    @staticmethod
+    def get_keyspace_layout():
+        # See core/keyspace.py
+        return make_layout(par.get("Redis", "layout", fallback=None),
+                           par.getint("Redis", "buckets", fallback=DEFAULT_BUCKETS))
 
     @classmethod
     def get_handler(cls, loop) -> "RedisServerHandler":
-        # Factory method
-        redis_ip, redis_port, redis_pass = cls.get_redis_credentials()
-        return RedisServerHandler(loop, redis_ip, redis_port, redis_pass)
+        # Factory method, "backend" under [Storage] in settings.ini picks the implementation
+        if get_backend() in LOCAL_BACKENDS:
+            return SQLiteServerHandler(loop)
+
+        return RedisServerHandler(loop)
 
     @staticmethod
     def get_cache_handler() -> "RedisCacheHandler":
+        if get_backend() in LOCAL_BACKENDS:
+            return SQLiteCacheHandler()
+
         return RedisCacheHandler()
 
+    @classmethod
+    def get_async_handler(cls) -> "AsyncRedisServerHandler":
+        if get_backend() in LOCAL_BACKENDS:
+            return AsyncSQLiteServerHandler()
+
+        return AsyncRedisServerHandler()
+
+    @staticmethod
+    def get_async_cache_handler() -> "AsyncRedisCacheHandler":
+        if get_backend() in LOCAL_BACKENDS:
+            return AsyncSQLiteCacheHandler()
+
+        return AsyncRedisCacheHandler()
+
     @staticmethod
     def make_pool(ip, port, password, **kwargs):
+        # Unbounded pool for the utilities, Nano itself uses ConnectionManager
         log.info("Created ConnectionPool for {}:{}".format(ip, port))
         return redis.ConnectionPool(host=ip, port=port, password=password, **kwargs)
 
@@ -181,46 +188,401 @@ mod_settings_map = {
     "invitefilter": INVITEFILTER_SETTING,
 }
 
+# Guild settings cache
+# Every process keeps decoded server:{id} hashes in memory. Writers evict their own copy
+# and publish the guild id on SETTINGS_CHANNEL so other processes evict theirs.
+SETTINGS_CHANNEL = "nano:settings:invalidate"
+# Safety net in case an invalidation is missed
+SETTINGS_TTL = 300
+# Expired entries are purged when the cache grows past this
+SETTINGS_PURGE_SIZE = 50000
+
+
+class GuildSettingsCache(metaclass=Singleton):
+    """
+    Read-through cache of guild settings, shared by the blocking and the asyncio handler
+
+    Asyncio readers take generation() before awaiting the read and pass it to put():
+    if the guild was evicted in the meantime, the (possibly stale) reply isn't cached.
+    """
+    __slots__ = ("records", "ttl", "generations", "epoch", "hits", "misses", "invalidations", "discarded")
+
+    def __init__(self, ttl=SETTINGS_TTL):
+        self.ttl = ttl
+        # guild id: (expires at, settings dict)
+        self.records = {}
+        # guild id: times it was evicted, epoch is bumped when everything is dropped
+        self.generations = {}
+        self.epoch = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        # Replies that were not cached because the guild was evicted during the read
+        self.discarded = 0
+
+    def get(self, guild_id):
+        record = self.records.get(int(guild_id))
+
+        if record is None or record[0] < time.monotonic():
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return record[1]
+
+    def generation(self, guild_id) -> tuple:
+        return self.epoch, self.generations.get(int(guild_id), 0)
+
+    def put(self, guild_id, data: dict, generation: tuple=None):
+        guild_id = int(guild_id)
+        if generation is not None and generation != self.generation(guild_id):
+            self.discarded += 1
+            return
+
+        if len(self.records) >= SETTINGS_PURGE_SIZE:
+            self.purge()
+
+        self.records[guild_id] = (time.monotonic() + self.ttl, data)
+
+    def evict(self, guild_id):
+        guild_id = int(guild_id)
+        self.generations[guild_id] = self.generations.get(guild_id, 0) + 1
+
+        if self.records.pop(guild_id, None) is not None:
+            self.invalidations += 1
+
+    def clear(self):
+        self.records = {}
+        self.generations = {}
+        self.epoch += 1
+
+    def purge(self):
+        now = time.monotonic()
+        self.records = {k: v for k, v in self.records.items() if v[0] >= now}
+
+    def get_stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "entries": len(self.records),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / total, 3) if total else 0,
+            "invalidations": self.invalidations,
+            "discarded": self.discarded,
+        }
+
+
+# Custom command index
+# Guilds with custom commands get a TriggerMatcher, guilds without any are only remembered in a set,
+# so most messages never touch redis. set_command/remove_command publish on COMMANDS_CHANNEL.
+COMMANDS_CHANNEL = "nano:commands:invalidate"
+# Matchers hold every response, drop them all if there are too many
+COMMANDS_MAX_GUILDS = 20000
+
+
+class CustomCommandCache(metaclass=Singleton):
+    """
+    Per-guild TriggerMatchers with a negative cache for guilds that have no custom commands
+
+    Like GuildSettingsCache, readers take generation() before loading the commands and pass it to build(),
+    which doesn't cache the result if the guild was evicted in the meantime.
+    """
+    __slots__ = ("matchers", "empty", "generations", "epoch", "builds", "invalidations", "discarded")
+
+    def __init__(self):
+        # guild id: TriggerMatcher
+        self.matchers = {}
+        # guild ids known to have no custom commands
+        self.empty = set()
+        # guild id: times it was evicted, epoch is bumped when everything is dropped
+        self.generations = {}
+        self.epoch = 0
+
+        self.builds = 0
+        self.invalidations = 0
+        self.discarded = 0
+
+    def is_empty(self, guild_id) -> bool:
+        return guild_id in self.empty
+
+    def get(self, guild_id):
+        return self.matchers.get(guild_id)
+
+    def generation(self, guild_id) -> tuple:
+        return self.epoch, self.generations.get(int(guild_id), 0)
+
+    def build(self, guild_id, commands: dict, generation: tuple=None):
+        """
+        Caches and returns a matcher for the commands, or None if there aren't any
+        """
+        self.builds += 1
+
+        # Commands changed while they were being loaded, use them for this message only
+        cache = generation is None or generation == self.generation(guild_id)
+        if not cache:
+            self.discarded += 1
+
+        if not commands:
+            if cache:
+                self.empty.add(guild_id)
+            return None
+
+        matcher = TriggerMatcher(commands)
+        if cache:
+            if len(self.matchers) >= COMMANDS_MAX_GUILDS:
+                self.matchers = {}
+
+            self.matchers[guild_id] = matcher
+
+        return matcher
+
+    def evict(self, guild_id):
+        guild_id = int(guild_id)
+        self.generations[guild_id] = self.generations.get(guild_id, 0) + 1
+
+        self.empty.discard(guild_id)
+        if self.matchers.pop(guild_id, None) is not None:
+            self.invalidations += 1
+
+    def clear(self):
+        self.matchers = {}
+        self.empty = set()
+        self.generations = {}
+        self.epoch += 1
+
+    def get_stats(self) -> dict:
+        return {
+            "guilds_with_commands": len(self.matchers),
+            "guilds_without": len(self.empty),
+            "builds": self.builds,
+            "invalidations": self.invalidations,
+            "discarded": self.discarded,
+        }
+
+
+async def listen_for_invalidations(redis_client, caches: dict, retry_after=5):
+    """
+    Evicts guilds invalidated by other processes, needs an asyncio redis client
+
+    :param caches: dict of channel name: cache (with evict(guild_id) and clear())
+    """
+    while True:
+        pubsub = redis_client.pubsub()
+
+        try:
+            await pubsub.subscribe(*caches.keys())
+            log.info("Listening for cache invalidations")
+
+            async for msg in pubsub.listen():
+                if msg["type"] == "message":
+                    caches[decode(msg["channel"])].evict(msg["data"])
+        except asyncio.CancelledError:
+            raise
+        except (redis.RedisError, OSError) as e:
+            log.warning("Lost the invalidation channels ({}), clearing caches".format(e))
+        except Exception:
+            log.exception("Invalidation listener crashed, clearing caches")
+        finally:
+            try:
+                await pubsub.reset()
+            except (redis.RedisError, OSError):
+                pass
+
+        # Anything could have changed while we weren't listening
+        for cache in caches.values():
+            cache.clear()
+        await asyncio.sleep(retry_after)
+
+
+# Layout commands
+# The compact layout runs its scripts with EVALSHA. Handlers SCRIPT LOAD them on connect, but Redis forgets
+# them on a restart or SCRIPT FLUSH: commands answered with NOSCRIPT are sent again with EVAL (see with_source).
+
+def execute_layout(client, command: tuple):
+    try:
+        return client.execute_command(*command)
+    except redis.exceptions.NoScriptError:
+        return client.execute_command(*with_source(command))
+
+
+async def execute_layout_async(client, command: tuple):
+    try:
+        return await client.execute_command(*command)
+    except redis.exceptions.NoScriptError:
+        return await client.execute_command(*with_source(command))
+
+
+def _script_retries(results: list) -> list:
+    return [index for index, result in enumerate(results) if isinstance(result, redis.exceptions.NoScriptError)]
+
+
+def _raise_errors(results: list):
+    for result in results:
+        if isinstance(result, Exception):
+            raise result
+
+
+def run_commands(client, commands: list) -> list:
+    """
+    Sends the commands in one pipeline and returns their results, retrying NOSCRIPT answers with EVAL
+    """
+    pipe = client.pipeline(transaction=False)
+    for command in commands:
+        pipe.execute_command(*command)
+
+    results = pipe.execute(raise_on_error=False)
+    for index in _script_retries(results):
+        results[index] = client.execute_command(*with_source(commands[index]))
+
+    _raise_errors(results)
+    return results
+
+
+async def run_commands_async(client, commands: list) -> list:
+    pipe = client.pipeline(transaction=False)
+    for command in commands:
+        pipe.execute_command(*command)
+
+    results = await pipe.execute(raise_on_error=False)
+    for index in _script_retries(results):
+        results[index] = await client.execute_command(*with_source(commands[index]))
+
+    _raise_errors(results)
+    return results
+
+
+def make_message_context(settings: dict, muted, blacklisted) -> dict:
+    """
+    Flattens guild settings and per-message flags into the dict returned by get_message_context
+    """
+    return {
+        "exists": bool(settings),
+        "prefix": settings.get("prefix"),
+        "lang": settings.get("lang"),
+        "sleeping": settings.get("sleeping") is True,
+        "muted": bool(muted),
+        "blacklisted": bool(blacklisted),
+        "spam_filter": settings.get(SPAMFILTER_SETTING) is True,
+        "word_filter": settings.get(WORDFILTER_SETTING) is True,
+        "invite_filter": settings.get(INVITEFILTER_SETTING) is True,
+        "log_channel": settings.get("logchannel"),
+    }
+
+
+# Every per-guild key family, removed together when Nano leaves a guild
+GUILD_KEY_FAMILIES = ("server", "commands", "blacklist", "mutes", "voting", "sr", "words")
+# Guilds checked (or deleted) per pipeline during reconciliation
+RECONCILE_CHUNK_SIZE = 500
+
+
+def guild_keys(server_id) -> list:
+    return ["{}:{}".format(family, server_id) for family in GUILD_KEY_FAMILIES]
+
+
 # IMPORTANT
 # The format for saving server data is => server:id_here
+#   (or srv:{id % buckets} -> {id: record} with the compact layout, see core/keyspace.py)
 # For commands => commands:id_here
 # For mutes => mutes:id_here
 # For blacklist => blacklist:id_here
 # For selfroles => sr:
+# For the word filter's extra words => words:id_here
+# Field types of every family are declared in core/schema.py, plugins pass their own
+# Schema to get_plugin_data_manager(namespace, schema=...)
 
 
 class RedisServerHandler(ServerHandler, metaclass=Singleton):
     __slots__ = ("_redis", "redis", "pool")
 
-    def __init__(self, loop, redis_ip, redis_port, redis_password):
+    def __init__(self, loop):
         super().__init__()
 
+        self.loop = loop
+
+        self.connections = ConnectionManager()
         self.pool = None
         self.redis = None
-        self.loop = loop
+        self.connect()
 
-        self.pool = self.make_pool(redis_ip, redis_port, redis_password, db=0)
-        self.redis = redis.StrictRedis(connection_pool=self.pool)
+        self.layout = self.get_keyspace_layout()
+        self.settings_cache = GuildSettingsCache()
+        self.command_cache = CustomCommandCache()
 
-        self.verify_connection(redis_ip, redis_port, redis_password)
+        self.verify_connection()
 
-    def verify_connection(self, redis_ip, redis_port, redis_password):
-        try:
-            self.redis.ping()
-        except redis.ConnectionError:
-            log.error("Could not connect to redis! Check settings.ini and your redis server")
-            log.error("Retrying in 3 sec...")
-
-            # Must be blocking
-            time.sleep(3)
-            self.verify_connection(redis_ip, redis_port, redis_password)
+    def connect(self):
+        self.pool = self.connections.get_pool(DATA)
+        self.redis = self.connections.client(CORE_NAMESPACE, DATA)
 
+    def get_client(self, namespace: str):
+        """
+        Returns a separate client for the data instance, with its commands counted under namespace
+        """
+        return self.connections.client(namespace, DATA)
 
+    def verify_connection(self):
+        # Retries with exponential backoff
+        self.connections.wait_until_healthy(DATA)
         log.info("Connected to Redis database")
 
+        for source in self.layout.scripts:
+            self.redis.script_load(source)
+
     def bg_save(self):
         return bool(self.redis.bgsave() == b"OK")
 
+    # SETTINGS CACHE
+    def get_settings(self, server_id) -> dict:
+        """
+        Returns the decoded guild settings, read through the settings cache. Do not modify it.
+        """
+        data = self.settings_cache.get(server_id)
+
+        if data is None:
+            data = self.layout.parse(execute_layout(self.redis, self.layout.read(server_id)))
+            self.settings_cache.put(server_id, data)
+
+        return data
+
+    def _update_settings(self, server_id, mapping: dict):
+        resp = execute_layout(self.redis, self.layout.update(server_id, mapping))
+        self.invalidate(server_id)
+        return resp
+
+    def _delete_settings(self, server_id, *fields):
+        resp = execute_layout(self.redis, self.layout.delete_fields(server_id, *fields))
+        self.invalidate(server_id)
+        return resp
+
+    def invalidate(self, server_id):
+        self.settings_cache.evict(server_id)
+        self.redis.publish(SETTINGS_CHANNEL, server_id)
+
+    def invalidate_commands(self, server_id):
+        self.command_cache.evict(server_id)
+        self.redis.publish(COMMANDS_CHANNEL, server_id)
+
+    def get_message_context(self, guild_id, channel_id, user_id) -> dict:
+        """
+        Returns everything needed to handle a message in one round trip (see make_message_context)
+        """
+        settings = self.settings_cache.get(guild_id)
+
+        commands = [("SISMEMBER", "mutes:{}".format(guild_id), user_id),
+                    ("SISMEMBER", "blacklist:{}".format(guild_id), channel_id)]
+        # Settings are only fetched if they aren't cached
+        if settings is None:
+            commands.append(self.layout.read(guild_id))
+
+        muted, blacklisted, *raw = run_commands(self.redis, commands)
+
+        if settings is None:
+            settings = self.layout.parse(raw[0])
+            self.settings_cache.put(guild_id, settings)
+
+        return make_message_context(settings, muted, blacklisted)
+
     # SERVER SETUPS
     @staticmethod
     def _default_guild_data(guild):
@@ -236,24 +598,30 @@ class RedisServerHandler(ServerHandler, metaclass=Singleton):
         # These are server defaults
         s_data = self._default_guild_data(guild)
 
-        sid = "server:{}".format(guild.id)
+        pipe = self.redis.pipeline()
+        for command in self.layout.replace(guild.id, s_data):
+            pipe.execute_command(*command)
+        pipe.execute()
 
-        self.redis.hmset(sid, s_data)
+        self.invalidate(guild.id)
         # commands:id, mutes:id, blacklist:id and sr:id are created automatically when needed
 
         log.info("New server: {}".format(guild.name))
 
     def reset_server(self, guild: Guild):
         server_data = self._default_guild_data(guild)
-        sid = "server:{}".format(guild.id)
 
-        self.redis.delete(sid)
-        self.redis.hmset(sid, server_data)
+        pipe = self.redis.pipeline()
+        for command in self.layout.replace(guild.id, server_data):
+            pipe.execute_command(*command)
+        pipe.execute()
+
+        self.invalidate(guild.id)
 
         log.info("Guild reset: {}".format(guild.name))
 
     def server_exists(self, server_id: int) -> bool:
-        return bool(self.redis.exists("server:{}".format(server_id)))
+        return bool(self.get_settings(server_id))
 
     def auto_setup_server(self, server: Guild):
         # shortcut for checking sever existence
@@ -261,13 +629,12 @@ class RedisServerHandler(ServerHandler, metaclass=Singleton):
             self.server_setup(server)
 
     def get_server_data(self, server) -> dict:
-        # NOTE: HGETALL returns a dict with binary keys and values!
-        base = decode(self.redis.hgetall("server:{}".format(server.id)))
         cmd_list = self.get_custom_commands(server)
         bl = self.get_blacklists(server)
         mutes = self.get_mute_list(server)
 
-        data = decode(base)
+        # The cached dict is shared, make a copy
+        data = dict(self.get_settings(server.id))
         data["commands"] = cmd_list
         data["blacklist"] = bl
         data["mutes"] = mutes
@@ -278,28 +645,32 @@ class RedisServerHandler(ServerHandler, metaclass=Singleton):
     # TODO investigate uses
     def get_var(self, server_id: int, key: str):
         # If value is in json, it will be a json-encoded string and not parsed
-        return decode(self.redis.hget("server:{}".format(server_id), key))
+        return self.get_settings(server_id).get(key)
 
     @validate_input
     def update_var(self, server_id: int, key: str, value: str) -> bool:
-        return bin2bool(self.redis.hset("server:{}".format(server_id), key, value))
+        return bin2bool(self._update_settings(server_id, {key: value}))
 
     @validate_input
     def update_moderation_settings(self, server_id: int, key: str, value: bool) -> bool:
         if key not in mod_settings_map.keys():
             raise TypeError("invalid moderation setting: {}".format(key))
 
-        return bin2bool(self.redis.hset("server:{}".format(server_id), mod_settings_map.get(key), value))
+        return bin2bool(self._update_settings(server_id, {mod_settings_map.get(key): value}))
 
     def check_server_vars(self, server: Guild):
         try:
-            sid = "server:{}".format(server.id)
+            settings = self.get_settings(server.id)
+            updates = {}
 
-            if int(decode(self.redis.hget(sid, "owner"))) != server.owner.id:
-                self.redis.hset(sid, "owner", server.owner.id)
+            if settings.get("owner") != server.owner.id:
+                updates["owner"] = server.owner.id
 
-            if decode(self.redis.hget(sid, "name")) != str(server.name):
-                self.redis.hset(sid, "name", server.name)
+            if str(settings.get("name")) != str(server.name):
+                updates["name"] = server.name
+
+            if updates:
+                self._update_settings(server.id, updates)
         except AttributeError:
             pass
 
@@ -317,12 +688,13 @@ class RedisServerHandler(ServerHandler, metaclass=Singleton):
         log.info("Removed {} old servers.".format(len(removed_servers)))
 
     def delete_server(self, server_id: int):
-        self.redis.delete("commands:{}".format(server_id))
-        self.redis.delete("blacklist:{}".format(server_id))
-        self.redis.delete("mutes:{}".format(server_id))
-        self.redis.delete("server:{}".format(server_id))
-        self.redis.delete("voting:{}".format(server_id))
-        self.redis.delete("sr:{}".format(server_id))
+        # UNLINK frees the memory in the background
+        self.redis.unlink(*guild_keys(server_id))
+        if self.layout.compact:
+            self.redis.execute_command(*self.layout.remove(server_id))
+
+        self.invalidate(server_id)
+        self.invalidate_commands(server_id)
 
         log.info("Deleted server: {}".format(server_id))
 
@@ -332,22 +704,26 @@ class RedisServerHandler(ServerHandler, metaclass=Singleton):
         if len(trigger) > 80:
             return False
 
-        return self.redis.hset("commands:{}".format(server.id), trigger, response)
+        resp = self.redis.hset("commands:{}".format(server.id), trigger, response)
+        self.invalidate_commands(server.id)
+        return resp
 
     def remove_command(self, server: Guild, trigger: str) -> bool:
-        return bin2bool(self.redis.hdel("commands:{}".format(server.id), trigger))
+        resp = bin2bool(self.redis.hdel("commands:{}".format(server.id), trigger))
+        self.invalidate_commands(server.id)
+        return resp
 
     def get_custom_commands(self, server_id: int) -> dict:
-        return decode(self.redis.hgetall("commands:{}".format(server_id))) or {}
+        return COMMANDS_SCHEMA.hash(self.redis.hgetall("commands:{}".format(server_id)))
 
     def get_custom_commands_keys(self, server_id: int) -> list:
-        return decode(self.redis.hkeys("commands:{}".format(server_id))) or []
+        return COMMANDS_SCHEMA.members(self.redis.hkeys("commands:{}".format(server_id))) or []
 
     def get_custom_command_by_key(self, server_id: int, key: str) -> str:
-        return decode(self.redis.hget("commands:{}".format(server_id), key))
+        return COMMANDS_SCHEMA.field(key, self.redis.hget("commands:{}".format(server_id), key))
 
     def get_command_amount(self, server_id: int) -> int:
-        return decode(self.redis.hlen("commands:{}".format(server_id)))
+        return self.redis.hlen("commands:{}".format(server_id))
 
     def custom_command_exists(self, server_id: int, trigger: str):
         return self.redis.hexists("commands:{}".format(server_id), trigger)
@@ -366,35 +742,35 @@ class RedisServerHandler(ServerHandler, metaclass=Singleton):
 
     def get_blacklists(self, server_id):
         serv = "blacklist:{}".format(server_id)
-        return list(decode(self.redis.smembers(serv)) or [])
+        return list(BLACKLIST_SCHEMA.members(self.redis.smembers(serv)) or [])
 
     # PREFIX
     def get_prefix(self, server: Guild) -> str:
-        return decode(self.redis.hget("server:{}".format(server.id), "prefix"))
+        return self.get_settings(server.id).get("prefix")
 
     @validate_input
     def change_prefix(self, server, prefix):
-        self.redis.hset("server:{}".format(server.id), "prefix", prefix)
+        self._update_settings(server.id, {"prefix": prefix})
 
     # MODERATION
     def has_spam_filter(self, server):
-        return decode(self.redis.hget("server:{}".format(server.id), SPAMFILTER_SETTING)) is True
+        return self.get_settings(server.id).get(SPAMFILTER_SETTING) is True
 
     def has_word_filter(self, server):
-        return decode(self.redis.hget("server:{}".format(server.id), WORDFILTER_SETTING)) is True
+        return self.get_settings(server.id).get(WORDFILTER_SETTING) is True
 
     def has_invite_filter(self, server):
-        return decode(self.redis.hget("server:{}".format(server.id), INVITEFILTER_SETTING)) is True
+        return self.get_settings(server.id).get(INVITEFILTER_SETTING) is True
 
     def get_log_channel(self, server):
-        return decode(self.redis.hget("server:{}".format(server.id), "logchannel"))
+        return self.get_settings(server.id).get("logchannel")
 
     def get_defaultchannel(self, server_id):
-        return decode(self.redis.hget("server:{}".format(server_id), "dchan"))
+        return self.get_settings(server_id).get("dchan")
 
     @validate_input
     def set_defaultchannel(self, server, channel_id):
-        self.redis.hset("server:{}".format(server.id), "dchan", channel_id)
+        self._update_settings(server.id, {"dchan": channel_id})
 
     # SETTINGS
     @validate_input
@@ -403,9 +779,9 @@ class RedisServerHandler(ServerHandler, metaclass=Singleton):
             raise TypeError("invalid channel type")
 
         if value is not None:
-            return bin2bool(self.redis.hset("server:{}".format(guild_id), var_name, value))
+            return bin2bool(self._update_settings(guild_id, {var_name: value}))
         else:
-            return self.redis.hdel("server:{}".format(guild_id), var_name)
+            return self._delete_settings(guild_id, var_name)
 
     @validate_input
     def set_custom_event_message(self, guild_id, var_name, value):
@@ -413,17 +789,17 @@ class RedisServerHandler(ServerHandler, metaclass=Singleton):
             raise TypeError("invalid event type")
 
         if value is not None:
-            return bin2bool(self.redis.hset("server:{}".format(guild_id), var_name, value))
+            return bin2bool(self._update_settings(guild_id, {var_name: value}))
         else:
-            return self.redis.hdel("server:{}".format(guild_id), var_name)
+            return self._delete_settings(guild_id, var_name)
 
     # SLEEPING
     def is_sleeping(self, server_id):
-        return decode(self.redis.hget("server:{}".format(server_id), "sleeping"))
+        return self.get_settings(server_id).get("sleeping")
 
     @validate_input
     def set_sleeping(self, server, bool_var):
-        self.redis.hset("server:{}".format(server.id), "sleeping", bool(bool_var))
+        self._update_settings(server.id, {"sleeping": bool(bool_var)})
 
     # MUTING
     @validate_input
@@ -442,19 +818,19 @@ class RedisServerHandler(ServerHandler, metaclass=Singleton):
 
     def get_mute_list(self, server):
         serv = "mutes:{}".format(server.id)
-        return list(decode(self.redis.smembers(serv)) or [])
+        return list(MUTES_SCHEMA.members(self.redis.smembers(serv)) or [])
 
     # LANGUAGES
     @validate_input
     def set_lang(self, server_id, language):
-        self.redis.hset("server:{}".format(server_id), "lang", language)
+        self._update_settings(server_id, {"lang": language})
 
     def get_lang(self, server_id):
-        return decode(self.redis.hget("server:{}".format(server_id), "lang"))
+        return self.get_settings(server_id).get("lang")
 
     # SELFROLES
     def get_selfroles(self, server_id):
-        return decode(self.redis.smembers("sr:{}".format(server_id)))
+        return SELFROLES_SCHEMA.members(self.redis.smembers("sr:{}".format(server_id)))
 
     @validate_input
     def add_selfrole(self, server_id, role_name):
@@ -467,6 +843,18 @@ class RedisServerHandler(ServerHandler, metaclass=Singleton):
     def is_selfrole(self, server_id, role_name):
         return bin2bool(self.redis.sismember("sr:{}".format(server_id), role_name))
 
+    # WORD FILTER
+    def get_banned_words(self, server_id):
+        return WORDS_SCHEMA.members(self.redis.smembers("words:{}".format(server_id)))
+
+    @validate_input
+    def add_banned_word(self, server_id, word):
+        return bin2bool(self.redis.sadd("words:{}".format(server_id), word))
+
+    @validate_input
+    def remove_banned_word(self, server_id, word):
+        return bin2bool(self.redis.srem("words:{}".format(server_id), word))
+
     # Special debug methods
     def db_info(self, section=None):
         return decode(self.redis.info(section=section))
@@ -476,19 +864,26 @@ class RedisServerHandler(ServerHandler, metaclass=Singleton):
 
     # Plugin storage system
     def get_plugin_data_manager(self, namespace, *args, **kwargs) -> "RedisPluginDataManager":
-        return RedisPluginDataManager(self.pool, namespace, *args, **kwargs)
+        return RedisPluginDataManager(DATA, namespace, *args, **kwargs)
 
     def _get_redis_instance(self):
         return self.redis
 
 
 class RedisPluginDataManager:
-    def __init__(self, pool, namespace=None, *_, **__):
+    def __init__(self, instance=DATA, namespace=None, schema: Schema=None, *_, **__):
         self.namespace = namespace
-        self.redis = redis.StrictRedis(connection_pool=pool)
+        self.redis = self.make_client(instance, namespace)
+        # Namespaces without a schema keep the old decode() behaviour
+        self.schema = schema or UntypedSchema(namespace)
 
         log.info("New plugin namespace registered: {}".format(self.namespace or "(no namespace)"))
 
+    @staticmethod
+    def make_client(instance, namespace):
+        # Commands are counted per namespace (see core/connections.py)
+        return ConnectionManager().client(namespace or instance, instance)
+
     def _make_key(self, name):
         if not self.namespace:
             return name
@@ -500,13 +895,13 @@ class RedisPluginDataManager:
         return decode(self.redis.set(self._make_key(key), val, **kwargs))
 
     def get(self, key):
-        return decode(self.redis.get(self._make_key(key)))
+        return self.schema.field(key, self.redis.get(self._make_key(key)))
 
     def hget(self, name, field, use_namespace=True):
-        return decode(self.redis.hget(self._make_key(name) if use_namespace else name, field))
+        return self.schema.field(field, self.redis.hget(self._make_key(name) if use_namespace else name, field))
 
     def hgetall(self, name, use_namespace=True):
-        return decode(self.redis.hgetall(self._make_key(name) if use_namespace else name))
+        return self.schema.hash(self.redis.hgetall(self._make_key(name) if use_namespace else name))
 
     def hdel(self, name, field):
         return decode(self.redis.hdel(self._make_key(name), field))
@@ -546,19 +941,19 @@ class RedisPluginDataManager:
         return self.redis.lpush(self._make_key(key), value)
 
     def lrange(self, key, from_key=0, to_key=-1):
-        return decode(self.redis.lrange(self._make_key(key), from_key, to_key))
+        return self.schema.members(self.redis.lrange(self._make_key(key), from_key, to_key))
 
     def lrem(self, key, value, count=1):
         return decode(self.redis.lrem(self._make_key(key), count, value))
 
     def lpop(self, key):
-        return decode(self.redis.lpop(self._make_key(key)))
+        return self.schema.value(self.redis.lpop(self._make_key(key)))
 
     def sadd(self, name, *values):
         return self.redis.sadd(self._make_key(name), *values)
 
     def srandmember(self, name, amount=1):
-        return decode(self.redis.srandmember(self._make_key(name), amount))
+        return self.schema.members(self.redis.srandmember(self._make_key(name), amount))
 
     def scard(self, name):
         return self.redis.scard(self._make_key(name))
@@ -577,10 +972,677 @@ class RedisPluginDataManager:
 
 class RedisCacheHandler(RedisPluginDataManager, ServerHandler, metaclass=Singleton):
     def __init__(self):
-        redis_ip, redis_port, redis_pass = self.get_cache_credentials()
-        self.pool = self.make_pool(redis_ip, redis_port, redis_pass, db=0)
+        self.pool = ConnectionManager().get_pool(CACHE)
+
+        super().__init__(CACHE)
+
+    def get_plugin_data_manager(self, namespace, schema: Schema=None):
+        return RedisPluginDataManager(CACHE, namespace, schema)
+
+
+# Everything regarding the asyncio-native handler below
+# MIGRATION: plugins get both "handler" (blocking) and "async_handler" in their kwargs.
+# Both use the same keys, so a plugin can move its calls over one by one:
+#   self.handler.get_prefix(guild)  ->  await self.async_handler.get_prefix(guild)
+# Plugin storage works the same way with get_plugin_data_manager
+
+
+class AsyncRedisServerHandler(ServerHandler, metaclass=Singleton):
+    """
+    Same method surface as RedisServerHandler, but every database call is a coroutine
+    and the connections come from a shared asyncio connection pool.
+    """
+    def __init__(self):
+        super().__init__()
+
+        if aioredis is None:
+            raise RuntimeError("redis.asyncio is not available, install redis>=4.2")
+
+        self.connections = ConnectionManager()
+        self.pool = None
+        self.redis = None
+        self.connect()
+
+        self.layout = self.get_keyspace_layout()
+        self.settings_cache = GuildSettingsCache()
+        self.command_cache = CustomCommandCache()
+        # Concurrent reads are coalesced into one pipeline per loop iteration
+        self.batcher = CommandBatcher(self.redis)
+
+    def connect(self):
+        self.pool = self.connections.get_async_pool(DATA)
+        self.redis = self.connections.async_client(CORE_NAMESPACE, DATA)
+
+    async def verify_connection(self):
+        # Retries with exponential backoff without blocking the loop
+        await self.connections.wait_until_healthy_async(DATA)
+        log.info("Connected to Redis database (asyncio)")
+
+        for source in self.layout.scripts:
+            await self.redis.script_load(source)
+
+    async def bg_save(self):
+        return bool(await self.redis.bgsave())
+
+    # SETTINGS CACHE
+    async def get_settings(self, server_id) -> dict:
+        """
+        Returns the decoded guild settings, read through the settings cache. Do not modify it.
+        """
+        data = self.settings_cache.get(server_id)
+
+        if data is None:
+            # Writes that land while the read is in flight evict the guild and bump this
+            generation = self.settings_cache.generation(server_id)
+            command = self.layout.read(server_id)
+
+            # The compact layout reads with a script, which isn't batched
+            if command[0] in READ_COMMANDS:
+                raw = await self.batcher.load(*command)
+            else:
+                raw = await execute_layout_async(self.redis, command)
+
+            data = self.layout.parse(raw)
+            self.settings_cache.put(server_id, data, generation)
+
+        return data
+
+    async def _update_settings(self, server_id, mapping: dict):
+        resp = await execute_layout_async(self.redis, self.layout.update(server_id, mapping))
+        await self.invalidate(server_id)
+        return resp
+
+    async def _delete_settings(self, server_id, *fields):
+        resp = await execute_layout_async(self.redis, self.layout.delete_fields(server_id, *fields))
+        await self.invalidate(server_id)
+        return resp
+
+    async def invalidate(self, server_id):
+        self.settings_cache.evict(server_id)
+        await self.redis.publish(SETTINGS_CHANNEL, server_id)
+
+    async def invalidate_commands(self, server_id):
+        self.command_cache.evict(server_id)
+        await self.redis.publish(COMMANDS_CHANNEL, server_id)
+
+    def watch_invalidations(self):
+        """
+        Coroutine that keeps the local caches in sync with other processes
+        """
+        return listen_for_invalidations(self.redis, {
+            SETTINGS_CHANNEL: self.settings_cache,
+            COMMANDS_CHANNEL: self.command_cache,
+        })
+
+    async def get_message_context(self, guild_id, channel_id, user_id) -> dict:
+        # All three reads end up in the same batched pipeline (and the settings hash is
+        # shared between every message of the guild in that batch)
+        settings, muted, blacklisted = await asyncio.gather(
+            self.get_settings(guild_id),
+            self.batcher.load("SISMEMBER", "mutes:{}".format(guild_id), user_id),
+            self.batcher.load("SISMEMBER", "blacklist:{}".format(guild_id), channel_id),
+        )
+
+        return make_message_context(settings, muted, blacklisted)
+
+    # SERVER SETUPS
+    _default_guild_data = staticmethod(RedisServerHandler._default_guild_data)
+
+    async def _replace_settings(self, guild: Guild):
+        # Layouts store every value as a string, bools as "True"/"False"
+        pipe = self.redis.pipeline()
+        for command in self.layout.replace(guild.id, self._default_guild_data(guild)):
+            pipe.execute_command(*command)
+
+        await pipe.execute()
+        await self.invalidate(guild.id)
+
+    async def server_setup(self, guild: Guild):
+        await self._replace_settings(guild)
+        log.info("New server: {}".format(guild.name))
+
+    async def reset_server(self, guild: Guild):
+        await self._replace_settings(guild)
+        log.info("Guild reset: {}".format(guild.name))
+
+    async def server_exists(self, server_id: int) -> bool:
+        return bool(await self.get_settings(server_id))
+
+    async def auto_setup_server(self, server: Guild):
+        if not await self.server_exists(server.id):
+            await self.server_setup(server)
+
+    async def get_server_data(self, server) -> dict:
+        # The cached dict is shared, make a copy
+        data = dict(await self.get_settings(server.id))
+        data["commands"] = await self.get_custom_commands(server.id)
+        data["blacklist"] = await self.get_blacklists(server.id)
+        data["mutes"] = await self.get_mute_list(server)
+
+        return data
+
+    # GENERAL USE: moderation settings, server vars
+    async def get_var(self, server_id: int, key: str):
+        return (await self.get_settings(server_id)).get(key)
+
+    @validate_input
+    async def update_var(self, server_id: int, key: str, value: str) -> bool:
+        return bin2bool(await self._update_settings(server_id, {key: value}))
+
+    @validate_input
+    async def update_moderation_settings(self, server_id: int, key: str, value: bool) -> bool:
+        if key not in mod_settings_map.keys():
+            raise TypeError("invalid moderation setting: {}".format(key))
+
+        return bin2bool(await self._update_settings(server_id, {mod_settings_map.get(key): value}))
+
+    async def check_server_vars(self, server: Guild):
+        try:
+            settings = await self.get_settings(server.id)
+            updates = {}
+
+            if settings.get("owner") != server.owner.id:
+                updates["owner"] = server.owner.id
+
+            if str(settings.get("name")) != str(server.name):
+                updates["name"] = server.name
+
+            if updates:
+                await self._update_settings(server.id, updates)
+        except AttributeError:
+            pass
+
+    async def delete_server(self, server_id: int):
+        await self.redis.unlink(*guild_keys(server_id))
+        if self.layout.compact:
+            await self.redis.execute_command(*self.layout.remove(server_id))
+
+        await self.invalidate(server_id)
+        await self.invalidate_commands(server_id)
+
+        log.info("Deleted server: {}".format(server_id))
+
+    async def reconcile_guilds(self, guilds: list, chunk_size: int=RECONCILE_CHUNK_SIZE, owns=None) -> dict:
+        """
+        Bulk version of auto_setup_server + check_server_vars + check_old_servers.
+        Guilds are checked in pipelined chunks and stale guild data is UNLINKed in batches.
+
+        :param guilds: every guild Nano is currently in
+        :param owns: when running in a cluster, tells whether a guild id belongs to this cluster's shards
+                     (data of other clusters' guilds is never removed)
+        :return: dict with counts and timings (in seconds)
+        """
+        started = time.monotonic()
+        report = {"checked": 0, "created": 0, "updated": 0, "removed": 0}
+
+        guilds = list(guilds)
+        for chunk in chunks(guilds, chunk_size):
+            # One round trip for the settings of every guild in the chunk
+            results = await run_commands_async(self.redis, [self.layout.read(guild.id) for guild in chunk])
+
+            # One more for all writes
+            writes = []
+            changed = []
+            for guild, raw in zip(chunk, results):
+                settings = self.layout.parse(raw)
+
+                if not settings:
+                    writes.extend(self.layout.replace(guild.id, self._default_guild_data(guild)))
+
+                    report["created"] += 1
+                    changed.append(guild.id)
+                    continue
+
+                updates = {}
+                owner_id = getattr(guild.owner, "id", None)
+                if owner_id is not None and settings.get("owner") != owner_id:
+                    updates["owner"] = owner_id
+                if str(settings.get("name")) != str(guild.name):
+                    updates["name"] = guild.name
+
+                if updates:
+                    writes.append(self.layout.update(guild.id, updates))
+                    report["updated"] += 1
+                    changed.append(guild.id)
+
+            if changed:
+                # Writes retried with EVAL land after the rest of the pipeline, publish once they're all done
+                await run_commands_async(self.redis, writes)
+
+                pipe = self.redis.pipeline(transaction=False)
+                for guild_id in changed:
+                    self.settings_cache.evict(guild_id)
+                    pipe.publish(SETTINGS_CHANNEL, guild_id)
+                await pipe.execute()
+
+            report["checked"] += len(chunk)
+            log.info("Reconciled {}/{} guilds ({:.2f}s)".format(report["checked"], len(guilds),
+                                                                  time.monotonic() - started))
+
+        checked_at = time.monotonic()
+
+        # Remove data of guilds Nano isn't in anymore
+        current = {str(guild.id) for guild in guilds}
+        stale = [server_id for server_id in await self._stored_guild_ids(chunk_size) - current
+                 if owns is None or owns(int(server_id))]
+
+        for chunk in chunks(stale, chunk_size):
+            keys = [key for server_id in chunk for key in guild_keys(server_id)]
+
+            pipe = self.redis.pipeline(transaction=False)
+            pipe.unlink(*keys)
+            for server_id in chunk:
+                if self.layout.compact:
+                    pipe.execute_command(*self.layout.remove(server_id))
+
+                self.settings_cache.evict(server_id)
+                self.command_cache.evict(server_id)
+                pipe.publish(SETTINGS_CHANNEL, server_id)
+                pipe.publish(COMMANDS_CHANNEL, server_id)
+            await pipe.execute()
+
+            report["removed"] += len(chunk)
+            log.info("Removed {}/{} old guilds".format(report["removed"], len(stale)))
+
+        report["check_time"] = round(checked_at - started, 3)
+        report["cleanup_time"] = round(time.monotonic() - checked_at, 3)
+
+        log.info("Guild reconciliation done: {checked} checked, {created} created, {updated} updated, "
+                 "{removed} removed in {check_time}s + {cleanup_time}s".format(**report))
+        return report
+
+    async def _stored_guild_ids(self, count: int) -> set:
+        # Legacy hashes are always scanned, guilds might not have been migrated yet
+        ids = set()
+        async for key in self.redis.scan_iter(match=LEGACY_PREFIX + "*", count=count):
+            ids.add(key.decode()[len(LEGACY_PREFIX):])
+
+        if self.layout.compact:
+            buckets = [key async for key in self.redis.scan_iter(match=COMPACT_PREFIX + "*", count=count)]
+
+            for chunk in chunks(buckets, count):
+                pipe = self.redis.pipeline(transaction=False)
+                for bucket in chunk:
+                    pipe.hkeys(bucket)
+
+                for fields in await pipe.execute():
+                    ids.update(field.decode() for field in fields)
+
+        return ids
+
+    # COMMANDS
+    @validate_input
+    async def set_command(self, server: Guild, trigger: str, response: str) -> bool:
+        if len(trigger) > 80:
+            return False
+
+        resp = await self.redis.hset("commands:{}".format(server.id), trigger, response)
+        await self.invalidate_commands(server.id)
+        return resp
+
+    async def remove_command(self, server: Guild, trigger: str) -> bool:
+        resp = bin2bool(await self.redis.hdel("commands:{}".format(server.id), trigger))
+        await self.invalidate_commands(server.id)
+        return resp
+
+    async def match_custom_command(self, server_id: int, content: str):
+        """
+        Returns the compiled response (see core/templates.py) of the custom command
+        the message starts with or None.
+        Guilds without custom commands are answered from memory.
+        """
+        cache = self.command_cache
+        if cache.is_empty(server_id):
+            return None
+
+        matcher = cache.get(server_id)
+        if matcher is None:
+            generation = cache.generation(server_id)
+            matcher = cache.build(server_id, await self.get_custom_commands(server_id), generation)
+
+            if matcher is None:
+                return None
+
+        return matcher.match(content)
+
+    async def get_custom_commands(self, server_id: int) -> dict:
+        return COMMANDS_SCHEMA.hash(await self.batcher.load("HGETALL", "commands:{}".format(server_id)))
+
+    async def get_custom_commands_keys(self, server_id: int) -> list:
+        return COMMANDS_SCHEMA.members(await self.batcher.load("HKEYS", "commands:{}".format(server_id))) or []
+
+    async def get_custom_command_by_key(self, server_id: int, key: str) -> str:
+        return COMMANDS_SCHEMA.field(key, await self.batcher.load("HGET", "commands:{}".format(server_id), key))
+
+    async def get_command_amount(self, server_id: int) -> int:
+        return await self.batcher.load("HLEN", "commands:{}".format(server_id))
+
+    async def custom_command_exists(self, server_id: int, trigger: str):
+        return await self.batcher.load("HEXISTS", "commands:{}".format(server_id), trigger)
+
+    # CHANNEL BLACKLIST
+    @validate_input
+    async def add_channel_blacklist(self, server_id: int, channel_id: int):
+        return bool(await self.redis.sadd("blacklist:{}".format(server_id), channel_id))
+
+    @validate_input
+    async def remove_channel_blacklist(self, server_id: int, channel_id: int):
+        return bool(await self.redis.srem("blacklist:{}".format(server_id), channel_id))
+
+    async def is_blacklisted(self, server_id, channel_id):
+        return bool(await self.batcher.load("SISMEMBER", "blacklist:{}".format(server_id), channel_id))
+
+    async def get_blacklists(self, server_id):
+        return list(BLACKLIST_SCHEMA.members(await self.batcher.load("SMEMBERS", "blacklist:{}".format(server_id))) or [])
+
+    # PREFIX
+    async def get_prefix(self, server: Guild) -> str:
+        return (await self.get_settings(server.id)).get("prefix")
+
+    @validate_input
+    async def change_prefix(self, server, prefix):
+        await self._update_settings(server.id, {"prefix": prefix})
+
+    # MODERATION
+    async def has_spam_filter(self, server):
+        return (await self.get_settings(server.id)).get(SPAMFILTER_SETTING) is True
+
+    async def has_word_filter(self, server):
+        return (await self.get_settings(server.id)).get(WORDFILTER_SETTING) is True
+
+    async def has_invite_filter(self, server):
+        return (await self.get_settings(server.id)).get(INVITEFILTER_SETTING) is True
+
+    async def get_log_channel(self, server):
+        return (await self.get_settings(server.id)).get("logchannel")
+
+    async def get_defaultchannel(self, server_id):
+        return (await self.get_settings(server_id)).get("dchan")
+
+    @validate_input
+    async def set_defaultchannel(self, server, channel_id):
+        await self._update_settings(server.id, {"dchan": channel_id})
+
+    # SETTINGS
+    @validate_input
+    async def set_custom_channel(self, guild_id, var_name, value):
+        if var_name not in ["logchannel", "dchan"]:
+            raise TypeError("invalid channel type")
+
+        if value is not None:
+            return bin2bool(await self._update_settings(guild_id, {var_name: value}))
+        else:
+            return await self._delete_settings(guild_id, var_name)
+
+    @validate_input
+    async def set_custom_event_message(self, guild_id, var_name, value):
+        if var_name not in ["welcomemsg", "banmsg", "kickmsg", "leavemsg"]:
+            raise TypeError("invalid event type")
+
+        if value is not None:
+            return bin2bool(await self._update_settings(guild_id, {var_name: value}))
+        else:
+            return await self._delete_settings(guild_id, var_name)
+
+    # SLEEPING
+    async def is_sleeping(self, server_id):
+        return (await self.get_settings(server_id)).get("sleeping")
+
+    @validate_input
+    async def set_sleeping(self, server, bool_var):
+        await self._update_settings(server.id, {"sleeping": bool(bool_var)})
+
+    # MUTING
+    @validate_input
+    async def mute(self, server, user_id):
+        return bool(await self.redis.sadd("mutes:{}".format(server.id), user_id))
+
+    @validate_input
+    async def unmute(self, member_id, server_id):
+        return bool(await self.redis.srem("mutes:{}".format(server_id), member_id))
+
+    async def is_muted(self, server, user_id):
+        return bool(await self.batcher.load("SISMEMBER", "mutes:{}".format(server.id), user_id))
+
+    async def get_mute_list(self, server):
+        return list(MUTES_SCHEMA.members(await self.batcher.load("SMEMBERS", "mutes:{}".format(server.id))) or [])
+
+    # LANGUAGES
+    @validate_input
+    async def set_lang(self, server_id, language):
+        await self._update_settings(server_id, {"lang": language})
+
+    async def get_lang(self, server_id):
+        return (await self.get_settings(server_id)).get("lang")
+
+    # SELFROLES
+    async def get_selfroles(self, server_id):
+        return SELFROLES_SCHEMA.members(await self.batcher.load("SMEMBERS", "sr:{}".format(server_id)))
+
+    @validate_input
+    async def add_selfrole(self, server_id, role_name):
+        return bin2bool(await self.redis.sadd("sr:{}".format(server_id), role_name))
+
+    @validate_input
+    async def remove_selfrole(self, server_id, role_name):
+        return bin2bool(await self.redis.srem("sr:{}".format(server_id), role_name))
+
+    async def is_selfrole(self, server_id, role_name):
+        return bin2bool(await self.batcher.load("SISMEMBER", "sr:{}".format(server_id), role_name))
+
+    # WORD FILTER
+    async def get_banned_words(self, server_id):
+        return WORDS_SCHEMA.members(await self.batcher.load("SMEMBERS", "words:{}".format(server_id)))
+
+    @validate_input
+    async def add_banned_word(self, server_id, word):
+        return bin2bool(await self.redis.sadd("words:{}".format(server_id), word))
+
+    @validate_input
+    async def remove_banned_word(self, server_id, word):
+        return bin2bool(await self.redis.srem("words:{}".format(server_id), word))
+
+    # Special debug methods
+    async def db_info(self, section=None):
+        return decode(await self.redis.info(section=section))
+
+    async def db_size(self):
+        return int(await self.redis.dbsize())
+
+    # Plugin storage system
+    def get_plugin_data_manager(self, namespace, *args, **kwargs) -> "AsyncRedisPluginDataManager":
+        return AsyncRedisPluginDataManager(DATA, namespace, *args, **kwargs)
+
+    def _get_redis_instance(self):
+        return self.redis
+
+
+class AsyncRedisPluginDataManager:
+    """
+    asyncio version of RedisPluginDataManager
+    """
+    def __init__(self, instance=DATA, namespace=None, schema: Schema=None, *_, **__):
+        self.namespace = namespace
+        self.redis = self.make_client(instance, namespace)
+        self.batcher = CommandBatcher(self.redis)
+        self.schema = schema or UntypedSchema(namespace)
+
+        log.info("New async plugin namespace registered: {}".format(self.namespace or "(no namespace)"))
+
+    @staticmethod
+    def make_client(instance, namespace):
+        return ConnectionManager().async_client(namespace or instance, instance)
+
+    _make_key = RedisPluginDataManager._make_key
+
+    async def set(self, key, val, **kwargs):
+        return decode(await self.redis.set(self._make_key(key), val, **kwargs))
+
+    async def get(self, key):
+        return self.schema.field(key, await self.batcher.load("GET", self._make_key(key)))
+
+    async def hget(self, name, field, use_namespace=True):
+        return self.schema.field(field, await self.batcher.load("HGET", self._make_key(name) if use_namespace else name, field))
+
+    async def hgetall(self, name, use_namespace=True):
+        return self.schema.hash(await self.batcher.load("HGETALL", self._make_key(name) if use_namespace else name))
+
+    async def hdel(self, name, field):
+        return decode(await self.redis.hdel(self._make_key(name), field))
+
+    async def hmset(self, name, payload):
+        return await self.redis.hset(self._make_key(name), mapping=payload)
+
+    async def hset(self, name, field, value):
+        return decode(await self.redis.hset(self._make_key(name), field, value))
+
+    async def hexists(self, name, field):
+        return await self.batcher.load("HEXISTS", name, field)
+
+    async def exists(self, name, use_namespace=True):
+        return await self.batcher.load("EXISTS", self._make_key(name) if use_namespace else name)
+
+    async def delete(self, name, use_namespace=True):
+        return await self.redis.delete(self._make_key(name) if use_namespace else name)
+
+    async def scan(self, cursor, use_namespace=True, match=None, **kwargs):
+        match = self._make_key(match) if use_namespace else match
+        return await self.redis.scan(cursor, match=match, **kwargs)
+
+    async def sscan(self, name, cursor, use_namespace=True, match=None, **kwargs):
+        match = self._make_key(match) if use_namespace else match
+        return await self.redis.sscan(name, cursor, match=match, **kwargs)
+
+    async def scan_iter(self, match, use_namespace=True):
+        match = self._make_key(match) if use_namespace else match
+        return [a.decode() async for a in self.redis.scan_iter(match)]
+
+    async def sscan_iter(self, name, match=None, use_namespace=True):
+        name = self._make_key(name) if use_namespace else name
+        return [a.decode() async for a in self.redis.sscan_iter(name, match)]
+
+    async def lpush(self, key, value):
+        return await self.redis.lpush(self._make_key(key), value)
+
+    async def lrange(self, key, from_key=0, to_key=-1):
+        return self.schema.members(await self.batcher.load("LRANGE", self._make_key(key), from_key, to_key))
+
+    async def lrem(self, key, value, count=1):
+        return decode(await self.redis.lrem(self._make_key(key), count, value))
+
+    async def lpop(self, key):
+        return self.schema.value(await self.redis.lpop(self._make_key(key)))
+
+    async def sadd(self, name, *values):
+        return await self.redis.sadd(self._make_key(name), *values)
+
+    async def srandmember(self, name, amount=1):
+        return self.schema.members(await self.redis.srandmember(self._make_key(name), amount))
+
+    async def scard(self, name):
+        return await self.batcher.load("SCARD", self._make_key(name))
+
+    def pipeline(self, **options):
+        # Commands are queued synchronously, only execute() is awaited
+        return self.redis.pipeline(**options)
+
+    async def expire(self, name, time):
+        return await self.redis.expire(name, int(time))
+
+    async def ttl(self, name):
+        return decode(await self.batcher.load("TTL", name))
+
+
+class AsyncRedisCacheHandler(AsyncRedisPluginDataManager, ServerHandler, metaclass=Singleton):
+    def __init__(self):
+        if aioredis is None:
+            raise RuntimeError("redis.asyncio is not available, install redis>=4.2")
+
+        self.pool = ConnectionManager().get_async_pool(CACHE)
+
+        super().__init__(CACHE)
+
+    def get_plugin_data_manager(self, namespace, schema: Schema=None):
+        return AsyncRedisPluginDataManager(CACHE, namespace, schema)
+
+
+# Embedded backends ("backend = sqlite" or "memory" under [Storage])
+# The handlers above only talk to their client, so these just swap it for SQLiteRedis (see core/localstore.py)
+
+
+def _local_layout():
+    # The compact layout needs EVAL
+    layout = ServerHandler.get_keyspace_layout()
+    if layout.name == LAYOUT_COMPACT:
+        log.warning("The compact keyspace layout needs Redis, using the legacy layout with sqlite")
+
+    return make_layout(LAYOUT_LEGACY)
+
+
+class SQLiteServerHandler(RedisServerHandler):
+    def connect(self):
+        self.redis = open_store(DATA)
+
+    def get_client(self, namespace: str):
+        return self.redis
+
+    @staticmethod
+    def get_keyspace_layout():
+        return _local_layout()
+
+    def verify_connection(self):
+        log.info("Using the sqlite database at {}".format(self.redis.path))
+
+    def get_plugin_data_manager(self, namespace, *args, **kwargs) -> "SQLitePluginDataManager":
+        return SQLitePluginDataManager(DATA, namespace, *args, **kwargs)
+
+
+class SQLitePluginDataManager(RedisPluginDataManager):
+    @staticmethod
+    def make_client(instance, namespace):
+        return open_store(instance)
+
+
+class SQLiteCacheHandler(SQLitePluginDataManager, ServerHandler, metaclass=Singleton):
+    def __init__(self):
+        self.pool = None
+
+        super().__init__(CACHE)
+
+    def get_plugin_data_manager(self, namespace, schema: Schema=None):
+        return SQLitePluginDataManager(CACHE, namespace, schema)
+
+
+class AsyncSQLiteServerHandler(AsyncRedisServerHandler):
+    def connect(self):
+        self.redis = AsyncSQLiteRedis(open_store(DATA))
+
+    @staticmethod
+    def get_keyspace_layout():
+        return _local_layout()
+
+    async def verify_connection(self):
+        log.info("Using the sqlite database at {} (asyncio)".format(self.redis.store.path))
+
+    async def watch_invalidations(self):
+        # Both handlers share the in-process caches and nothing else writes to the database
+        return
+
+    def get_plugin_data_manager(self, namespace, *args, **kwargs) -> "AsyncSQLitePluginDataManager":
+        return AsyncSQLitePluginDataManager(DATA, namespace, *args, **kwargs)
+
+
+class AsyncSQLitePluginDataManager(AsyncRedisPluginDataManager):
+    @staticmethod
+    def make_client(instance, namespace):
+        return AsyncSQLiteRedis(open_store(instance))
+
+
+class AsyncSQLiteCacheHandler(AsyncSQLitePluginDataManager, ServerHandler, metaclass=Singleton):
+    def __init__(self):
+        self.pool = None
 
-        super().__init__(self.pool)
+        super().__init__(CACHE)
 
-    def get_plugin_data_manager(self, namespace):
-        return RedisPluginDataManager(self.pool, namespace)
+    def get_plugin_data_manager(self, namespace, schema: Schema=None):
+        return AsyncSQLitePluginDataManager(CACHE, namespace, schema)
@@ -3,6 +3,7 @@ import configparser
 import logging
 import redis
 from .utils import decode
+from .schema import STATS_SCHEMA
 
 __author__ = "DefaltSimon"
 # Stats handler for Nano
@@ -38,15 +39,14 @@ stat_types = [MESSAGE, WRONG_ARG, SERVER_LEFT, SLEPT, WRONG_PERMS, HELP, IMAGE_S
 class NanoStats:
     __slots__ = ("_redis", "redis", "loop", "_pending_data", "MAX_BEFORE_UPDATE")
 
-    def __init__(self, loop, redis_ip, redis_port, redis_pass):
+    def __init__(self, loop, redis_client):
         self.loop = loop
-        self.redis = None
+        # Shares the data instance's pool, see ConnectionManager.client
+        self.redis = redis_client
 
         self._pending_data = {a: 0 for a in stat_types}
         self.MAX_BEFORE_UPDATE = 5
 
-        self.redis = redis.StrictRedis(host=redis_ip, port=redis_port, password=redis_pass)
-
         try:
             self.redis.ping()
         except redis.ConnectionError:
@@ -77,10 +77,10 @@ class NanoStats:
             self._pending_data[stat_type] = 0
 
     def get_data(self):
-        return decode(self.redis.hgetall("stats"))
+        return STATS_SCHEMA.hash(self.redis.hgetall("stats"))
 
     def get_amount(self, typ):
         if typ not in stat_types:
             raise TypeError("invalid type")
 
-        return decode(self.redis.hget("stats", typ))
+        return STATS_SCHEMA.field(typ, self.redis.hget("stats", typ))
@@ -0,0 +1,415 @@
+# coding=utf-8
+import logging
+import re
+import sys
+import time
+from datetime import datetime
+from random import randint
+
+from .utils import DynamicResponse, CmdResponseTypes, IgnoredException, filter_text
+
+__author__ = "DefaltSimon"
+# Dynamic custom command responses ({author|name}, {rnd|1|6}, ...)
+
+log = logging.getLogger(__name__)
+log.setLevel(logging.INFO)
+
+# CONSTANTS
+
+# Templates with more groups than this are sent as plain text
+MAX_TEMPLATE_GROUPS = 25
+# Discord's message length limit
+MAX_RENDERED_LENGTH = 2000
+
+GROUP_PATTERN = re.compile(r"({.+?})")
+
+
+# Utility for non-failable get operator
+def l_get(lst, index, fallback=None):
+    return lst[index] if len(lst) > index else fallback
+
+
+class Parser:
+    __slots__ = ("pt", )
+
+    def __init__(self):
+        # Used to capture parsing groups
+        self.pt = re.compile(r"({.+?})")
+
+    def _split_groups(self, text):
+        text_list = []
+
+        # Splits the text on every group in the match
+        c_ind = 0
+        gr = self.pt.finditer(text)
+        for m in gr:
+            st = m.start()
+            en = m.end()
+
+            text_list.append(text[c_ind:st])
+            text_list.append(text[st:en])
+            # Set last char index
+            c_ind = en
+
+        # Append the last group
+        last = text[c_ind:len(text)]
+        text_list.append(last)
+
+        return text_list
+
+    @staticmethod
+    def _parse_group(group, ctx):
+        name, *tokens = group.split("|")
+        if len(tokens) != 0:
+            first, *tokens = tokens
+        else:
+            first = None
+
+        # Actually gets the result
+        # whole system in this function because of performance
+
+        # 1. Author stuff
+        if name == "author":
+            if first == "name":
+                return ctx.author.display_name
+            if first == "id":
+                return ctx.author.id
+            if first == "mention":
+                return ctx.author.mention
+            if first == "discrim":
+                return ctx.author.discriminator
+            if first == "avatar":
+                return ctx.author.avatar_url or ctx.author.default_avatar_url
+            else:
+                return ctx.author.name
+
+        # 2. Mention stuff
+        elif name == "mentions":
+            # first == index
+            try:
+                typ = tokens[0]
+            except IndexError:
+                typ = None
+
+            if first:
+                first = int(first)
+            else:
+                first = 0
+
+            try:
+                if typ == "name":
+                    return ctx.mentions[first].display_name
+                if typ == "id":
+                    return ctx.mentions[first].id
+                if typ == "mention":
+                    return ctx.mentions[first].mention
+                if typ == "discrim":
+                    return ctx.mentions[first].discriminator
+                if typ == "avatar":
+                    return ctx.mentions[first].avatar_url or ctx.mentions[first].default_avatar_url
+                else:
+                    return ctx.mentions[first].name
+            except IndexError:
+                raise IndexError("No such mention") from None
+
+        # 3. Random numbers
+        elif name == "rnd":
+            # from is first
+            # to is the second item (index 1)
+            to = l_get(tokens, 0)
+            first = first or 1
+
+            # Two arguments
+            if to:
+                # Assumes both arguments can be ints
+                return randint(int(first), int(to))
+            # Only one
+            else:
+                # Assumes argument is int
+                return randint(0, int(first))
+
+        elif name == "time":
+            # https://docs.python.org/3/library/datetime.html#strftime-strptime-behavior
+            first = first or "format"
+
+            if first == "raw":
+                return time.time()
+            elif first == "now":
+                return datetime.now().strftime("%H:%M %d. of %B, %Y")
+            elif first == "format":
+                return datetime.now().strftime(tokens[0])
+            else:
+                # Defaults to epoch time
+                return time.time()
+
+        elif name == "choose":
+            items = (first, *tokens)
+            chnum = randint(0, len(items) - 1)
+
+            return items[chnum]
+
+        # 4. Failure fallback
+        elif name == "onfail":
+            # onfail|<message> - returns your custom text
+            # onfail|raw - returns the raw exception
+            if first == "raw":
+                return DynamicResponse.register_failure_response(lambda: "Error: " + str(sys.exc_info()[1]))
+            else:
+                return DynamicResponse.register_failure_response(first)
+
+    @staticmethod
+    def _handle_onfail(on_fail):
+        if callable(on_fail):
+            return on_fail()
+        else:
+            return on_fail
+
+    def parse(self, text, ctx):
+        # Ignore stuff that isn't a dynamic command
+        if "{" not in text or "}" not in text:
+            return text
+
+        ls = self._split_groups(text)
+        responses = []
+
+        on_fail = None
+
+        for ind, t in enumerate(ls):
+            if t and (t[0] == "{") and (t[-1] == "}"):
+                # valid group, parse
+                # Cut out { and }
+                try:
+                    result = self._parse_group(t[1:-1], ctx)
+                except Exception:
+                    if on_fail is not None:
+                        return self._handle_onfail(on_fail)
+
+                    raise IgnoredException
+
+                if type(result) is DynamicResponse:
+                    # Special cases (for example: {onfail|text}
+                    if result.intention == CmdResponseTypes.REGISTER_ON_FAIL:
+                        on_fail = result.data
+
+                    # Don't add that class' repr to the list
+                    continue
+
+                responses.append(str(result))
+            # Not a group, just append it to responses
+            else:
+                responses.append(t)
+
+        return "".join(responses)
+
+
+#####
+# Compiled templates
+# Responses are split and parsed once (see compile_template) into a tuple of operations:
+# strings are copied as-is, (function, args) tuples are called with the message.
+# render_template produces the same output as Parser.parse, except that mass mentions
+# in substituted values are escaped.
+#####
+
+def _author(message, field):
+    author = message.author
+
+    if field == "name":
+        return author.display_name
+    if field == "id":
+        return author.id
+    if field == "mention":
+        return author.mention
+    if field == "discrim":
+        return author.discriminator
+    if field == "avatar":
+        return author.avatar_url or author.default_avatar_url
+
+    return author.name
+
+
+def _mention(message, index, field):
+    try:
+        member = message.mentions[index]
+    except IndexError:
+        raise IndexError("No such mention") from None
+
+    if field == "name":
+        return member.display_name
+    if field == "id":
+        return member.id
+    if field == "mention":
+        return member.mention
+    if field == "discrim":
+        return member.discriminator
+    if field == "avatar":
+        return member.avatar_url or member.default_avatar_url
+
+    return member.name
+
+
+def _rnd(_, low, high):
+    return randint(low, high)
+
+
+def _time_raw(_):
+    return time.time()
+
+
+def _time_now(_):
+    return datetime.now().strftime("%H:%M %d. of %B, %Y")
+
+
+def _time_format(_, fmt):
+    return datetime.now().strftime(fmt)
+
+
+def _choose(_, items):
+    return items[randint(0, len(items) - 1)]
+
+
+def _constant(_, value):
+    return value
+
+
+def _raise(_, exc):
+    # Errors found while compiling are raised when rendering, like the interpreted parser did
+    raise exc
+
+
+# Marks {onfail|...}, handled by the renderer itself
+def _onfail(*_):
+    pass
+
+
+ONFAIL_RAW = object()
+
+
+def _compile_group(group: str) -> tuple:
+    name, *tokens = group.split("|")
+    if len(tokens) != 0:
+        first, *tokens = tokens
+    else:
+        first = None
+
+    if name == "author":
+        return _author, (first, )
+
+    elif name == "mentions":
+        try:
+            index = int(first) if first else 0
+        except ValueError as e:
+            return _raise, (e, )
+
+        return _mention, (index, l_get(tokens, 0))
+
+    elif name == "rnd":
+        to = l_get(tokens, 0)
+        first = first or 1
+
+        try:
+            if to:
+                return _rnd, (int(first), int(to))
+            else:
+                return _rnd, (0, int(first))
+        except ValueError as e:
+            return _raise, (e, )
+
+    elif name == "time":
+        first = first or "format"
+
+        if first == "now":
+            return _time_now, ()
+        elif first == "format":
+            if not tokens:
+                return _raise, (IndexError("list index out of range"), )
+
+            return _time_format, (tokens[0], )
+        else:
+            return _time_raw, ()
+
+    elif name == "choose":
+        return _choose, ((first, *tokens), )
+
+    elif name == "onfail":
+        return _onfail, (ONFAIL_RAW if first == "raw" else first, )
+
+    # Unknown groups render as "None", same as before
+    return _constant, (None, )
+
+
+class CompiledTemplate:
+    __slots__ = ("source", "ops", "static")
+
+    def __init__(self, source: str, ops: tuple, static=None):
+        self.source = source
+        self.ops = ops
+        # Set if the template has no groups at all
+        self.static = static
+
+    def __repr__(self):
+        return "<CompiledTemplate ({} ops)>".format(len(self.ops))
+
+
+def compile_template(text) -> CompiledTemplate:
+    text = str(text)
+
+    # Ignore stuff that isn't a dynamic command
+    if "{" not in text or "}" not in text:
+        return CompiledTemplate(text, (), static=text)
+
+    ops = []
+    groups = 0
+    last = 0
+
+    for m in GROUP_PATTERN.finditer(text):
+        if m.start() > last:
+            ops.append(text[last:m.start()])
+
+        ops.append(_compile_group(text[m.start() + 1:m.end() - 1]))
+        groups += 1
+        last = m.end()
+
+    if last < len(text):
+        ops.append(text[last:])
+
+    if groups > MAX_TEMPLATE_GROUPS:
+        log.debug("Template has {} groups, treating it as text".format(groups))
+        return CompiledTemplate(text, (), static=text)
+
+    return CompiledTemplate(text, tuple(ops))
+
+
+def render_template(template: CompiledTemplate, message) -> str:
+    """
+    Renders a compiled template for the message
+
+    :raises IgnoredException: when a group fails and there is no {onfail}
+    """
+    if template.static is not None:
+        return template.static
+
+    parts = []
+    on_fail = None
+
+    for op in template.ops:
+        if op.__class__ is str:
+            parts.append(op)
+            continue
+
+        func, args = op
+        if func is _onfail:
+            on_fail = args[0]
+            continue
+
+        try:
+            # Values come from users (names, choices), so they can't ping everyone
+            parts.append(filter_text(func(message, *args), filter_user_mention=False))
+        except Exception as e:
+            if on_fail is ONFAIL_RAW:
+                return "Error: " + str(e)
+            elif on_fail is not None:
+                return on_fail
+
+            raise IgnoredException
+
+    return "".join(parts)[:MAX_RENDERED_LENGTH]
@@ -0,0 +1,197 @@
+# coding=utf-8
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+from collections import deque
+
+from .confparser import PLUGINS_DIR
+
+__author__ = "DefaltSimon"
+# Event loop lag monitor for Nano
+
+log = logging.getLogger(__name__)
+log.setLevel(logging.INFO)
+
+# CONSTANTS
+
+# How often the heartbeat coroutine wakes up (seconds)
+HEARTBEAT_INTERVAL = 0.05
+# Lag that counts as a stall (seconds)
+STALL_THRESHOLD = 0.1
+# How often the sampling thread checks the heartbeat (seconds)
+SAMPLE_INTERVAL = 0.02
+
+# Amount of recent stalls to keep
+RING_SIZE = 100
+
+PLUGINS_PATH = os.path.abspath(PLUGINS_DIR)
+CORE_PATH = os.path.abspath(os.path.dirname(__file__))
+
+
+class Stall:
+    __slots__ = ("when", "duration", "plugin", "function", "line", "blocking_call")
+
+    def __init__(self, when, duration, plugin, function, line, blocking_call):
+        self.when = when
+        self.duration = duration
+
+        self.plugin = plugin
+        self.function = function
+        self.line = line
+        # Innermost frame, usually the library call that blocked
+        self.blocking_call = blocking_call
+
+    def to_dict(self) -> dict:
+        return {
+            "when": self.when,
+            "duration": round(self.duration, 4),
+            "plugin": self.plugin,
+            "function": self.function,
+            "line": self.line,
+            "blocking_call": self.blocking_call,
+        }
+
+
+def _describe(frame) -> str:
+    code = frame.f_code
+    return "{}:{} ({})".format(os.path.basename(code.co_filename), frame.f_lineno, code.co_name)
+
+
+def attribute_frame(frame) -> tuple:
+    """
+    Walks the stack from the innermost frame outwards and returns the first plugin (or core) frame
+
+    :return: tuple(module name, function name, line number, innermost frame description)
+    """
+    innermost = _describe(frame)
+    core_match = None
+
+    while frame is not None:
+        filename = os.path.abspath(frame.f_code.co_filename)
+
+        if filename.startswith(PLUGINS_PATH):
+            module = os.path.splitext(os.path.basename(filename))[0]
+            return module, frame.f_code.co_name, frame.f_lineno, innermost
+
+        # Remember the innermost core frame in case no plugin is on the stack
+        if core_match is None and filename.startswith(CORE_PATH):
+            module = "core." + os.path.splitext(os.path.basename(filename))[0]
+            core_match = module, frame.f_code.co_name, frame.f_lineno, innermost
+
+        frame = frame.f_back
+
+    return core_match or ("unknown", None, None, innermost)
+
+
+class LoopWatchdog:
+    """
+    Measures event loop lag and blames stalls on whatever was running.
+
+    A heartbeat coroutine wakes up every HEARTBEAT_INTERVAL. A separate thread watches the
+    heartbeat and, if it is late by more than the threshold, captures the loop thread's stack.
+    When the loop comes back, the stall is recorded with the plugin function that was on the stack.
+    """
+    def __init__(self, loop, interval=HEARTBEAT_INTERVAL, threshold=STALL_THRESHOLD):
+        self.loop = loop
+        self.interval = interval
+        self.threshold = threshold
+
+        self.stalls = deque(maxlen=RING_SIZE)
+        # (plugin, function): [count, total duration, worst duration]
+        self.offenders = {}
+
+        self.max_lag = 0
+        self.last_lag = 0
+        self.beats = 0
+
+        self._last_beat = time.monotonic()
+        self._loop_thread = None
+        # Stack captured by the sampling thread for the current beat
+        self._captured = None
+
+        self._thread = None
+        self.running = False
+
+    def start(self):
+        if self.running:
+            return
+
+        self.running = True
+        self.loop.create_task(self.heartbeat())
+
+        self._thread = threading.Thread(target=self._sample, name="LoopWatchdog", daemon=True)
+        self._thread.start()
+
+        log.info("Loop watchdog enabled (threshold: {}ms)".format(int(self.threshold * 1000)))
+
+    def stop(self):
+        self.running = False
+
+    async def heartbeat(self):
+        self._loop_thread = threading.get_ident()
+
+        while self.running:
+            self._last_beat = time.monotonic()
+            await asyncio.sleep(self.interval)
+
+            lag = time.monotonic() - self._last_beat - self.interval
+            self.last_lag = lag
+            self.beats += 1
+
+            if lag > self.max_lag:
+                self.max_lag = lag
+
+            captured, self._captured = self._captured, None
+            if captured is not None and lag >= self.threshold:
+                self._record(lag, captured)
+
+    def _sample(self):
+        while self.running:
+            time.sleep(SAMPLE_INTERVAL)
+
+            # Only capture once per late beat
+            if self._captured is not None or self._loop_thread is None:
+                continue
+
+            if time.monotonic() - self._last_beat < self.interval + self.threshold:
+                continue
+
+            frame = sys._current_frames().get(self._loop_thread)
+            if frame is None:
+                continue
+
+            self._captured = attribute_frame(frame)
+            del frame
+
+    def _record(self, lag: float, captured: tuple):
+        plugin, function, line, blocking_call = captured
+
+        self.stalls.append(Stall(time.time(), lag, plugin, function, line, blocking_call))
+
+        entry = self.offenders.get((plugin, function))
+        if entry is None:
+            self.offenders[(plugin, function)] = [1, lag, lag]
+        else:
+            entry[0] += 1
+            entry[1] += lag
+            entry[2] = max(entry[2], lag)
+
+        log.warning("Event loop stalled for {}ms in {}.{} (line {}, {})"
+                    .format(int(lag * 1000), plugin, function, line, blocking_call))
+
+    def worst_offenders(self, amount: int=10) -> list:
+        """
+        Returns a list of (plugin, function, count, total, worst) sorted by total stall time
+        """
+        items = [(plugin, function, *data) for (plugin, function), data in self.offenders.items()]
+        items.sort(key=lambda a: a[3], reverse=True)
+
+        return items[:amount]
+
+    def reset(self):
+        self.stalls.clear()
+        self.offenders = {}
+        self.max_lag = 0
@@ -0,0 +1,84 @@
+# coding=utf-8
+import argparse
+import asyncio
+import logging
+import os
+import sys
+
+import discord
+
+from core.cluster import ClusterSupervisor, get_cluster_settings, shard_ranges
+from core.confparser import get_settings_parser
+
+__author__ = "DefaltSimon"
+
+#########################################
+# Cluster launcher
+# Runs Nano as several processes, each one connecting a contiguous range of shards ([Cluster] in settings.ini).
+# Crashed clusters are restarted with a backoff, nano.restart and nano.kill apply to all of them
+# and commands like !status add up every cluster's numbers over a local TCP connection.
+#
+# Run from the repository root (instead of nano.py):
+#   python launcher.py
+#   python launcher.py --clusters 4 --shards 16
+#########################################
+
+logging.basicConfig(level=logging.INFO)
+log = logging.getLogger(__name__)
+
+parser = get_settings_parser()
+
+NANO_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "nano.py")
+
+
+async def recommended_shards(token: str) -> int:
+    http = discord.http.HTTPClient()
+
+    try:
+        await http.static_login(token, bot=True)
+        shards, _ = await http.get_bot_gateway()
+    finally:
+        await http.close()
+
+    return shards
+
+
+async def main(args) -> int:
+    clusters, shard_count, port = get_cluster_settings()
+
+    clusters = args.clusters or clusters
+    shard_count = args.shards or shard_count
+    port = args.port or port
+
+    if not shard_count:
+        token = parser.get("Credentials", "token", fallback="").strip()
+        if not token:
+            log.critical("Token not found. Check your settings.ini")
+            return 1
+
+        shard_count = await recommended_shards(token)
+        log.info("Discord recommends {} shards".format(shard_count))
+
+    ranges = shard_ranges(shard_count, clusters)
+    if len(ranges) < clusters:
+        log.warning("Only {} shards, running {} clusters instead of {}".format(shard_count, len(ranges), clusters))
+
+    supervisor = ClusterSupervisor(asyncio.get_event_loop(), [sys.executable, NANO_SCRIPT],
+                                   shard_count, len(ranges), port)
+    await supervisor.run()
+
+    return 0
+
+
+if __name__ == "__main__":
+    arguments = argparse.ArgumentParser(description="Runs Nano as multiple shard clusters")
+    arguments.add_argument("--clusters", type=int, help="worker processes (overrides [Cluster] clusters)")
+    arguments.add_argument("--shards", type=int, help="total shards (overrides [Cluster] shard_count)")
+    arguments.add_argument("--port", type=int, help="IPC port (overrides [Cluster] ipc_port)")
+
+    # Subprocesses need the proactor loop on Windows (the default selector loop before Python 3.8 can't start them)
+    if sys.platform == "win32":
+        asyncio.set_event_loop(asyncio.ProactorEventLoop())
+
+    loop = asyncio.get_event_loop()
+    sys.exit(loop.run_until_complete(main(arguments.parse_args())))
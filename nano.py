@@ -8,10 +8,18 @@ import time
 import discord
 import traceback
 
+from core.capture import TrafficRecorder
+from core.cluster import ClusterInfo, ClusterClient
+from core.connections import ConnectionManager
+from core.jobs import JobCoordinator
+from core.events import EventContext, Pipeline, PipelineStage, UNRESOLVED, compile_pipelines
+from core.metrics import LatencyRegistry, clock
+from core.router import CommandRouter
 from core.serverhandler import ServerHandler
 from core.stats import NanoStats
 from core.translations import TranslationManager
 from core.utils import log_to_file
+from core.watchdog import LoopWatchdog
 from core.confparser import get_settings_parser, PLUGINS_DIR
 
 __title__ = "Nano"
@@ -76,13 +84,21 @@ parser = get_settings_parser()
 loop = asyncio.get_event_loop()
 
 # NOW USES AUTOSHARDING
-client = discord.AutoShardedClient(loop=loop)
+# Started by launcher.py, this process only runs its cluster's shards (see core/cluster.py)
+cluster_info = ClusterInfo.from_environment()
+
+if cluster_info:
+    client = discord.AutoShardedClient(loop=loop, shard_ids=cluster_info.shard_ids,
+                                       shard_count=cluster_info.shard_count)
+else:
+    client = discord.AutoShardedClient(loop=loop)
 
 log.info("Initializing ServerHandler and NanoStats...")
 
 # Setup the server data and stats
 handler = ServerHandler.get_handler(loop)
-stats = NanoStats(loop, *ServerHandler.get_redis_credentials())
+async_handler = ServerHandler.get_async_handler()
+stats = NanoStats(loop, handler.get_client("stats"))
 trans = TranslationManager()
 
 
@@ -94,6 +110,11 @@ class PluginObject:
         self.instance = instance
         self.events = self.handler.events
 
+        # Routed plugins only receive on_message for their own commands (see core/router.py)
+        self.routed = getattr(self.handler, "routed", False)
+        # Events in which this plugin may stop or annotate the event, the rest run concurrently
+        self.gating = set(getattr(self.handler, "gating", ()))
+
 
 # Singleton metaclass
 class Singleton(type):
@@ -117,8 +138,21 @@ class Nano(metaclass=Singleton):
         # Plugin-related
         self.plugin_names = []
         self.plugins = {}
-        self.plugin_events = {a: [] for a in EVENTS}
-        self.event_types = set(self.plugin_events.keys())
+        # Compiled callbacks for each event (see core/events.py)
+        self.pipelines = {a: Pipeline() for a in EVENTS}
+
+        # Command routing
+        self.router = CommandRouter()
+
+        # Per-plugin, per-event latency
+        self.latency = LatencyRegistry()
+        # Event loop lag and blocking calls
+        self.watchdog = LoopWatchdog(loop)
+
+        # IPC with the other clusters, None when not started by launcher.py
+        self.cluster = ClusterClient(cluster_info, loop) if cluster_info else None
+        # Background loops of plugins, run once per deployment (see core/jobs.py)
+        self.jobs = JobCoordinator(loop, cluster_info)
 
         # Updates the plugin list
         self.update_plugins()
@@ -171,6 +205,7 @@ class Nano(metaclass=Singleton):
                 inst = handler_cls(client=client,
                                    loop=loop,
                                    handler=handler,
+                                   async_handler=async_handler,
                                    nano=self,
                                    stats=stats,
                                    trans=trans)
@@ -248,6 +283,7 @@ class Nano(metaclass=Singleton):
             inst = handler_cls(client=client,
                                loop=loop,
                                handler=handler,
+                               async_handler=async_handler,
                                nano=self,
                                stats=stats,
                                trans=trans)
@@ -277,23 +313,27 @@ class Nano(metaclass=Singleton):
     def _parse_priorities(self):
         log.info("Parsing priorities...")
 
-        temp = {}
+        stages = []
 
-        for p in self.plugins.values():
+        for name, p in self.plugins.items():
             assert isinstance(p, PluginObject)
 
             for ev_name, priority in p.events.items():
-                if not temp.get(ev_name):
-                    temp[ev_name] = []
+                callback = getattr(p.instance, ev_name)
+                routed = p.routed and ev_name == ON_MESSAGE
+                gating = ev_name in p.gating
 
-                temp[ev_name].append({"callback": getattr(p.instance, ev_name), "importance": priority})
+                stage = PipelineStage(name, callback, priority, routed=routed, gating=gating,
+                                      histogram=self.latency.get(name, ev_name))
+                stages.append((ev_name, stage))
 
-        # Order callbacks
-        for event, unordered in temp.items():
-            ordered = sorted(unordered, key=lambda a: a["importance"])
-            ordered = [i["callback"] for i in ordered]
+        # Order callbacks into per-event pipelines
+        pipelines = {a: Pipeline() for a in EVENTS}
+        pipelines.update(compile_pipelines(stages))
 
-            self.plugin_events[event] = ordered
+        self.pipelines = pipelines
+        # Rebuilt along with priorities so reloaded plugins get their commands routed
+        self.router = CommandRouter.from_plugins(self.plugins)
 
     def get_plugin(self, name: str) -> dict:
         if name.endswith(".py"):
@@ -301,146 +341,185 @@ class Nano(metaclass=Singleton):
 
         return self.plugins[name]
 
+    def _routes_to(self, stage: PipelineStage, message, ctx: EventContext) -> bool:
+        # Owner of the command in the message, resolved when the first routed plugin is reached
+        if ctx.owner is UNRESOLVED:
+            ctx.owner = self.router.get_owner(message.content, ctx.prefix)
+
+        return ctx.owner == stage.plugin
+
+    @staticmethod
+    async def _run_stage(stage: PipelineStage, args: tuple, ctx: EventContext):
+        started = clock()
+        failed = True
+
+        # Execute the corresponding method in the plugin
+        try:
+            if stage.takes_context:
+                resp = await stage.callback(*args, ctx=ctx)
+            else:
+                resp = await stage.callback(*args, **ctx.as_kwargs())
+
+            failed = False
+        finally:
+            stage.histogram.record(clock() - started, failed)
+
+        # COMMUNICATION
+        # Plugins that don't use the context return the old string commands
+        if resp:
+            ctx.apply_response(resp)
+
+    async def _run_isolated(self, stage: PipelineStage, args: tuple, ctx: EventContext):
+        try:
+            await self._run_stage(stage, args, ctx)
+        except Exception:
+            # Don't report errors of error handlers, that could loop forever
+            if ctx.event == ON_ERROR:
+                log.critical(traceback.format_exc())
+                return
+
+            # Same path as exceptions raised directly in discord events
+            await self.dispatch_event(ON_ERROR, ctx.event, *args)
+
     async def dispatch_event(self, event_type, *args, **kwargs):
         """
         Dispatches any discord event (for example: on_message)
         """
-        if event_type not in self.event_types:
+        pipeline = self.pipelines.get(event_type)
+        if pipeline is None:
             log.warning("No such event: {}".format(event_type))
             return
 
         # If there is no registered event, quit
-        if not self.plugin_events[event_type]:
+        if not pipeline:
             return
 
+        ctx = EventContext(event_type, kwargs)
+
+        # GATING
         # Plugins have already been ordered from most important to least important
-        for cb in self.plugin_events[event_type]:
-            # log.debug("Executing plugin {}:{}".format(cb.strip(".py"), event_type))
+        for stage in pipeline.gating:
+            # Routed plugins are only called if they own the command in the message
+            if stage.routed and not self._routes_to(stage, args[0], ctx):
+                continue
 
-            # Execute the corresponding method in the plugin
-            resp = await cb(*args, **kwargs)
+            await self._run_stage(stage, args, ctx)
 
-            # COMMUNICATION
-            # If data is passed, assign proper variables
-            if not resp:
-                continue
+            if ctx.stop:
+                break
 
-            if type(resp) is not list:
-                resp = (resp, )
-
-            # Multiple commands can be passed in a form of a tuple
-            for cmd in resp:
-                # Parse additional variables
-                if type(cmd) in (tuple, list, set):
-                    # Unpacks parameters
-                    cmd, arguments, *safe = cmd
-
-                # No additional arguments
-                else:
-                    arguments = ()
-
-                # Makes communication between the core and plugins possible
-
-                # RETURN
-                # Exits the current event immediately and doesn't call any more plugins
-                if cmd == "return":
-                    return
-
-                # ADD_VAR
-                # Adds a variable to the current kwargs
-                elif cmd == "add_var":
-                    if type(arguments) is tuple:
-                        # Arguments must be a dict
-                        for k, v in arguments[0].items():
-                            kwargs[k] = v
-                    else:
-                        for k, v in arguments.items():
-                            kwargs[k] = v
-
-                # SHUTDOWN
-                # Calls the ON_SHUTDOWN event, then exists
-                elif cmd == "shutdown":
-                    try:
-                        await self.dispatch_event(ON_SHUTDOWN)
-
-                    finally:
-                        # Sys.exit is usually handled by developer.py in the ON_SHUTDOWN event
-                        # but it is here as backup as well
-                        sys.exit(0)
+        # TERMINAL
+        # Independent plugins run concurrently, an exception in one doesn't affect the others
+        if not ctx.stop:
+            terminal = [stage for stage in pipeline.terminal
+                        if not stage.routed or self._routes_to(stage, args[0], ctx)]
+
+            if len(terminal) == 1:
+                await self._run_isolated(terminal[0], args, ctx)
+            elif terminal:
+                await asyncio.gather(*[self._run_isolated(stage, args, ctx) for stage in terminal])
+
+        # SHUTDOWN
+        # Calls the ON_SHUTDOWN event, then exists
+        if ctx.shutdown:
+            try:
+                await self.dispatch_event(ON_SHUTDOWN)
+
+            finally:
+                # Sys.exit is usually handled by developer.py in the ON_SHUTDOWN event
+                # but it is here as backup as well
+                sys.exit(0)
 
 
 nano = Nano()
 
+# Anonymized event capture, see [Capture] in settings.ini and utilities/replay_capture.py
+recorder = TrafficRecorder.from_settings(lambda: nano.router)
+
 # DISCORD EVENTS -> NANO EVENTS
 
 
 @client.event
 async def on_message(message):
+    recorder.record(ON_MESSAGE, message)
     await nano.dispatch_event(ON_MESSAGE, message)
 
 
 @client.event
 async def on_reaction_add(reaction, user):
+    recorder.record(ON_REACTION_ADD, reaction, user)
     await nano.dispatch_event(ON_REACTION_ADD, reaction, user)
 
 
 @client.event
 async def on_message_delete(message):
+    recorder.record(ON_MESSAGE_DELETE, message)
     await nano.dispatch_event(ON_MESSAGE_DELETE, message)
 
 
 @client.event
 async def on_message_edit(before, after):
+    recorder.record(ON_MESSAGE_EDIT, before, after)
     await nano.dispatch_event(ON_MESSAGE_EDIT, before, after)
 
 
 @client.event
 async def on_channel_delete(channel):
+    recorder.record(ON_CHANNEL_DELETE, channel)
     await nano.dispatch_event(ON_CHANNEL_DELETE, channel)
 
 
 @client.event
 async def on_channel_create(channel):
+    recorder.record(ON_CHANNEL_CREATE, channel)
     await nano.dispatch_event(ON_CHANNEL_DELETE, channel)
 
 
 @client.event
 async def on_channel_update(before, after):
+    recorder.record(ON_CHANNEL_UPDATE, before, after)
     await nano.dispatch_event(ON_CHANNEL_UPDATE, before, after)
 
 
 @client.event
 async def on_member_join(member):
+    recorder.record(ON_MEMBER_JOIN, member)
     await nano.dispatch_event(ON_MEMBER_JOIN, member)
 
 
 @client.event
 async def on_member_remove(member):
+    recorder.record(ON_MEMBER_REMOVE, member)
     await nano.dispatch_event(ON_MEMBER_REMOVE, member)
 
 
 @client.event
 async def on_member_update(before, after):
+    recorder.record(ON_MEMBER_UPDATE, before, after)
     await nano.dispatch_event(ON_MEMBER_UPDATE, before, after)
 
 
 @client.event
 async def on_member_ban(guild, user):
+    recorder.record(ON_MEMBER_BAN, guild, user)
     await nano.dispatch_event(ON_MEMBER_BAN, guild, user)
 
 
 @client.event
 async def on_member_unban(guild, member):
+    recorder.record(ON_MEMBER_UNBAN, guild, member)
     await nano.dispatch_event(ON_MEMBER_UNBAN, guild, member)
 
 
 @client.event
 async def on_guild_join(guild):
+    recorder.record(ON_GUILD_JOIN, guild)
     await nano.dispatch_event(ON_GUILD_JOIN, guild)
 
 
 @client.event
 async def on_guild_remove(guild):
+    recorder.record(ON_GUILD_REMOVE, guild)
     await nano.dispatch_event(ON_GUILD_REMOVE, guild)
 
 
@@ -477,10 +556,35 @@ async def start():
 
     token = parser.get("Credentials", "token")
 
+    await async_handler.verify_connection()
+    nano.watchdog.start()
+
+    # Pings Redis in the background (see nano.dev.redis)
+    loop.create_task(ConnectionManager().monitor())
+
+    # Evict guild settings and custom commands changed by other processes
+    loop.create_task(async_handler.watch_invalidations())
+
+    if nano.cluster:
+        log.info("Running as cluster {}/{}, shards {}".format(cluster_info.cluster_id, cluster_info.clusters,
+                                                               cluster_info.shard_ids))
+        nano.cluster.on_stop = stop_cluster
+        loop.create_task(nano.cluster.run())
+
+    loop.create_task(nano.jobs.run())
+
     await client.login(token)
     await client.connect()
 
 
+async def stop_cluster():
+    # The supervisor is shutting down or restarting every cluster
+    nano.cluster.running = False
+
+    await nano.dispatch_event(ON_SHUTDOWN)
+    await client.logout()
+
+
 def main():
     try:
         print("Connecting to Discord...", end="")
@@ -497,6 +601,10 @@ def main():
         log.critical("Shutting down...")
 
     finally:
+        # Lets another process take over the leader jobs right away
+        loop.run_until_complete(nano.jobs.close())
+
+        recorder.close()
         loop.close()
 
 
@@ -9,11 +9,12 @@ from typing import Union
 from discord import utils, Client, Embed, TextChannel, Colour, DiscordException, Object, HTTPException
 
 from core.serverhandler import INVITEFILTER_SETTING, SPAMFILTER_SETTING, WORDFILTER_SETTING
-from core.utils import convert_to_seconds, matches_iterable, is_valid_command, StandardEmoji, \
+from core.utils import convert_to_seconds, matches_iterable, StandardEmoji, \
                        resolve_time, log_to_file, is_disabled, IgnoredException, parse_special_chars, \
                        apply_string_padding
 
 from core.stats import MESSAGE
+from core.schema import Schema, MODERATION_SCHEMA, to_int
 
 
 #####
@@ -29,6 +30,7 @@ CMD_LIMIT = 40
 CMD_LIMIT_T = 40
 CMD_LIMIT_A = 1000
 SELFROLE_MAX = 35
+WORDFILTER_MAX = 100
 PREFIX_MAX = 50
 BLACKLIST_MAX = 35
 TICK_DURATION = 15
@@ -38,6 +40,9 @@ NEW_PAGE_BEFORE = 2000 - (CMD_LIMIT_T + CMD_LIMIT_A + 150)
 
 # 15 seconds
 REMINDER_MIN = 15
+
+# softban:{guild id} -> {user id: unban time}
+SOFTBAN_SCHEMA = Schema("softban", key=to_int, default=to_int)
 # 5 Days
 REMINDER_MAX = 5 * 24 * 60 * 60
 
@@ -85,7 +90,10 @@ commands = {
     "nano.blacklist list": {"desc": "Shows all blacklisted channels on this server", "use": "[command]"},
 
     "nano.settings": {"desc": "Sets server settings like word, spam, invite filtering, log channel and selfrole.\nPossible setting keyords: `wordfilter`, `spamfilter`, `invitefilter`, `logchannel`, `selfrole`, `defaultchannel`", "use": "[command] [setting] True/False/Something else"},
-    "nano.settings wordfilter": {"desc": "Turns the swearing filter on or off.", "use": "[command] True/False"},
+    "nano.settings wordfilter": {"desc": "Turns the swearing filter on or off.\nSubcommands: `add` `remove` `list` (the server's own banned words)", "use": "[command] True/False"},
+    "nano.settings wordfilter add": {"desc": "Adds a word or phrase to the server's banned words.", "use": "[command] [word]"},
+    "nano.settings wordfilter remove": {"desc": "Removes a word or phrase from the server's banned words.", "use": "[command] [word]"},
+    "nano.settings wordfilter list": {"desc": "Lists the server's own banned words.", "use": "[command]"},
     "nano.settings spamfilter": {"desc": "Turns the spam filter on or off. (please note, this is only a gibberish filter)", "use": "[command] True/False"},
     "nano.settings invitefilter": {"desc": "Turns the invite filter on or off. All links except those sent by Nano Mods or higher will be deleted.", "use": "[command] True/False"},
     "nano.settings logchannel": {"desc": "Sets the channel you want Nano to log events into (this includes join/leave/... events and also some command executions)", "use": "[command] True/False"},
@@ -116,17 +124,14 @@ commands = {
 
 }
 
-# !cmds conflicts with !cmd add/etc...
-ignore_commands = [
-    "_cmds"
-]
-
 
 class RedisSoftBanScheduler:
-    def __init__(self, client, handler, loop=asyncio.get_event_loop()):
+    def __init__(self, client, handler, loop=asyncio.get_event_loop(), owns=None):
         self.client = client
         self.loop = loop
-        self.redis = handler.get_plugin_data_manager(namespace="softban")
+        # Tells whether a guild is handled by this process (see core/jobs.py)
+        self.owns = owns or (lambda _: True)
+        self.redis = handler.get_plugin_data_manager(namespace="softban", schema=SOFTBAN_SCHEMA)
 
     def get_guild_bans(self, guild_id) -> dict:
         return self.redis.hgetall(guild_id)
@@ -183,6 +188,9 @@ class RedisSoftBanScheduler:
         while True:
             # Iterate through users and their reminders
             for guild_id, ban in self.get_all_bans().items():
+                if not self.owns(int(guild_id)):
+                    continue
+
                 # If time is up, unban the user
                 for user, tm in ban.items():
                     if int(tm) <= last_time:
@@ -417,8 +425,8 @@ class Admin:
         self.trans = kwargs.get("trans")
         self.nano = kwargs.get("nano")
 
-        self.timer = RedisSoftBanScheduler(self.client, self.handler, self.loop)
-        self.loop.create_task(self.timer.start_monitoring())
+        self.timer = RedisSoftBanScheduler(self.client, self.handler, self.loop, self.nano.jobs.owns)
+        self.nano.jobs.partitioned("softbans", self.timer.start_monitoring)
 
         self.list = ObjectListReactions(self.client, self.handler, self.trans)
         self.loop.create_task(self.list.track.start_monitoring())
@@ -426,7 +434,7 @@ class Admin:
         self.default_channel = None
         self.handle_log_channel = None
 
-        self.modp = self.handler.get_plugin_data_manager("moderation")
+        self.modp = self.handler.get_plugin_data_manager("moderation", schema=MODERATION_SCHEMA)
 
     async def on_plugins_loaded(self):
         self.default_channel = self.nano.get_plugin("server").instance.default_channel
@@ -640,16 +648,8 @@ class Admin:
 
         assert isinstance(client, Client)
 
-        # Check if this is a valid command
-        if not is_valid_command(message.content, commands, prefix):
-            return
-        else:
-            # Check for conflicts
-            for ignore in ignore_commands:
-                if message.content.startswith(ignore.replace("_", prefix)):
-                    return
-
-            self.stats.add(MESSAGE)
+        # Only called for commands owned by this plugin (see NanoPlugin.routed)
+        self.stats.add(MESSAGE)
 
         def startswith(*matches):
             for match in matches:
@@ -1531,6 +1531,56 @@ class Admin:
                     self.handler.remove_selfrole(message.guild.id, r_name)
                     await message.channel.send(trans.get("MSG_SELFROLE_ADMIN_REMOVED", lang).format(r_name))
 
+            # nano.settings wordfilter add/remove/list
+            elif setting == "wordfilter" and arg.split(" ", 1)[0] in ("add", "remove", "list"):
+                try:
+                    setting, arg = arg.split(" ", 1)
+                    setting, arg = setting.strip(" "), arg.strip(" ").lower()
+                except ValueError:
+                    setting, arg = arg, ""
+
+                words = handler.get_banned_words(message.guild.id)
+
+                if setting == "list":
+                    if not words:
+                        await message.channel.send(trans.get("MSG_WORDFILTER_NONE", lang).format(prefix))
+                        return
+
+                    await message.channel.send(trans.get("MSG_WORDFILTER_LIST", lang).format(
+                        ", ".join("`{}`".format(word) for word in sorted(words))))
+                    return
+
+                if not arg:
+                    await message.channel.send(trans.get("ERROR_INVALID_CMD_ARGUMENTS", lang))
+                    return
+
+                # nano.settings wordfilter add
+                if setting == "add":
+                    if arg in words:
+                        await message.channel.send(trans.get("MSG_WORDFILTER_ALR_EX", lang))
+                        return
+
+                    if len(words) >= WORDFILTER_MAX:
+                        await message.channel.send(trans.get("MSG_WORDFILTER_TOO_MANY", lang).format(WORDFILTER_MAX))
+                        return
+
+                    handler.add_banned_word(message.guild.id, arg)
+                    await message.channel.send(trans.get("MSG_WORDFILTER_ADDED", lang).format(arg))
+
+                # nano.settings wordfilter remove
+                else:
+                    if arg not in words:
+                        await message.channel.send(trans.get("MSG_WORDFILTER_NOT_PRESENT", lang))
+                        return
+
+                    handler.remove_banned_word(message.guild.id, arg)
+                    await message.channel.send(trans.get("MSG_WORDFILTER_REMOVED", lang).format(arg))
+
+                # Other processes pick the change up once their cached copy expires
+                moderator = self.nano.plugins.get("moderator")
+                if moderator is not None:
+                    moderator.instance.checker.swearing_detect.invalidate(message.guild.id)
+
             # nano.settings defaultchannel
             elif setting == "defaultchannel":
                 if len(message.channel_mentions) == 0:
@@ -2079,6 +2129,9 @@ class NanoPlugin:
     version = "33"
 
     handler = Admin
+    routed = True
+    # Softbans stop on_member_remove
+    gating = ("on_member_remove", )
     events = {
         "on_message": 10,
         "on_member_remove": 4,
@@ -16,6 +16,7 @@ class GuildCounter:
     def __init__(self, **kwargs):
         self.client = kwargs.get("client")
         self.loop = kwargs.get("loop")
+        self.nano = kwargs.get("nano")
 
         try:
             self.botspw_token = parser.get("bots.discord.pw", "token")
@@ -33,7 +34,8 @@ class GuildCounter:
         return self.session
 
     async def on_guild_join(self, guild, **_):
-        srv_amount = len(self.client.guilds)
+        # Counts the guilds of every cluster (see launcher.py)
+        srv_amount, _, _ = await self.nano.get_plugin("server").instance.totals()
 
         resp = await self.upload(srv_amount)
 
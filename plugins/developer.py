@@ -1,16 +1,22 @@
 # coding=utf-8
 import logging
+import math
 import os
 import subprocess
+try:
+    from rapidjson import dumps
+except ImportError:
+    from json import dumps
 from asyncio import sleep
 from datetime import datetime
 from random import shuffle
 from shutil import copy2
 
-from discord import Game, utils, Embed, Colour, DiscordException
+from discord import Game, utils, Embed, Colour, DiscordException, File
 
 from core.stats import MESSAGE
-from core.utils import is_valid_command, log_to_file, StandardEmoji, resolve_time
+from core.utils import log_to_file, StandardEmoji, resolve_time, apply_string_padding
+from core.cluster import ACTION_RESTART, ACTION_SHUTDOWN
 from core.confparser import get_settings_parser, BACKUP_DIR, DATA_DIR
 
 #######################
@@ -24,6 +30,9 @@ log.setLevel(logging.INFO)
 parser = get_settings_parser()
 
 
+LATENCY_DUMP = os.path.join(DATA_DIR, "latency.json")
+
+
 game_list = [
     "Hi there!",
     "HI MOM!",
@@ -157,6 +166,7 @@ class DevFeatures:
     def __init__(self, **kwargs):
         self.nano = kwargs.get("nano")
         self.handler = kwargs.get("handler")
+        self.async_handler = kwargs.get("async_handler")
         self.client = kwargs.get("client")
         self.stats = kwargs.get("stats")
         self.loop = kwargs.get("loop")
@@ -165,10 +175,57 @@ class DevFeatures:
         self.backup = BackupManager()
         self.roller = StatusRoller(self.client)
 
+        # One backup per deployment, every process rolls the status of its own shards
+        self.nano.jobs.leader("backup", self.backup.start)
+        self.nano.jobs.partitioned("status", self.roller.run)
+
         self.shutdown_mode = None
 
         self.default_channel = None
 
+        # Commands that change the bot's state apply to every cluster (see launcher.py)
+        if self.nano.cluster:
+            self.nano.cluster.register("set_playing", self.set_playing)
+            self.nano.cluster.register("reload_translations", self.reload_translations)
+            self.nano.cluster.register("reload_plugin", self.reload_plugin)
+            self.nano.cluster.register("cluster_status", self.cluster_status)
+
+    async def set_playing(self, status: str):
+        await self.client.change_presence(activity=Game(name=status))
+
+    async def reload_translations(self):
+        self.trans.reload_translations()
+
+    async def reload_plugin(self, name: str) -> tuple:
+        v_old = self.nano.get_plugin(name).plugin.NanoPlugin.version
+        success = await self.nano.reload_plugin(name)
+        v_new = self.nano.get_plugin(name).plugin.NanoPlugin.version
+
+        return success, v_old, v_new
+
+    async def cluster_status(self) -> dict:
+        info = self.nano.cluster.info
+        # NaN without shards, inf until a shard gets its first heartbeat ACK
+        latency = self.client.latency
+
+        return {
+            "pid": os.getpid(),
+            "shards": [info.shard_ids[0], info.shard_ids[-1]],
+            "guilds": len(self.client.guilds),
+            "latency": int(latency * 1000) if math.isfinite(latency) else None,
+            "lag": int(self.nano.watchdog.max_lag * 1000),
+            "uptime": int(datetime.now().timestamp() - self.nano.boot_time),
+        }
+
+    async def everywhere(self, name: str, **args) -> dict:
+        """
+        Runs a handler above on every cluster or just here, returns {cluster id: result}
+        """
+        if self.nano.cluster:
+            return await self.nano.cluster.query(name, **args)
+
+        return {0: await getattr(self, name)(**args)}
+
     async def on_plugins_loaded(self):
         self.default_channel = self.nano.get_plugin("server").instance.default_channel
 
@@ -178,11 +235,8 @@ class DevFeatures:
         prefix = kwargs.get("prefix")
         lang = kwargs.get("lang")
 
-        # Check if this is a valid command
-        if not is_valid_command(message.content, commands, prefix):
-            return
-        else:
-            self.stats.add(MESSAGE)
+        # Only called for commands owned by this plugin (see NanoPlugin.routed)
+        self.stats.add(MESSAGE)
 
         def startswith(*matches):
             for match in matches:
@@ -251,23 +305,65 @@ class DevFeatures:
         elif startswith("nano.dev.plugin.reload"):
             name = message.content[len("nano.dev.plugin.reload "):]
 
-            v_old = self.nano.get_plugin(name).plugin.NanoPlugin.version
-            s = await self.nano.reload_plugin(name)
-            v_new = self.nano.get_plugin(name).plugin.NanoPlugin.version
+            results = await self.everywhere("reload_plugin", name=name)
+            failed = [str(cluster) for cluster, (s, _, _) in results.items() if not s]
 
-            if s:
+            if results and not failed:
+                _, v_old, v_new = results[min(results)]
                 await message.channel.send("Successfully reloaded **{}**\nFrom version *{}* to *{}*.".format(name, v_old, v_new))
             else:
-                await message.channel.send("Something went wrong, check the logs.")
+                await message.channel.send("Something went wrong, check the logs (clusters: {}).".format(", ".join(failed)))
 
         # nano.dev.servers.clean
         elif startswith("nano.dev.servers.tidy"):
             self.handler.delete_server_by_list([s.id for s in self.client.guilds])
 
+        # nano.dev.jobs
+        elif startswith("nano.dev.jobs"):
+            jobs = self.nano.jobs
+            rows = []
+            for job in jobs.get_stats():
+                state = "running" if job["running"] else "idle"
+                rows.append("{}: {} ({}), {} crashes".format(job["name"], state, job["scope"], job["crashes"]))
+
+                if job["last_error"]:
+                    rows.append("  last error: {}".format(job["last_error"]))
+
+            await message.channel.send("**Background jobs** (this process {} the leader)\n```{}```".format(
+                "is" if jobs.is_leader else "isn't", "\n".join(rows) or "None"))
+
+        # nano.dev.cluster
+        elif startswith("nano.dev.cluster"):
+            if not self.nano.cluster:
+                await message.channel.send("Not running in a cluster (see launcher.py).")
+                return
+
+            results = await self.nano.cluster.query("cluster_status")
+            info = self.nano.cluster.info
+
+            rows = ["cluster  shards    guilds  ws ms  max lag ms  uptime  pid"]
+            for cluster, data in sorted(results.items()):
+                rows.append("{:<8} {:<9} {:<7} {:<6} {:<11} {:<7} {}".format(
+                    "{}{}".format(cluster, "*" if cluster == info.cluster_id else ""),
+                    "{}-{}".format(*data["shards"]), data["guilds"], data["latency"], data["lag"],
+                    resolve_time(data["uptime"], "en"), data["pid"]))
+
+            missing = info.clusters - len(results)
+            if missing:
+                rows.append("\n{} cluster(s) didn't answer".format(missing))
+
+            await message.channel.send("**{} clusters, {} shards**\n```{}```".format(
+                info.clusters, info.shard_count, "\n".join(rows)))
+
         # nano.restart
         elif startswith("nano.restart"):
             await message.channel.send("**DED, but gonna come back**")
 
+            # The supervisor stops and starts every cluster
+            if self.nano.cluster:
+                await self.nano.cluster.request(ACTION_RESTART)
+                return
+
             await client.logout()
 
             self.shutdown_mode = "restart"
@@ -277,6 +373,10 @@ class DevFeatures:
         elif startswith("nano.kill"):
             await message.channel.send("**DED**")
 
+            if self.nano.cluster:
+                await self.nano.cluster.request(ACTION_SHUTDOWN)
+                return
+
             await client.logout()
 
             self.shutdown_mode = "exit"
@@ -286,15 +386,136 @@ class DevFeatures:
         elif startswith("nano.playing"):
             status = message.content[len("nano.playing "):]
 
-            await client.change_presence(activity=Game(name=str(status)))
+            await self.everywhere("set_playing", status=str(status))
             await message.channel.send("Status changed " + StandardEmoji.THUMBS_UP)
 
         # nano.dev.translations.reload
         elif startswith("nano.dev.translations.reload"):
-            self.trans.reload_translations()
+            await self.everywhere("reload_translations")
 
             await message.channel.send(StandardEmoji.PERFECT)
 
+        # nano.dev.latency.dump
+        elif startswith("nano.dev.latency.dump"):
+            with open(LATENCY_DUMP, "w") as dump:
+                dump.write(dumps(self.nano.latency.to_dict(), indent=2))
+
+            await message.channel.send("Latency dump (microseconds):", file=File(LATENCY_DUMP, "latency.json"))
+
+        # nano.dev.latency.reset
+        elif startswith("nano.dev.latency.reset"):
+            self.nano.latency.reset()
+            await message.channel.send("Latency histograms cleared " + StandardEmoji.PERFECT)
+
+        # nano.dev.latency
+        elif startswith("nano.dev.latency"):
+            slowest = self.nano.latency.slowest(15)
+
+            if not slowest:
+                await message.channel.send("No events recorded yet.")
+                return
+
+            def ms(us):
+                return "{:.1f}".format(us / 1000)
+
+            names = apply_string_padding(["plugin:event"] + ["{}:{}".format(p, e) for p, e, _ in slowest])
+            rows = ["{} calls  err   p50ms  p95ms  p99ms  maxms".format(names[0])]
+            for name, (_, _, data) in zip(names[1:], slowest):
+                rows.append("{} {:<6} {:<5} {:<6} {:<6} {:<6} {}".format(
+                    name, data["calls"], data["errors"],
+                    ms(data["p50"]), ms(data["p95"]), ms(data["p99"]), ms(data["max"])))
+
+            await message.channel.send("**Slowest plugins (by p99)**\n```{}```".format("\n".join(rows)))
+
+        # nano.dev.lag.reset
+        elif startswith("nano.dev.lag.reset"):
+            self.nano.watchdog.reset()
+            await message.channel.send("Loop stalls cleared " + StandardEmoji.PERFECT)
+
+        # nano.dev.lag
+        elif startswith("nano.dev.lag"):
+            watchdog = self.nano.watchdog
+            offenders = watchdog.worst_offenders(10)
+
+            header = "Current lag: {}ms, max: {}ms, stalls recorded: {}".format(
+                int(watchdog.last_lag * 1000), int(watchdog.max_lag * 1000), len(watchdog.stalls))
+
+            if not offenders:
+                await message.channel.send(header)
+                return
+
+            rows = ["{}.{}: {}x, total {}ms, worst {}ms".format(plugin, function, count, int(total * 1000), int(worst * 1000))
+                    for plugin, function, count, total, worst in offenders]
+
+            last = watchdog.stalls[-1]
+            rows.append("\nLast: {}ms in {}.{} (line {}) -> {}".format(
+                int(last.duration * 1000), last.plugin, last.function, last.line, last.blocking_call))
+
+            await message.channel.send("{}\n```{}```".format(header, "\n".join(rows)))
+
+        # nano.dev.cache
+        elif startswith("nano.dev.cache"):
+            stats = self.handler.settings_cache.get_stats()
+            rows = ["{}: {}".format(k, v) for k, v in stats.items()]
+
+            commands = self.async_handler.command_cache.get_stats()
+            rows.append("\nCustom command index")
+            rows.extend("{}: {}".format(k, v) for k, v in commands.items())
+
+            batching = self.async_handler.batcher.get_stats()
+            rows.append("\nRead batching")
+            rows.extend("{}: {}".format(k, v) for k, v in batching.items())
+
+            # Per-user state kept by plugins
+            stores = []
+            observer = self.nano.plugins.get("observer")
+            if observer is not None:
+                stores.append(("rate limits", observer.instance.buckets.get_stats()))
+            moderator = self.nano.plugins.get("moderator")
+            if moderator is not None:
+                repeats = moderator.instance.checker.repeating_detect.get_stats()
+                stores.extend(("repeat {}".format(name), data) for name, data in repeats.items())
+                stores.append(("guild word filters", moderator.instance.checker.swearing_detect.guild_filters.get_stats()))
+                stores.append(("duplicate windows", moderator.instance.checker.duplicate_detect.windows.get_stats()))
+
+            rows.append("\nPer-user and per-guild state")
+            rows.extend("{}: {} live, {} expired, {} evicted".format(name, data["entries"], data["expired"], data["evicted"])
+                        for name, data in stores)
+
+            await message.channel.send("**Guild settings cache**\n```{}```".format("\n".join(rows)))
+
+        # nano.dev.redis.reset
+        elif startswith("nano.dev.redis.reset"):
+            self.handler.connections.metrics.reset()
+            await message.channel.send("Redis command counters cleared " + StandardEmoji.PERFECT)
+
+        # nano.dev.redis
+        elif startswith("nano.dev.redis"):
+            connections = self.handler.connections
+            busiest = connections.metrics.busiest(12)
+
+            def ms(us):
+                return "{:.1f}".format(us / 1000)
+
+            names = apply_string_padding(["namespace"] + ["{}:{}".format(i, n) for n, i, _, _ in busiest])
+            rows = ["{} commands  trips  err  p50ms  p95ms".format(names[0])]
+            for name, (_, _, count, data) in zip(names[1:], busiest):
+                rows.append("{} {:<9} {:<6} {:<4} {:<6} {}".format(
+                    name, count, data["calls"], data["errors"], ms(data["p50"]), ms(data["p95"])))
+
+            rows.append("\nPools")
+            rows.extend("{}: {}/{} connections".format(name, pool["connections"], pool["max"])
+                        for name, pool in connections.get_pool_stats().items())
+
+            rows.append("\nHealth")
+            for instance, state in connections.health.items():
+                if state["healthy"]:
+                    rows.append("{}: ok ({}ms)".format(instance, int((state["latency"] or 0) * 1000)))
+                else:
+                    rows.append("{}: DOWN, {} failed checks ({})".format(instance, state["failures"], state["last_error"]))
+
+            await message.channel.send("**Redis usage by namespace**\n```{}```".format("\n".join(rows)))
+
         # nano.dev.test_default_channel
         elif startswith("nano.dev.test_default_channel"):
             df = await self.default_channel(message.guild)
@@ -367,10 +588,6 @@ class DevFeatures:
             await message.channel.send(embed=embed)
 
 
-    async def on_ready(self):
-        self.loop.create_task(self.backup.start())
-        self.loop.create_task(self.roller.run())
-
     async def on_shutdown(self):
         # Make redis save data with BGSAVE
         self.handler.bg_save()
@@ -389,9 +606,9 @@ class NanoPlugin:
     version = "27"
 
     handler = DevFeatures
+    routed = True
     events = {
         "on_message": 10,
-        "on_ready": 5,
         "on_shutdown": 15,
         "on_plugins_loaded": 5,
         # type : importance
@@ -16,7 +16,7 @@ from discord import Embed, Colour, File
 from PIL import Image, ImageDraw, ImageFont
 
 from core.stats import PRAYER, MESSAGE, IMAGE_SENT
-from core.utils import is_valid_command, build_url, add_dots, gen_id
+from core.utils import build_url, add_dots, gen_id
 from core.confparser import get_config_parser, DATA_DIR, PLUGINS_DIR
 
 # plugins/config.ini
@@ -291,7 +291,7 @@ class Fun:
                 return
 
         # Check if this is a valid command
-        if not is_valid_command(message.content, commands, prefix):
+        if self.nano.router.get_owner(message.content, prefix) != "fun":
             return
         else:
             self.stats.add(MESSAGE)
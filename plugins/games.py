@@ -10,9 +10,10 @@ except ImportError:
     from json import loads, dumps
 from discord import Embed
 
-from core.utils import is_valid_command, build_url
+from core.utils import build_url
 from core.confparser import get_config_parser
 from core.stats import MESSAGE
+from core.schema import Schema, to_int, to_optional_int, to_optional_str
 
 commands = {
     "_gamedb": {"desc": "Looks up information on all kinds of video games.\nUses https://www.igdb.com"},
@@ -23,6 +24,9 @@ valid_commands = commands.keys()
 parser = get_config_parser()
 log = logging.getLogger(__name__)
 
+# Missing values are cached as "None"
+GAMES_SCHEMA = Schema("games", {"id": to_int, "name": to_optional_str, "rating": to_optional_int}, default=to_optional_str)
+
 
 class Game:
     def __init__(self, **fields):
@@ -77,7 +81,7 @@ class IgdbCacheManager:
                 hash fields with all
     """
     def __init__(self, handler):
-        self._cache = handler.get_cache_handler().get_plugin_data_manager("games")
+        self._cache = handler.get_cache_handler().get_plugin_data_manager("games", schema=GAMES_SCHEMA)
 
         self._tmp_names = {}
         self._fill_name_cache()
@@ -210,11 +214,8 @@ class GameDB:
         prefix = kwargs.get("prefix")
         lang = kwargs.get("lang")
 
-        # Check if this is a valid command
-        if not is_valid_command(message.content, commands, prefix):
-            return
-        else:
-            self.stats.add(MESSAGE)
+        # Only called for commands owned by this plugin (see NanoPlugin.routed)
+        self.stats.add(MESSAGE)
 
         def startswith(*matches):
             for match in matches:
@@ -269,6 +270,7 @@ class NanoPlugin:
     version = "1"
 
     handler = GameDB
+    routed = True
     events = {
         "on_message": 10,
         # type : importance
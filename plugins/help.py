@@ -6,7 +6,6 @@ from datetime import datetime
 from discord import Embed, Colour
 
 from core.stats import MESSAGE, HELP, WRONG_ARG
-from core.utils import is_valid_command
 from core.confparser import get_settings_parser, DATA_DIR
 
 # Template: {"desc": ""},
@@ -114,11 +113,8 @@ class Help:
         prefix = kwargs.get("prefix")
         lang = kwargs.get("lang")
 
-        # Check if this is a valid command
-        if not is_valid_command(message.content, commands, prefix):
-            return
-        else:
-            self.stats.add(MESSAGE)
+        # Only called for commands owned by this plugin (see NanoPlugin.routed)
+        self.stats.add(MESSAGE)
 
         def startswith(*matches):
             for match in matches:
@@ -251,6 +247,7 @@ class NanoPlugin:
     version = "30"
 
     handler = Help
+    routed = True
     events = {
         "on_message": 10,
         "on_plugins_loaded": 5,
@@ -4,6 +4,7 @@ import configparser
 import logging
 import aiohttp
 import os
+import time
 import traceback
 
 from random import randint
@@ -17,8 +18,9 @@ from typing import Union
 from discord import Embed, Colour
 
 from core.stats import MESSAGE, IMAGE_SENT
-from core.utils import is_valid_command, is_number, log_to_file, filter_text
+from core.utils import is_number, log_to_file, filter_text
 from core.confparser import get_config_parser, PLUGINS_DIR
+from core.schema import Schema, to_int
 
 commands = {
     "_xkcd": {"desc": "Fetches XKCD comics (defaults to random).", "use": "[command] (random/number/latest)"},
@@ -30,6 +32,12 @@ valid_commands = commands.keys()
 
 parser = get_config_parser()
 
+XKCD_SCHEMA = Schema("xkcd", {"num": to_int})
+# Number of the latest comic, shared by every process (only the leader updates it)
+XKCD_LATEST_KEY = "latest"
+# Seconds before the shared number is read again
+XKCD_LATEST_REFRESH = 3600
+
 log = logging.getLogger(__name__)
 
 
@@ -116,15 +124,25 @@ class XKCD:
         self.link_base = "https://xkcd.com/{}"
 
         self.last_num = None
+        self.last_checked = 0
         cache_handler = handler.get_cache_handler()
-        self.cache = cache_handler.get_plugin_data_manager("xkcd")
+        self.cache = cache_handler.get_plugin_data_manager("xkcd", schema=XKCD_SCHEMA)
 
         self.req = Connector(loop)
         self.loop = loop
 
         self.running = True
 
-        self.loop.create_task(self.updater())
+    def get_last_num(self) -> Union[None, int]:
+        # Another process may be running the updater
+        if self.last_num is None or time.monotonic() - self.last_checked > XKCD_LATEST_REFRESH:
+            latest = self.cache.get(XKCD_LATEST_KEY)
+            if latest:
+                self.last_num = int(latest)
+
+            self.last_checked = time.monotonic()
+
+        return self.last_num
 
     def exists_in_cache(self, number) -> bool:
         return self.cache.exists(number)
@@ -156,6 +174,7 @@ class XKCD:
 
         if c:
             self.last_num = int(c["num"])
+            self.cache.set(XKCD_LATEST_KEY, self.last_num)
             log.info("Last comic number gotten: {}".format(self.last_num))
         else:
             log.warning("Could not get latest xkcd! (retrying in {} min)".format(5 * time_falloff))
@@ -190,7 +209,7 @@ class XKCD:
         return data
 
     async def get_random_xkcd(self) -> Union[None, ComicImage]:
-        if not self.last_num:
+        if not self.get_last_num():
             return await self.get_latest_xkcd()
 
         num = randint(1, self.last_num)
@@ -257,6 +276,7 @@ class Joke:
 
         self.cats = CatGenerator(self.loop)
         self.xkcd = XKCD(self.handler, self.loop)
+        self.nano.jobs.leader("xkcd", self.xkcd.updater)
         self.joke = JokeList(self.handler)
 
     async def on_message(self, message, **kwargs):
@@ -265,11 +285,8 @@ class Joke:
         prefix = kwargs.get("prefix")
         lang = kwargs.get("lang")
 
-        # Check if this is a valid command
-        if not is_valid_command(message.content, commands, prefix):
-            return
-        else:
-            self.stats.add(MESSAGE)
+        # Only called for commands owned by this plugin (see NanoPlugin.routed)
+        self.stats.add(MESSAGE)
 
         def startswith(*matches):
             for match in matches:
@@ -313,7 +330,7 @@ class Joke:
             if fmt:
                 if is_number(fmt):
                     # Check if number is valid
-                    if int(fmt) > self.xkcd.last_num:
+                    if int(fmt) > (self.xkcd.get_last_num() or 0):
                         await message.channel.send(trans.get("MSG_XKCD_NO_SUCH", lang))
                         return
                     else:
@@ -361,6 +378,7 @@ class NanoPlugin:
     version = "10"
 
     handler = Joke
+    routed = True
     events = {
         "on_message": 10
     }
@@ -14,13 +14,16 @@ import aiohttp
 from discord import File
 
 from core.stats import MESSAGE, WRONG_ARG, IMAGE_SENT
-from core.utils import is_valid_command, is_number
+from core.utils import is_number
+from core.schema import Schema, to_float
 from core.confparser import PLUGINS_DIR
 
 log = logging.getLogger(__name__)
 log.setLevel(logging.INFO)
 
 # CONSTANTS
+MC_SCHEMA = Schema("mc", {"last_fetch": to_float})
+
 ITEM_ID_PAIR = 1
 ITEM_ID = 2
 ITEM_NAME = 3
@@ -52,7 +55,7 @@ class McItems:
         MAX_AGE = 604800  # 1 week
 
         cache_temp = handler.get_cache_handler()
-        self.cache = cache_temp.get_plugin_data_manager("mc")
+        self.cache = cache_temp.get_plugin_data_manager("mc", schema=MC_SCHEMA)
 
         # Check validity of cache
         if self.cache.exists("raw_data") and (time.time() - float(self.cache.get("last_fetch"))) < MAX_AGE:
@@ -195,11 +198,8 @@ class Minecraft:
         prefix = kwargs.get("prefix")
         lang = kwargs.get("lang")
 
-        # Check if this is a valid command
-        if not is_valid_command(message.content, commands, prefix):
-            return
-        else:
-            self.stats.add(MESSAGE)
+        # Only called for commands owned by this plugin (see NanoPlugin.routed)
+        self.stats.add(MESSAGE)
 
         def startswith(*matches):
             for match in matches:
@@ -276,6 +276,7 @@ class NanoPlugin:
     version = "14"
 
     handler = Minecraft
+    routed = True
     events = {
         "on_message": 10
         # type : importance
@@ -1,22 +1,78 @@
 # coding=utf-8
+import asyncio
 import logging
 import re
+import time
+from bisect import bisect_right
+from collections import deque
 from enum import IntEnum
 from pickle import load
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 from discord import Message, Embed, TextChannel
 
+from core.events import EventContext
+from core.expiring import ExpiringMap
 from core.stats import SUPPRESS
 from core.utils import add_dots, get_valid_commands
-from core.confparser import PLUGINS_DIR
+from core.confparser import PLUGINS_DIR, get_settings_parser
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
 
+parser = get_settings_parser()
+
 # CONSTANTS
 
 accepted_chars = "abcdefghijklmnopqrstuvwxyz "
 
+# Messages with at least this many (normalized) characters are scored with numpy, shorter ones in Python
+# (see utilities/bench_gibberish.py)
+VECTORIZE_FROM = 64
+
+# Leetspeak is folded into letters before words are matched
+LEET_TABLE = str.maketrans({"4": "a", "@": "a", "$": "s", "0": "o"})
+# Seconds a guild's compiled word list is used before it's loaded again
+GUILD_WORDS_TTL = 60
+# Compiled lists of guilds without messages for this long are dropped, and at most this many are kept
+# (a list that is loaded again unchanged reuses its automaton until then)
+GUILD_FILTERS_TTL = 600
+GUILD_FILTERS_MAX = 50000
+
+# Spam filter limits
+CAPS_RATIO = 0.45
+MENTION_LIMIT = 5
+GIBBERISH_MIN_LENGTH = 10
+
+# Per-user repeat state is forgotten after this many seconds of silence, and kept for at most this many users
+REPEAT_TTL = 600
+REPEAT_MAX_USERS = 200000
+
+# Batch mode ([Moderation] batching): seconds a message waits for others and the largest batch
+BATCH_WINDOW = 0.005
+BATCH_SIZE = 256
+
+# Near-duplicates posted by several users (see DuplicateDetector)
+# Fingerprints kept per guild, seconds they count for and bits two of them may differ in
+DUPLICATE_WINDOW = 256
+DUPLICATE_TTL = 30
+DUPLICATE_DISTANCE = 6
+# Distinct users that have to post the same text, the words it needs to have and the most that are compared
+DUPLICATE_USERS = 3
+DUPLICATE_MIN_WORDS = 5
+DUPLICATE_MAX_WORDS = 64
+# Most guild windows kept, windows idle for DUPLICATE_TTL are dropped (nothing in them counts anymore)
+DUPLICATE_MAX_GUILDS = 20000
+
+WORD_REGEX = re.compile(r"\w+")
+
+# ASCII_UPPER[code] tells whether the ASCII character is uppercase
+ASCII_UPPER = numpy.array([chr(a).isupper() for a in range(128)], dtype=numpy.bool_) if numpy else None
+
 
 def normalize(line):
     # Ignores punctuation, new lines, etc...
@@ -33,11 +89,106 @@ def two_chars(line):
         yield norm[rn:rn + 1], norm[rn + 1:rn + 2]
 
 
+def normalize_words(text: str) -> str:
+    return text.lower().translate(LEET_TABLE)
+
+
+def strip_links(message: str) -> str:
+    return " ".join([word for word in message.split(" ") if
+                     (not word.startswith("https://")) and (not word.startswith("http://"))])
+
+
+def count_upper(messages: list) -> list:
+    """
+    Uppercase characters in each message. ASCII messages are counted together with numpy.
+    """
+    counts = [0] * len(messages)
+
+    # (index, encoded message)
+    batched = []
+    for index, message in enumerate(messages):
+        if ASCII_UPPER is not None:
+            try:
+                batched.append((index, message.encode("ascii")))
+                continue
+            except UnicodeEncodeError:
+                pass
+
+        counts[index] = sum([1 for c in message if c.isupper()])
+
+    if not batched:
+        return counts
+
+    chars = numpy.frombuffer(b"".join([encoded for _, encoded in batched]), dtype=numpy.uint8)
+    upper = numpy.zeros(len(chars) + 1, dtype=numpy.int64)
+    numpy.cumsum(ASCII_UPPER[chars], out=upper[1:])
+
+    position = 0
+    for index, encoded in batched:
+        end = position + len(encoded)
+        counts[index] = int(upper[end] - upper[position])
+        position = end
+
+    return counts
+
+
+# SimHash votes are added up in 8-bit lanes of one integer, _SPREAD[n][byte] puts the bits of a hash's nth byte
+# into their lanes
+_SPREAD = [tuple(sum([1 << (8 * (8 * number + bit)) for bit in range(8) if value >> bit & 1]) for value in range(256))
+           for number in range(8)]
+_LANES = sum([1 << (8 * bit) for bit in range(64)])
+_TOP_BITS = _LANES << 7
+_BINARY = bytes.maketrans(b"\x00\x01", b"01")
+# Fingerprint bytes are indexed as byte number << 8 | byte
+_BAND_OFFSETS = tuple(range(0, 8 << 8, 1 << 8))
+# Keeps the votes in their lanes
+_MAX_FEATURES = 254
+# feature: its spread hash, most words come up again and again
+_spread_cache = {}
+SPREAD_CACHE_SIZE = 4096
+
+
+def _spread(feature) -> int:
+    spread = _spread_cache.get(feature)
+    if spread is None:
+        if len(_spread_cache) >= SPREAD_CACHE_SIZE:
+            _spread_cache.clear()
+
+        h = hash(feature)
+        s0, s1, s2, s3, s4, s5, s6, s7 = _SPREAD
+        spread = _spread_cache[feature] = s0[h & 255] + s1[h >> 8 & 255] + s2[h >> 16 & 255] + \
+            s3[h >> 24 & 255] + s4[h >> 32 & 255] + s5[h >> 40 & 255] + s6[h >> 48 & 255] + s7[h >> 56 & 255]
+
+    return spread
+
+
+def fingerprint(features: list):
+    """
+    64-bit SimHash: similar lists of words get fingerprints that differ in only a few bits.
+    Fingerprints use hash(), so they only mean something inside one process.
+
+    :return: int or None if there are no features
+    """
+    if not features:
+        return None
+
+    features = features[:_MAX_FEATURES]
+    lanes = sum([_spread(feature) for feature in features])
+
+    # A bit is set when more than half of the features have it, that lane's top bit ends up set after adding
+    # 127 - half to every lane
+    lanes += (127 - len(features) // 2) * _LANES
+    bits = ((lanes & _TOP_BITS) >> 7).to_bytes(64, "little")
+
+    return int(bits.translate(_BINARY)[::-1], 2)
+
+
 class SpamType(IntEnum):
     REPEATED = 1
     GIBBERISH = 2
     CAPS = 3
     MENTIONS = 4
+    DUPLICATE = 5
 
 
 class ModBucket:
@@ -80,7 +231,8 @@ class GibberishDetector:
     """
     Detects "gibberish" (e.g. asdasdhadasda). Uses statistical occurences of two characters one after another.
     """
-    __slots__ = ("data", "threshold", "char_positions", "chars2", "pos2")
+    __slots__ = ("data", "threshold", "char_positions", "chars2", "pos2",
+                 "codes", "dropped", "size", "rare", "rare_matrix")
 
     def __init__(self):
         # Gibberish detector
@@ -91,10 +243,41 @@ class GibberishDetector:
         self.threshold = spam_model["threshold"]
         self.char_positions = spam_model["positions"]
 
+        # bytes.translate table and deleted bytes: accepted characters become their position in the model,
+        # everything else is dropped like normalize() does (non-ASCII is never accepted)
+        table = bytearray(range(256))
+        for char, position in self.char_positions.items():
+            table[ord(char)] = position
+
+        self.codes = bytes(table)
+        self.dropped = bytes(a for a in range(256) if chr(a) not in accepted_chars)
+
+        # rare[a * size + b] tells whether bigram (a, b) is below the threshold of a
+        self.size = len(self.data)
+        self.rare = tuple(self.data[a][b] < self.threshold[a] for a in range(self.size) for b in range(self.size))
+        self.rare_matrix = numpy.array(self.rare, dtype=numpy.bool_).reshape(self.size, self.size) if numpy else None
+
         # Entropy calculator
         self.chars2 = "abcdefghijklmnopqrstuvwxyz,.-!?_;:|1234567890*=)(/&%$#\"~<> "
         self.pos2 = dict([(c, index) for index, c in enumerate(self.chars2)])
 
+    def to_codes(self, message: str) -> bytes:
+        """
+        Normalizes the message into model positions, one byte per character
+        """
+        return message.encode("ascii", "ignore").translate(self.codes, self.dropped)
+
+    def count_rare(self, codes: bytes) -> int:
+        """
+        Number of rare bigrams in normalized codes
+        """
+        if len(codes) < VECTORIZE_FROM or self.rare_matrix is None:
+            rare = self.rare
+            size = self.size
+            return sum([rare[a * size + b] for a, b in zip(codes, codes[1:])])
+
+        positions = numpy.frombuffer(codes, dtype=numpy.uint8)
+        return int(numpy.count_nonzero(self.rare_matrix[positions[:-1], positions[1:]]))
 
     def is_gibberish(self, message: str):
         """
@@ -107,79 +290,397 @@ class GibberishDetector:
             return
 
         th = len(message) / 1.8
-        c = float(0)
-        for ca, cb in two_chars(message):
+        codes = self.to_codes(message)
+
+        # Not enough bigrams left to reach the threshold
+        if len(codes) - 1 < th:
+            return False
+
+        return bool(self.count_rare(codes) >= th)
+
+    def is_gibberish_many(self, messages: list) -> list:
+        """
+        is_gibberish for several messages, their bigrams are looked up in one numpy call
+
+        :param messages: list of strings
+        :return: list of bool
+        """
+        results = [False] * len(messages)
+
+        # (index, codes, threshold) of messages that can still reach their threshold
+        candidates = []
+        for index, message in enumerate(messages):
+            if not message:
+                continue
+
+            th = len(message) / 1.8
+            codes = self.to_codes(message)
+            if len(codes) - 1 >= th:
+                candidates.append((index, codes, th))
+
+        total = sum([len(codes) for _, codes, _ in candidates])
+        if self.rare_matrix is None or total < VECTORIZE_FROM:
+            for index, codes, th in candidates:
+                results[index] = bool(self.count_rare(codes) >= th)
 
-            if self.data[self.char_positions[ca]][self.char_positions[cb]] < self.threshold[self.char_positions[ca]]:
-                c += 1
+            return results
 
-        return bool(c >= th)
+        positions = numpy.frombuffer(b"".join([codes for _, codes, _ in candidates]), dtype=numpy.uint8)
+        # rare[i] counts rare bigrams before position i, bigrams across two messages are never read
+        rare = numpy.zeros(len(positions), dtype=numpy.int64)
+        numpy.cumsum(self.rare_matrix[positions[:-1], positions[1:]], out=rare[1:])
+
+        start = 0
+        for index, codes, th in candidates:
+            end = start + len(codes)
+            results[index] = bool(rare[end - 1] - rare[start] >= th)
+            start = end
+
+        return results
+
+
+class WordAutomaton:
+    """
+    Aho-Corasick automaton: finds any of the words in one pass over the text.
+    Words only match as whole space-separated tokens (or several, for phrases like "blow job").
+    """
+    __slots__ = ("transitions", "terminal", "words")
+
+    def __init__(self, words):
+        # Spaces around every pattern keep matches from starting or ending inside a token
+        patterns = {" {} ".format(normalize_words(word).strip(" ")) for word in words if word.strip(" ")}
+        self.words = len(patterns)
+
+        # Trie
+        trie = [{}]
+        terminal = [False]
+        for pattern in patterns:
+            state = 0
+            for char in pattern:
+                following = trie[state].get(char)
+                if following is None:
+                    following = len(trie)
+                    trie[state][char] = following
+                    trie.append({})
+                    terminal.append(False)
+
+                state = following
+
+            terminal[state] = True
+
+        # Failure links, resolved into complete transitions (characters that aren't stored go back to the root)
+        alphabet = {char for pattern in patterns for char in pattern}
+        transitions = [{} for _ in trie]
+        fail = [0] * len(trie)
+
+        queue = deque()
+        for char, following in trie[0].items():
+            transitions[0][char] = following
+            queue.append(following)
+
+        while queue:
+            state = queue.popleft()
+            terminal[state] = terminal[state] or terminal[fail[state]]
+
+            for char in alphabet:
+                following = trie[state].get(char)
+                if following is not None:
+                    fail[following] = transitions[fail[state]].get(char, 0)
+                    transitions[state][char] = following
+                    queue.append(following)
+                else:
+                    target = transitions[fail[state]].get(char, 0)
+                    if target:
+                        transitions[state][char] = target
+
+        self.transitions = transitions
+        self.terminal = terminal
+
+    def search(self, text: str) -> bool:
+        """
+        :param text: normalized text (see normalize_words) padded with a space on both ends
+        """
+        return self.search_many([text])[0]
+
+    def search_many(self, texts: list) -> list:
+        """
+        search() for several texts in one pass over all of them.
+        Every pattern starts with a space, so from the root the scan jumps straight to the next one.
+        """
+        transitions = self.transitions
+        terminal = self.terminal
+
+        results = [False] * len(texts)
+        if not texts:
+            return results
+
+        starts = []
+        position = 0
+        for text in texts:
+            starts.append(position)
+            position += len(text) + 1
+
+        # NUL isn't in any pattern, so no match continues into the next text
+        joined = "\0".join(texts)
+        find = joined.find
+        end = len(joined)
+
+        state = 0
+        position = find(" ")
+        while position != -1:
+            state = transitions[state].get(joined[position], 0)
+
+            if terminal[state]:
+                index = bisect_right(starts, position) - 1
+                results[index] = True
+
+                # The rest of this text doesn't matter
+                if index + 1 == len(texts):
+                    break
+
+                state = 0
+                position = find(" ", starts[index + 1])
+            elif state:
+                position += 1
+                if position == end:
+                    break
+            else:
+                position = find(" ", position + 1)
+
+        return results
 
 
 class SwearingDetector:
     """
-    Detects blocked words from banned_words.txt. Makes some "permutations" to all words so detection quality is higher.
+    Detects blocked words from banned_words.txt and the guild's own list (nano.settings wordfilter add).
+    Leetspeak (4ss, a$$, @ss, b00b) is normalized in the message instead of listing every variant.
     """
-    __slots__ = ("permutations", "word_list")
+    __slots__ = ("word_list", "automaton", "guild_filters")
 
     def __init__(self):
-        self.permutations = [
-            dict(a="4"),
-            dict(s="$"),
-            dict(o="0"),
-            dict(a="@"),
-        ]
-
         with open("{}/banned_words.txt".format(PLUGINS_DIR)) as banned:
             self.word_list = [line.strip("\n") for line in banned.readlines()]
 
-        # Builds a more sophisticated list
-        before = len(self.word_list)
-        for word in self.word_list:
-            initial = str(word)
+        self.automaton = WordAutomaton(self.word_list)
+        # guild id: (valid until, words, WordAutomaton or None)
+        self.guild_filters = ExpiringMap(GUILD_FILTERS_TTL, max_size=GUILD_FILTERS_MAX)
+
+        logger.info("Compiled word filter: {} words, {} states".format(self.automaton.words,
+                                                                       len(self.automaton.terminal)))
+
+    def get_guild_filter(self, guild_id: int) -> tuple:
+        """
+        Returns (WordAutomaton or None, whether it's still valid)
+        """
+        cached = self.guild_filters.get(guild_id)
+        if cached is None:
+            return None, False
+
+        return cached[2], cached[0] > time.monotonic()
+
+    def set_guild_words(self, guild_id: int, words):
+        """
+        Caches the guild's words, recompiling only when they changed. Returns the guild's automaton.
+        """
+        words = frozenset(words or ())
+
+        cached = self.guild_filters.get(guild_id)
+        if cached is not None and cached[1] == words:
+            automaton = cached[2]
+        else:
+            automaton = WordAutomaton(words) if words else None
 
-            for perm in self.permutations:
-                (k, v), = perm.items()
-                changed = initial.replace(k, v)
-                if initial != changed:
-                    self.word_list.append(changed)
+        self.guild_filters[guild_id] = (time.monotonic() + GUILD_WORDS_TTL, words, automaton)
+        return automaton
 
-        logger.info("Processed word list: added {} entries ({} total)".format(len(self.word_list) - before, len(self.word_list)))
+    def invalidate(self, guild_id: int):
+        self.guild_filters.pop(guild_id, None)
 
-    def has_swearing(self, message: str) -> bool:
+    def has_swearing(self, message: str, guild_automaton: WordAutomaton=None) -> bool:
         """
         Returns True if there is a banned word
 
         :param message: Discord Message content
+        :param guild_automaton: the guild's own words (see set_guild_words)
+        """
+        text = " {} ".format(normalize_words(message))
+
+        if self.automaton.search(text):
+            return True
+
+        return guild_automaton is not None and guild_automaton.search(text)
+
+    def has_swearing_many(self, messages: list, guild_automata: list) -> list:
+        """
+        has_swearing for several messages, the shared word list is searched in one pass
         """
-        res = [a for a in self.word_list if a in message.split(" ")]
-        return bool(res)
+        texts = [" {} ".format(normalize_words(message)) for message in messages]
+        results = self.automaton.search_many(texts)
+
+        # Messages that are still clean, grouped by their guild's automaton
+        pending = {}
+        for index, automaton in enumerate(guild_automata):
+            if not results[index] and automaton is not None:
+                pending.setdefault(automaton, []).append(index)
+
+        for automaton, indexes in pending.items():
+            for index, found in zip(indexes, automaton.search_many([texts[index] for index in indexes])):
+                results[index] = found
+
+        return results
 
 
 class RepeatingMessageDetector:
     __slots__ = ("user_buckets", "last_from_user")
 
     def __init__(self):
-        self.last_from_user = {}
-        self.user_buckets = {}
+        # user id: hash of their last message
+        self.last_from_user = ExpiringMap(REPEAT_TTL, max_size=REPEAT_MAX_USERS)
+        # user id: ModBucket
+        self.user_buckets = ExpiringMap(REPEAT_TTL, max_size=REPEAT_MAX_USERS)
 
     def is_repeating(self, user_id: int, message: str):
         # Get bucket
         bucket = self.user_buckets.get(user_id)
-        if not bucket:
+        if bucket is None:
             bucket = ModBucket()
             self.user_buckets[user_id] = bucket
 
         # See if message repeats
         last = self.last_from_user.get(user_id)
 
+        message = hash(message) if message else None
         self.last_from_user[user_id] = message
         # If first message
-        if not last:
+        if last is None or message is None:
             return False
 
         return bucket.notice(message == last)
 
+    def get_stats(self) -> dict:
+        return {
+            "buckets": self.user_buckets.get_stats(),
+            "last_messages": self.last_from_user.get_stats(),
+        }
+
+
+class FingerprintWindow:
+    """
+    Ring buffer of the last `size` fingerprints posted in a guild.
+    Fingerprints are indexed by their eight bytes: two that differ in at most DUPLICATE_DISTANCE (6) bits
+    share at least two of them, so only fingerprints found under two bytes are compared. Each byte only points
+    to the latest fingerprint of every user, so one user flooding a channel doesn't make lookups slower.
+    """
+    __slots__ = ("fingerprints", "users", "times", "bands", "position")
+
+    def __init__(self, size: int=DUPLICATE_WINDOW):
+        self.fingerprints = [None] * size
+        self.users = [0] * size
+        self.times = [0.0] * size
+
+        # band key: {user id: slot}
+        self.bands = {}
+        self.position = 0
+
+    @staticmethod
+    def band_keys(value: int) -> list:
+        # Keys of different bytes never collide
+        return [offset | byte for offset, byte in zip(_BAND_OFFSETS, value.to_bytes(8, "little"))]
+
+    def add(self, value: int, keys: list, user_id: int, now: float):
+        slot = self.position
+        self.position = (slot + 1) % len(self.fingerprints)
+
+        old = self.fingerprints[slot]
+        if old is not None:
+            old_user = self.users[slot]
+
+            for key in self.band_keys(old):
+                band = self.bands[key]
+                # Unless the user posted something newer with the same byte
+                if band.get(old_user) == slot:
+                    del band[old_user]
+                    if not band:
+                        del self.bands[key]
+
+        self.fingerprints[slot] = value
+        self.users[slot] = user_id
+        self.times[slot] = now
+
+        for key in keys:
+            band = self.bands.get(key)
+            if band is None:
+                self.bands[key] = {user_id: slot}
+            else:
+                band[user_id] = slot
+
+    def similar_users(self, value: int, keys: list, user_id: int, now: float, enough: int) -> set:
+        """
+        Other users that posted a similar fingerprint in the last DUPLICATE_TTL seconds (stops at `enough`)
+        """
+        fingerprints = self.fingerprints
+        times = self.times
+        oldest = now - DUPLICATE_TTL
+
+        users = set()
+        # slot: bytes it shares with this fingerprint so far
+        shared = {}
+
+        for key in keys:
+            band = self.bands.get(key)
+            if band is None:
+                continue
+
+            for other, slot in band.items():
+                if other == user_id:
+                    continue
+
+                count = shared.get(slot, 0) + 1
+                shared[slot] = count
+                # Compared once, on the second shared byte
+                if count != 2 or times[slot] < oldest:
+                    continue
+
+                if bin(fingerprints[slot] ^ value).count("1") <= DUPLICATE_DISTANCE:
+                    users.add(other)
+                    if len(users) >= enough:
+                        return users
+
+        return users
+
+
+class DuplicateDetector:
+    """
+    Detects the same text being posted by several users across a guild's channels (raids).
+    Only fixed-size fingerprints are kept, DUPLICATE_WINDOW of them per guild.
+    """
+    __slots__ = ("windows", )
+
+    def __init__(self):
+        # guild id: FingerprintWindow
+        self.windows = ExpiringMap(DUPLICATE_TTL, max_size=DUPLICATE_MAX_GUILDS)
+
+    def is_duplicate(self, guild_id: int, user_id: int, message: str) -> bool:
+        # Distinct words, otherwise common ones decide most bits. Short messages are too common to compare.
+        words = list(dict.fromkeys(WORD_REGEX.findall(message.lower())))
+        if len(words) < DUPLICATE_MIN_WORDS:
+            return False
+
+        value = fingerprint(words[:DUPLICATE_MAX_WORDS])
+
+        window = self.windows.get(guild_id)
+        if window is None:
+            window = FingerprintWindow()
+            self.windows[guild_id] = window
+
+        now = time.monotonic()
+        keys = window.band_keys(value)
+
+        others = window.similar_users(value, keys, user_id, now, DUPLICATE_USERS - 1)
+        window.add(value, keys, user_id, now)
+
+        return len(others) + 1 >= DUPLICATE_USERS
+
 
 
 class NanoModerator:
@@ -187,19 +688,34 @@ class NanoModerator:
         self.gib_detect = GibberishDetector()
         self.swearing_detect = SwearingDetector()
         self.repeating_detect = RepeatingMessageDetector()
+        self.duplicate_detect = DuplicateDetector()
 
         self.invite_regex = re.compile(r'(http(s)?://)?discord.gg/\w+')
 
 
-    def check_swearing(self, message: str) -> bool:
+    def check_swearing(self, message: str, guild_automaton: WordAutomaton=None) -> bool:
         """
         Checks whether a message includes words that are not allowed.
 
         :param message: str
+        :param guild_automaton: the guild's own banned words
         :return: bool
         """
-        return self.swearing_detect.has_swearing(message.lower())
+        return self.swearing_detect.has_swearing(message, guild_automaton)
+
+
+    def check_repeats(self, author_id: int, message: str, raw_message):
+        """
+        Checks whether the user repeats themselves or other users post the same text (across all channels).
+        Both keep state, so every message has to go through here in the order it was sent.
+        """
+        if self.repeating_detect.is_repeating(author_id, message) is True:
+            return SpamType.REPEATED
+
+        if self.duplicate_detect.is_duplicate(raw_message.guild.id, author_id, message):
+            return SpamType.DUPLICATE
 
+        return False
 
     def check_spam(self, author_id: int, message: str, raw_message):
         """
@@ -215,15 +731,15 @@ class NanoModerator:
         # Repeating sentence detection
         #########
 
-        is_repeating = self.repeating_detect.is_repeating(author_id, message)
-        if is_repeating is True:
-            return SpamType.REPEATED
+        is_repeating = self.check_repeats(author_id, message, raw_message)
+        if is_repeating:
+            return is_repeating
 
 
         #########
         # Usage of caps
         #########
-        caps_threshold = len(message) * 0.45
+        caps_threshold = len(message) * CAPS_RATIO
 
         up_count = sum([1 for c in message if c.isupper()])
         if len(message) > 5 and up_count > caps_threshold:
@@ -233,8 +749,7 @@ class NanoModerator:
         #########
         # Mention spam
         #########
-        mention_limit = 5
-        if sum([len(raw_message.mentions), len(raw_message.role_mentions)]) > mention_limit:
+        if sum([len(raw_message.mentions), len(raw_message.role_mentions)]) > MENTION_LIMIT:
             return SpamType.MENTIONS
 
 
@@ -243,11 +758,10 @@ class NanoModerator:
         #########
 
         # Should exclude links
-        message = " ".join([word for word in message.split(" ") if
-                            (not word.startswith("https://")) and (not word.startswith("http://"))])
+        message = strip_links(message)
 
         # Should always ignore short sentences
-        if len(message) < 10:
+        if len(message) < GIBBERISH_MIN_LENGTH:
             return False
 
         if self.gib_detect.is_gibberish(message):
@@ -265,6 +779,168 @@ class NanoModerator:
 
         return bool(res) if res else False
 
+    def check_invites(self, messages: list) -> list:
+        """
+        check_invite for several messages with one regex pass over all of them
+        (invites can't contain a new line, so none spans two messages)
+        """
+        results = [False] * len(messages)
+
+        starts = []
+        position = 0
+        for message in messages:
+            starts.append(position)
+            position += len(message) + 1
+
+        for match in self.invite_regex.finditer("\n".join(messages)):
+            results[bisect_right(starts, match.start()) - 1] = True
+
+        return results
+
+    def check_batch(self, checks: list) -> list:
+        """
+        Gives the same verdicts as check_spam, check_swearing and check_invite called for each message in turn,
+        but every detector goes through the whole batch at once.
+
+        :param checks: list of PendingCheck, in the order the messages arrived
+        :return: list of (spam reason, swearing, invite)
+        """
+        spam = [False] * len(checks)
+
+        # Repeats depend on earlier messages, so those are checked first and in order
+        unresolved = []
+        for index, check in enumerate(checks):
+            if not check.spam:
+                continue
+
+            message = check.message
+            spam[index] = self.check_repeats(message.author.id, message.content, message)
+            if not spam[index]:
+                unresolved.append(index)
+
+        # Caps, mentions, then gibberish
+        texts = [checks[index].message.content for index in unresolved]
+        gibberish = []
+
+        for index, text, up_count in zip(unresolved, texts, count_upper(texts)):
+            message = checks[index].message
+
+            if len(text) > 5 and up_count > len(text) * CAPS_RATIO:
+                spam[index] = SpamType.CAPS
+            elif len(message.mentions) + len(message.role_mentions) > MENTION_LIMIT:
+                spam[index] = SpamType.MENTIONS
+            else:
+                text = strip_links(text)
+                if len(text) >= GIBBERISH_MIN_LENGTH:
+                    gibberish.append((index, text))
+
+        verdicts = self.gib_detect.is_gibberish_many([text for _, text in gibberish])
+        for (index, _), is_gibberish in zip(gibberish, verdicts):
+            if is_gibberish:
+                spam[index] = SpamType.GIBBERISH
+
+        # Swearing
+        swearing = [False] * len(checks)
+        indexes = [index for index, check in enumerate(checks) if check.swearing]
+        verdicts = self.swearing_detect.has_swearing_many([checks[index].message.content for index in indexes],
+                                                          [checks[index].guild_automaton for index in indexes])
+        for index, verdict in zip(indexes, verdicts):
+            swearing[index] = verdict
+
+        # Invites
+        invite = [False] * len(checks)
+        indexes = [index for index, check in enumerate(checks) if check.invite]
+        verdicts = self.check_invites([checks[index].message.content for index in indexes])
+        for index, verdict in zip(indexes, verdicts):
+            invite[index] = verdict
+
+        return list(zip(spam, swearing, invite))
+
+
+class PendingCheck:
+    """
+    A message waiting in ModerationBatcher and the filters its guild has enabled
+    """
+    __slots__ = ("message", "spam", "swearing", "invite", "guild_automaton", "future")
+
+    def __init__(self, message: Message, spam: bool, swearing: bool, invite: bool,
+                 guild_automaton: WordAutomaton=None):
+        self.message = message
+        self.spam = spam
+        self.swearing = swearing
+        self.invite = invite
+        self.guild_automaton = guild_automaton
+
+        self.future = None
+
+
+class ModerationBatcher:
+    """
+    Holds messages that need filtering for up to `window` seconds (or until `size` are waiting)
+    and checks them together with NanoModerator.check_batch. During raids this spreads the per-message
+    overhead of every detector over the whole batch.
+    """
+    __slots__ = ("checker", "window", "size", "_pending", "_timer",
+                 "batches", "messages")
+
+    def __init__(self, checker: NanoModerator, window: float=BATCH_WINDOW, size: int=BATCH_SIZE):
+        self.checker = checker
+        self.window = window
+        self.size = size
+
+        self._pending = []
+        self._timer = None
+
+        self.batches = 0
+        self.messages = 0
+
+    async def check(self, check: PendingCheck) -> tuple:
+        """
+        Waits for the batch to be checked and returns the message's (spam reason, swearing, invite)
+        """
+        loop = asyncio.get_event_loop()
+        check.future = loop.create_future()
+        self._pending.append(check)
+
+        if len(self._pending) >= self.size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush)
+
+        return await check.future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        pending, self._pending = self._pending, []
+        if not pending:
+            return
+
+        self.batches += 1
+        self.messages += len(pending)
+
+        try:
+            verdicts = self.checker.check_batch(pending)
+        except Exception as e:
+            for check in pending:
+                if not check.future.done():
+                    check.future.set_exception(e)
+            return
+
+        for check, verdict in zip(pending, verdicts):
+            # The handler may have been cancelled in the meantime
+            if not check.future.done():
+                check.future.set_result(verdict)
+
+    def get_stats(self) -> dict:
+        return {
+            "batches": self.batches,
+            "messages": self.messages,
+            "avg_batch": round(self.messages / self.batches, 1) if self.batches else 0,
+        }
+
 
 class LogManager:
     def __init__(self, client, nano, loop, handler, trans):
@@ -308,6 +984,7 @@ class Moderator:
         self.client = kwargs.get("client")
         self.loop = kwargs.get("loop")
         self.handler = kwargs.get("handler")
+        self.async_handler = kwargs.get("async_handler")
         self.nano = kwargs.get("nano")
         self.stats = kwargs.get("stats")
         self.trans = kwargs.get("trans")
@@ -315,6 +992,13 @@ class Moderator:
         self.checker = NanoModerator()
         self.log = LogManager(self.client, self.nano, self.loop, self.handler, self.trans)
 
+        if parser.getboolean("Moderation", "batching", fallback=False):
+            self.batcher = ModerationBatcher(self.checker,
+                                             parser.getfloat("Moderation", "batch_window", fallback=BATCH_WINDOW),
+                                             parser.getint("Moderation", "batch_size", fallback=BATCH_SIZE))
+        else:
+            self.batcher = None
+
         self.valid_commands = set()
 
     async def on_plugins_loaded(self):
@@ -332,25 +1016,67 @@ class Moderator:
 
         await self.log.resolve_plugin()
 
-    async def on_message(self, message, **kwargs):
-        handler = self.handler
+    async def guild_words(self, guild_id: int):
+        detector = self.checker.swearing_detect
+
+        automaton, valid = detector.get_guild_filter(guild_id)
+        if valid:
+            return automaton
+
+        return detector.set_guild_words(guild_id, await self.async_handler.get_banned_words(guild_id))
+
+    async def check_message(self, message, needs_spam_filter: bool, needs_swearing_filter: bool,
+                            needs_invite_filter: bool) -> tuple:
+        if needs_spam_filter:
+            spam_reason = self.checker.check_spam(message.author.id, message.content, message)
+        else:
+            spam_reason = False
+
+        if needs_swearing_filter:
+            swearing = self.checker.check_swearing(message.content, await self.guild_words(message.guild.id))
+        else:
+            swearing = False
+
+        if needs_invite_filter:
+            # Ignore invites from admins
+            if not self.async_handler.is_admin(message.author, message.guild):
+                invite = self.checker.check_invite(message.content)
 
-        prefix = kwargs.get("prefix")
-        lang = kwargs.get("lang")
+            else:
+                invite = False
+
+        else:
+            invite = False
+
+        return spam_reason, swearing, invite
+
+    async def on_message(self, message, ctx: EventContext):
+        handler = self.async_handler
+
+        prefix = ctx.prefix
+        lang = ctx.lang
 
         if not isinstance(message.channel, TextChannel):
-            return "return"
+            ctx.stop = True
+            return
+
+        # Fetched by Observer (see RedisServerHandler.get_message_context)
+        context = ctx.settings
+        if context is None:
+            context = await handler.get_message_context(message.guild.id, message.channel.id, message.author.id)
 
         # Muting
-        if handler.is_muted(message.guild, message.author.id):
+        if context["muted"]:
             await message.delete()
 
             self.stats.add(SUPPRESS)
-            return "return"
+            ctx.stop = True
+            return
 
         # Channel blacklisting
-        if handler.is_blacklisted(message.guild.id, message.channel.id):
-            return "return"
+        if context["blacklisted"]:
+            ctx.stop = True
+            return
 
         # Ignore the filter if user is executing a command
         if message.content.startswith(prefix):
@@ -363,30 +1089,22 @@ class Moderator:
             return
 
         # Spam, swearing and invite filter
-        needs_spam_filter = handler.has_spam_filter(message.guild)
-        needs_swearing_filter = handler.has_word_filter(message.guild)
-        needs_invite_filter = handler.has_invite_filter(message.guild)
+        needs_spam_filter = context["spam_filter"]
+        needs_swearing_filter = context["word_filter"]
+        needs_invite_filter = context["invite_filter"]
 
-        if needs_spam_filter:
-            spam_reason = self.checker.check_spam(message.author.id, message.content, message)
-        else:
-            spam_reason = False
-
-        if needs_swearing_filter:
-            swearing = self.checker.check_swearing(message.content)
-        else:
-            swearing = False
+        if self.batcher is not None and any([needs_spam_filter, needs_swearing_filter, needs_invite_filter]):
+            guild_automaton = await self.guild_words(message.guild.id) if needs_swearing_filter else None
+            spam_reason, swearing, invite = await self.batcher.check(
+                PendingCheck(message, needs_spam_filter, needs_swearing_filter, needs_invite_filter, guild_automaton))
 
-        if needs_invite_filter:
             # Ignore invites from admins
-            if not handler.is_admin(message.author, message.guild):
-                invite = self.checker.check_invite(message.content)
-
-            else:
+            if invite and handler.is_admin(message.author, message.guild):
                 invite = False
 
         else:
-            invite = False
+            spam_reason, swearing, invite = await self.check_message(message, needs_spam_filter,
+                                                                     needs_swearing_filter, needs_invite_filter)
 
 
         # Delete if necessary
@@ -395,7 +1113,7 @@ class Moderator:
             logger.debug("Message filtered")
 
             # Check if current channel is the logging channel
-            log_channel_name = self.handler.get_log_channel(message.guild)
+            log_channel_name = context["log_channel"]
             if log_channel_name == message.channel.name:
                 return
 
@@ -409,6 +1127,8 @@ class Moderator:
                     await self.log.send_log(message, lang, self.trans.get("MSG_MOD_SPAM_R", lang))
                 elif spam_reason == SpamType.MENTIONS:
                     await self.log.send_log(message, lang, self.trans.get("MSG_MOD_SPAM_M", lang))
+                elif spam_reason == SpamType.DUPLICATE:
+                    await self.log.send_log(message, lang, self.trans.get("MSG_MOD_SPAM_D", lang))
 
                 else:
                     raise NotImplementedError("This offense type is not implemented.")
@@ -423,7 +1143,8 @@ class Moderator:
                 # Lol wat
                 return
 
-            return "return"
+            ctx.stop = True
+            return
 
 
 class NanoPlugin:
@@ -431,6 +1152,7 @@ class NanoPlugin:
     version = "31"
 
     handler = Moderator
+    gating = ("on_message", )
     events = {
         "on_plugins_loaded": 5,
         "on_message": 6
@@ -9,14 +9,18 @@ from discord import errors
 from typing import Union
 
 from core.stats import MESSAGE
-from core.utils import is_valid_command, IgnoredException, filter_text
+from core.utils import IgnoredException, filter_text
 from core.confparser import get_config_parser
+from core.schema import Schema, to_int, to_float
 
 log = logging.getLogger(__name__)
 log.setLevel(logging.INFO)
 
 parser = get_config_parser()
 
+# Titles and ratings stay strings, "1917" is a title
+MOVIES_SCHEMA = Schema("movies", {"id": to_int, "timestamp": to_float})
+
 commands = {
     "_imdb search": {"desc": "Searches for films/tv series and displays things such as release year, summary, ratings, ...", "use": "[command] [film/series title]"},
     "_imdb trailer": {"desc": "Gives you a link to the trailer of a film/series.", "use": "[command] [film/series title]"},
@@ -51,7 +55,7 @@ class RedisMovieCache:
 
     def __init__(self, handler, max_age=21600):
         cache = handler.get_cache_handler()
-        self.cache = cache.get_plugin_data_manager("movies")
+        self.cache = cache.get_plugin_data_manager("movies", schema=MOVIES_SCHEMA)
 
         self.max_age = max_age
 
@@ -163,11 +167,8 @@ class TMDb:
         prefix = kwargs.get("prefix")
         lang = kwargs.get("lang")
 
-        # Check if this is a valid command
-        if not is_valid_command(message.content, commands, prefix):
-            return
-        else:
-            self.stats.add(MESSAGE)
+        # Only called for commands owned by this plugin (see NanoPlugin.routed)
+        self.stats.add(MESSAGE)
 
         def startswith(*matches):
             for match in matches:
@@ -310,6 +311,7 @@ class NanoPlugin:
     version = "19"
 
     handler = TMDb
+    routed = True
     events = {
         "on_message": 10
         # type : importance
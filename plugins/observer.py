@@ -4,6 +4,8 @@ import time
 
 from discord import TextChannel
 
+from core.events import EventContext
+from core.expiring import ExpiringMap
 from core.stats import SLEPT
 from core.confparser import get_config_parser
 from core.utils import get_valid_commands
@@ -15,6 +17,11 @@ parser = get_config_parser()
 
 DEFAULT_PREFIX = parser.get("Servers", "defaultprefix")
 
+# Rate-limit buckets of users that stopped using commands are dropped after this many seconds
+# (longer than the Bucket cooldown, so a dropped bucket would have been reset anyway)
+BUCKET_TTL = 60
+MAX_BUCKETS = 200000
+
 # Prefix getter plugin
 
 commands = {
@@ -58,11 +65,13 @@ class Observer:
     def __init__(self, *_, **kwargs):
         self.client = kwargs.get("client")
         self.handler = kwargs.get("handler")
+        self.async_handler = kwargs.get("async_handler")
         self.stats = kwargs.get("stats")
         self.trans = kwargs.get("trans")
         self.nano = kwargs.get("nano")
 
-        self.buckets = {}
+        # user id: Bucket
+        self.buckets = ExpiringMap(BUCKET_TTL, max_size=MAX_BUCKETS)
         self.valid_commands = set()
 
     async def on_plugins_loaded(self):
@@ -78,28 +87,35 @@ class Observer:
 
         self.valid_commands = set(temp)
 
-    async def on_message(self, message, **_):
+    async def on_message(self, message, ctx: EventContext):
         trans = self.trans
 
         # Ignore your own messages
         if message.author == self.client.user:
-            return "return"
+            ctx.stop = True
+            return
         # Ignore private messages
         if not isinstance(message.channel, TextChannel):
-            return "return"
+            ctx.stop = True
+            return
         # Ignore bot messages
         if message.author.bot:
-            return "return"
+            ctx.stop = True
+            return
+
+        # Guild settings, mute and blacklist state in one round trip
+        context = await self.async_handler.get_message_context(message.guild.id, message.channel.id,
+                                                               message.author.id)
 
-        # Add prefix to kwargs for future plugins
-        pref = self.handler.get_prefix(message.guild)
+        # Add prefix to the context for future plugins
+        pref = context["prefix"]
         if pref is None:
             pref = str(DEFAULT_PREFIX)
         else:
             pref = str(pref)
 
         # Parse language
-        lang = self.handler.get_lang(message.guild.id)
+        lang = context["lang"]
         if not lang:
             lang = str(self.trans.default_lang)
 
@@ -112,14 +128,14 @@ class Observer:
         np_text = "_" + np_text.split(" ", maxsplit=1)[0]
         if np_text in self.valid_commands:
             # Check rate-limits
+            bucket = self.buckets.get(message.author.id)
             # If user was silent until now, create a new bucket
-            if message.author.id not in self.buckets.keys():
+            if bucket is None:
                 b = Bucket()
                 b.action()
                 self.buckets[message.author.id] = b
             # Otherwise, check bucket size
             else:
-                bucket = self.buckets[message.author.id]
                 # bucket.action() returns a bool indicating if the user can execute the requested command
                 if not bucket.action():
                     if not bucket.was_warned:
@@ -127,12 +143,13 @@ class Observer:
                         bucket.was_warned = True
                         await message.channel.send(trans.get("MSG_RATELIMIT", lang).format(message.author.mention))
 
-                    return "return"
+                    ctx.stop = True
+                    return
 
 
         # Set up the server if it is not present in redis db
-        if not self.handler.server_exists(message.guild.id):
-            self.handler.server_setup(message.guild)
+        if not context["exists"]:
+            await self.async_handler.server_setup(message.guild)
 
         # Ah, the shortcuts
         def startswith(*matches):
@@ -147,82 +164,94 @@ class Observer:
         if startswith("nano.sleep"):
             if not self.handler.is_admin(message.author, message.guild):
                 await message.channel.send(trans.get("PERM_ADMIN", lang))
-                return "return"
+                ctx.stop = True
+                return
 
-            self.handler.set_sleeping(message.guild, True)
+            await self.async_handler.set_sleeping(message.guild, True)
             await message.channel.send(self.trans.get("MSG_NANO_SLEEP", lang))
-            return "return"
+            ctx.stop = True
+            return
 
         # nano.wake
         elif startswith("nano.wake"):
             if not self.handler.is_admin(message.author, message.guild):
                 await message.channel.send(trans.get("PERM_ADMIN", lang))
-                return "return"
+                ctx.stop = True
+                return
 
-            if not self.handler.is_sleeping(message.guild.id):
+            if not context["sleeping"]:
                 await message.channel.send(trans.get("MSG_NANO_WASNT_SLEEPING", lang))
-                return "return"
+                ctx.stop = True
+                return
 
-            self.handler.set_sleeping(message.guild, False)
+            await self.async_handler.set_sleeping(message.guild, False)
             await message.channel.send(self.trans.get("MSG_NANO_WAKE", lang))
 
             self.stats.add(SLEPT)
-            return "return"
+            ctx.stop = True
+            return
 
         # Quit if the bot is sleeping
-        if self.handler.is_sleeping(message.guild.id):
-            return "return"
+        if context["sleeping"]:
+            ctx.stop = True
+            return
 
-        return "add_var", dict(prefix=pref, lang=lang)
+        ctx.prefix = pref
+        ctx.lang = lang
+        ctx.settings = context
 
-    async def on_member_join(self, member, **_):
+    async def on_member_join(self, member, ctx: EventContext):
         # Quit if the bot is sleeping
-        if self.handler.is_sleeping(member.guild.id):
-            return "return"
+        if await self.async_handler.is_sleeping(member.guild.id):
+            ctx.stop = True
+            return
 
-        lang = self.handler.get_lang(member.guild.id)
+        lang = await self.async_handler.get_lang(member.guild.id)
         if not lang:
             lang = str(self.trans.default_lang)
 
-        return "add_var", dict(lang=lang)
+        ctx.lang = lang
 
-    async def on_member_ban(self, guild, _, **__):
+    async def on_member_ban(self, guild, _, ctx: EventContext):
         # Quit if the bot is sleeping
-        if self.handler.is_sleeping(guild.id):
-            return "return"
+        if await self.async_handler.is_sleeping(guild.id):
+            ctx.stop = True
+            return
 
-        lang = self.handler.get_lang(guild.id)
+        lang = await self.async_handler.get_lang(guild.id)
         if not lang:
             lang = str(self.trans.default_lang)
 
-        return "add_var", dict(lang=lang)
+        ctx.lang = lang
 
-    async def on_member_remove(self, member, **_):
+    async def on_member_remove(self, member, ctx: EventContext):
         # Quit if the bot is sleeping
-        if self.handler.is_sleeping(member.guild.id):
-            return "return"
+        if await self.async_handler.is_sleeping(member.guild.id):
+            ctx.stop = True
+            return
 
-        lang = self.handler.get_lang(member.guild.id)
+        lang = await self.async_handler.get_lang(member.guild.id)
         if not lang:
             lang = str(self.trans.default_lang)
 
-        return "add_var", dict(lang=lang)
+        ctx.lang = lang
 
-    async def on_guild_join(self, _, **__):
+    async def on_guild_join(self, _, ctx: EventContext):
         lang = str(self.trans.default_lang)
 
-        return "add_var", dict(lang=lang)
+        ctx.lang = lang
 
-    async def on_reaction_add(self, reaction, user, **__):
+    async def on_reaction_add(self, reaction, user, ctx: EventContext):
         # Ignore private messages
         if not isinstance(reaction.message.channel, TextChannel):
-            return "return"
+            ctx.stop = True
+            return
 
-        lang = self.handler.get_lang(user.guild.id)
+        lang = await self.async_handler.get_lang(user.guild.id)
         if not lang:
             lang = str(self.trans.default_lang)
 
-        return "add_var", dict(lang=lang)
+        ctx.lang = lang
 
 
 
@@ -232,6 +261,10 @@ class NanoPlugin:
     version = "23"
 
     handler = Observer
+    gating = (
+        "on_message", "on_member_join", "on_member_ban", "on_member_remove",
+        "on_reaction_add", "on_guild_join",
+    )
     events = {
         "on_message": 4,
         "on_plugins_loaded": 4,
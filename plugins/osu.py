@@ -7,7 +7,7 @@ import osu_ds
 from discord import Embed, Colour, errors
 
 from core.stats import MESSAGE
-from core.utils import is_valid_command, invert_num, invert_str, split_every
+from core.utils import invert_num, invert_str, split_every
 from core.confparser import get_config_parser
 
 #####
@@ -55,11 +55,8 @@ class Osu:
         prefix = kwargs.get("prefix")
         lang = kwargs.get("lang")
 
-        # Check if this is a valid command
-        if not is_valid_command(message.content, commands, prefix):
-            return
-        else:
-            self.stats.add(MESSAGE)
+        # Only called for commands owned by this plugin (see NanoPlugin.routed)
+        self.stats.add(MESSAGE)
 
         def startswith(*matches):
             for match in matches:
@@ -151,6 +148,7 @@ class NanoPlugin:
     version = "9"
 
     handler = Osu
+    routed = True
     events = {
         "on_message": 10
         # type : importance
@@ -8,7 +8,8 @@ from typing import Union
 from discord import DiscordException
 
 from core.stats import MESSAGE, WRONG_ARG
-from core.utils import resolve_time, convert_to_seconds, is_valid_command, gen_id, IgnoredException, log_to_file
+from core.utils import resolve_time, convert_to_seconds, gen_id, IgnoredException, log_to_file
+from core.schema import Schema, to_int
 
 log = logging.getLogger(__name__)
 log.setLevel(logging.INFO)
@@ -28,6 +29,14 @@ REM_MAX_DAYS = int(REM_MAX_DURATION / 86400)
 REMINDER_PERSONAL = "personal"
 REMINDER_CHANNEL = "channel"
 
+REMINDER_SCHEMA = Schema("reminder", {
+    "receiver": to_int,
+    "server": to_int,
+    "author": to_int,
+    "time_created": to_int,
+    "time_target": to_int,
+})
+
 commands = {
     "_remind": {"desc": "General module for timers\nSubcommands: remind me in, remind here in, remind list, remind remove"},
     "_remind me in": {"desc": "Adds a reminder (reminds you in dm)", "use": "[command] [time (ex: 3h 5min)] : [message] OR  [command] [time] to [message]"},
@@ -56,12 +65,14 @@ class RedisReminderHandler:
                             raw: raw content
 
     """
-    def __init__(self, client, handler, trans, loop=asyncio.get_event_loop()):
-        self.redis = handler.get_plugin_data_manager(namespace="reminder")
+    def __init__(self, client, handler, trans, loop=asyncio.get_event_loop(), owns=None):
+        self.redis = handler.get_plugin_data_manager(namespace="reminder", schema=REMINDER_SCHEMA)
 
         self.loop = loop
         self.client = client
         self.trans = trans
+        # Tells whether a guild (or user) id is handled by this process (see core/jobs.py)
+        self.owns = owns or (lambda _: True)
 
     def get_reminder_amount(self):
         return len(self.get_all_reminders())
@@ -195,7 +206,8 @@ class RedisReminderHandler:
         else:
             log.info("Dispatching personal reminder by {}".format(rem["receiver"]))
 
-            user = self.client.get_user(int(rem["receiver"]))
+            # The user might only be cached by another cluster
+            user = self.client.get_user(int(rem["receiver"])) or await self.client.fetch_user(int(rem["receiver"]))
 
             if not user:
                 log.info("User missing, ignoring...")
@@ -215,6 +227,10 @@ class RedisReminderHandler:
             for user in a:
 
                 for id_, reminder in user.items():
+                    # Channel reminders belong to the guild's shard, personal ones to the receiver's
+                    if not self.owns(reminder.get("server") or reminder.get("receiver")):
+                        continue
+
                     # If enough time has passed, send the reminder
                     if int(reminder["time_target"]) <= last_time:
                         try:
@@ -238,11 +254,11 @@ class Reminder:
         self.stats = kwargs.get("stats")
         self.trans = kwargs.get("trans")
 
-        self.reminder = RedisReminderHandler(self.client, self.handler, self.trans, self.loop)
+        self.reminder = RedisReminderHandler(self.client, self.handler, self.trans, self.loop, self.nano.jobs.owns)
 
         self.filter = None
 
-        self.loop.create_task(self.reminder.monitor())
+        self.nano.jobs.partitioned("reminders", self.reminder.monitor)
 
     async def on_plugins_loaded(self):
         self.filter = self.nano.get_plugin("commons").instance.at_everyone_filter
@@ -288,11 +304,8 @@ class Reminder:
         prefix = kwargs.get("prefix")
         lang = kwargs.get("lang")
 
-        # Check if this is a valid command
-        if not is_valid_command(message.content, commands, prefix):
-            return
-        else:
-            self.stats.add(MESSAGE)
+        # Only called for commands owned by this plugin (see NanoPlugin.routed)
+        self.stats.add(MESSAGE)
 
         def startswith(*matches):
             for match in matches:
@@ -406,6 +419,7 @@ class NanoPlugin:
     version = "22"
 
     handler = Reminder
+    routed = True
     events = {
         "on_message": 10,
         "on_plugins_loaded": 5,
@@ -10,7 +10,8 @@ from discord import utils, Embed, Colour, __version__ as d_version, HTTPExceptio
 from discord import Member, Guild
 
 from core.stats import MESSAGE
-from core.utils import is_valid_command, log_to_file, is_disabled, IgnoredException
+from core.utils import log_to_file, is_disabled, IgnoredException
+from core.schema import MODERATION_SCHEMA
 
 log = logging.getLogger(__name__)
 log.setLevel(logging.INFO)
@@ -39,6 +40,7 @@ class ServerManagement:
         self.client = kwargs.get("client")
         self.loop = kwargs.get("loop")
         self.handler = kwargs.get("handler")
+        self.async_handler = kwargs.get("async_handler")
         self.nano = kwargs.get("nano")
         self.stats = kwargs.get("stats")
         self.trans = kwargs.get("trans")
@@ -46,7 +48,34 @@ class ServerManagement:
         # Debug
         self.lt = time.time()
 
-        self.modp = self.handler.get_plugin_data_manager("moderation")
+        self.modp = self.handler.get_plugin_data_manager("moderation", schema=MODERATION_SCHEMA)
+
+        if self.nano.cluster:
+            self.nano.cluster.register("guild_totals", self.local_totals)
+
+    async def local_totals(self) -> list:
+        members = 0
+        channels = 0
+
+        # Iterate though servers and add up things
+        for guild in self.client.guilds:
+            members += int(guild.member_count)
+            channels += len(guild.channels)
+
+        return [len(self.client.guilds), members, channels]
+
+    async def totals(self) -> tuple:
+        """
+        Returns (guilds, members, channels) of every cluster, or just this process when not clustered
+        """
+        if not self.nano.cluster:
+            return tuple(await self.local_totals())
+
+        results = await self.nano.cluster.query("guild_totals")
+        if not results:
+            return tuple(await self.local_totals())
+
+        return tuple(sum(column) for column in zip(*results.values()))
 
     async def handle_log_channel(self, guild):
         # Older servers may still have names of channels, that can cause an error
@@ -122,11 +151,8 @@ class ServerManagement:
         prefix = kwargs.get("prefix")
         lang = kwargs.get("lang")
 
-        # Check if this is a valid command
-        if not is_valid_command(message.content, commands, prefix):
-            return
-        else:
-            self.stats.add(MESSAGE)
+        # Only called for commands owned by this plugin (see NanoPlugin.routed)
+        self.stats.add(MESSAGE)
 
         def startswith(*matches):
             for match in matches:
@@ -137,16 +163,7 @@ class ServerManagement:
 
         # !status
         if startswith(prefix + "status"):
-            server_count = 0
-            members = 0
-            channels = 0
-
-            # Iterate though servers and add up things
-            for guild in client.guilds:
-
-                server_count += 1
-                members += int(guild.member_count)
-                channels += len(guild.channels)
+            server_count, members, channels = await self.totals()
 
             embed = Embed(name=trans.get("MSG_STATUS_STATS", lang), colour=Colour.dark_blue())
 
@@ -196,7 +213,7 @@ class ServerManagement:
             fields = trans.get("MSG_DEBUG_MULTI", lang).format(nano_version, discord_version, mem_after, abs(garbage),
                                                                cpu, reminders, polls, redis_mem, redis_size)
 
-            total_shards = len(self.client.shards.keys())
+            total_shards = self.client.shard_count
             current_shard = message.guild.shard_id
 
             additional = trans.get("MSG_DEBUG_MULTI_2", lang).format(total_shards, current_shard)
@@ -356,18 +373,10 @@ class ServerManagement:
         # Delay in case servers are still being received
         await asyncio.sleep(10)
 
-        log.info("Checking guild vars...")
-        for guild in self.client.guilds:
-            if not self.handler.server_exists(guild.id):
-                self.handler.server_setup(guild)
-
-            self.handler.check_server_vars(guild)
-        log.info("Done.")
-
-        log.info("Checking for non-used guild data...")
-        server_ids = [s.id for s in self.client.guilds]
-        self.handler.check_old_servers(server_ids)
-        log.info("Done.")
+        log.info("Reconciling guild data...")
+        cluster = self.nano.cluster
+        await self.async_handler.reconcile_guilds(self.client.guilds,
+                                                  owns=cluster.info.owns_guild if cluster else None)
 
 
 class NanoPlugin:
@@ -375,6 +384,7 @@ class NanoPlugin:
     version = "2"
 
     handler = ServerManagement
+    routed = True
     events = {
         "on_message": 10,
         "on_ready": 11,
@@ -8,7 +8,7 @@ except ImportError:
     from json import loads, dumps
 from discord import Embed, Colour
 
-from core.utils import is_valid_command, get_valid_commands
+from core.utils import get_valid_commands
 from core.confparser import get_config_parser
 from core.stats import MESSAGE
 
@@ -182,7 +182,7 @@ class Statistics:
             self.adv_stats.track_user(message.author.id, message.guild.id)
 
         # Check if this is a valid command
-        if not is_valid_command(message.content, commands, prefix):
+        if self.nano.router.get_owner(message.content, prefix) != "statistics":
             return
         else:
             self.stats.add(MESSAGE)
@@ -5,7 +5,7 @@ import steamapi
 from discord import HTTPException
 
 from core.stats import MESSAGE, WRONG_ARG
-from core.utils import is_valid_command, filter_text
+from core.utils import filter_text
 from core.confparser import get_config_parser
 
 logger = logging.getLogger(__name__)
@@ -78,10 +78,8 @@ class Steam:
         trans = self.trans
         lang = kwargs.get("lang")
 
-        if not is_valid_command(message.content, commands, prefix=prefix):
-            return
-        else:
-            self.stats.add(MESSAGE)
+        # Only called for commands owned by this plugin (see NanoPlugin.routed)
+        self.stats.add(MESSAGE)
 
         def startswith(*msg):
             for a in msg:
@@ -183,6 +181,7 @@ class NanoPlugin:
     version = "18"
 
     handler = Steam
+    routed = True
     events = {
         "on_message": 10
         # type : importance
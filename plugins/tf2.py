@@ -15,7 +15,6 @@ from json import JSONDecodeError
 import aiohttp
 
 from core.stats import MESSAGE, WRONG_ARG
-from core.utils import is_valid_command
 from core.confparser import get_config_parser, CACHE_DIR
 
 #####
@@ -344,11 +343,8 @@ class TeamFortress:
         prefix = kwargs.get("prefix")
         lang = kwargs.get("lang")
 
-        # Check if this is a valid command
-        if not is_valid_command(message.content, commands, prefix):
-            return
-        else:
-            self.stats.add(MESSAGE)
+        # Only called for commands owned by this plugin (see NanoPlugin.routed)
+        self.stats.add(MESSAGE)
 
         def startswith(*matches):
             for match in matches:
@@ -391,6 +387,7 @@ class NanoPlugin:
     version = "21"
 
     handler = TeamFortress
+    routed = True
     events = {
         "on_message": 10
         # type : importance
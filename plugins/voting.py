@@ -10,7 +10,8 @@ except ImportError:
 from discord import Embed, Colour, errors
 
 from core.stats import MESSAGE, VOTE, WRONG_PERMS
-from core.utils import is_valid_command, log_to_file, decode, add_dots, filter_text
+from core.utils import log_to_file, add_dots, filter_text
+from core.schema import Schema, to_int
 
 __author__ = "DefaltSimon"
 # Voting plugin
@@ -40,6 +41,8 @@ QUESTION_EMOJI = "❔"
 log = logging.getLogger(__name__)
 log.setLevel(logging.INFO)
 
+VOTING_SCHEMA = Schema("voting", {"author": to_int})
+
 
 class RedisVoteHandler:
     """
@@ -55,7 +58,7 @@ class RedisVoteHandler:
         author: int (author id)
     """
     def __init__(self, handler):
-        self.redis = handler.get_plugin_data_manager(namespace="voting")
+        self.redis = handler.get_plugin_data_manager(namespace="voting", schema=VOTING_SCHEMA)
 
     def get_vote_amount(self) -> int:
         return len(self.redis.scan_iter("*"))
@@ -91,7 +94,7 @@ class RedisVoteHandler:
         if not self.in_progress(server_id):
             return False
 
-        data = decode(self.redis.hgetall(server_id))
+        data = self.redis.hgetall(server_id)
         voters, vote_counts, options = loads(data.get("voters")), loads(data.get("votes")), loads(data.get("choices"))
 
         # Missing option
@@ -154,11 +157,8 @@ class Vote:
         prefix = kwargs.get("prefix")
         lang = kwargs.get("lang")
 
-        # Check if this is a valid command
-        if not is_valid_command(message.content, commands, prefix):
-            return
-        else:
-            self.stats.add(MESSAGE)
+        # Only called for commands owned by this plugin (see NanoPlugin.routed)
+        self.stats.add(MESSAGE)
 
         def startswith(*matches):
             for match in matches:
@@ -357,6 +357,7 @@ class NanoPlugin:
     version = "28"
 
     handler = Vote
+    routed = True
     events = {
         "on_message": 10,
         # type : importance
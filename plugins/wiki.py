@@ -11,7 +11,7 @@ except ImportError:
     from json import loads
 
 from core.stats import MESSAGE
-from core.utils import is_valid_command, add_dots, filter_text
+from core.utils import add_dots, filter_text
 from core.confparser import get_config_parser
 
 logger = logging.getLogger(__name__)
@@ -127,10 +127,8 @@ class Definitions:
         trans = self.trans
         lang = kwargs.get("lang")
 
-        if not is_valid_command(message.content, commands, prefix=prefix):
-            return
-        else:
-            self.stats.add(MESSAGE)
+        # Only called for commands owned by this plugin (see NanoPlugin.routed)
+        self.stats.add(MESSAGE)
 
         def startswith(*msg):
             for a in msg:
@@ -183,6 +181,7 @@ class NanoPlugin:
     version = "10"
 
     handler = Definitions
+    routed = True
     events = {
         "on_message": 10
         # type : importance
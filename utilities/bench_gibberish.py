@@ -0,0 +1,182 @@
+# coding=utf-8
+import argparse
+import os
+import random
+import string
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from plugins import moderator
+from plugins.moderator import GibberishDetector, two_chars
+
+#########################################
+# Gibberish detector benchmark
+# Checks that GibberishDetector.is_gibberish gives the same answers as the original per-bigram implementation
+# on random messages, then times both for 10, 200 and 2000 character messages.
+# The numpy path is only timed when numpy is installed.
+#
+# Run from the repository root:
+#   python utilities/bench_gibberish.py
+#   python utilities/bench_gibberish.py --parity 50000 --sizes 10 50 200 2000
+#########################################
+
+DEFAULT_SIZES = [10, 200, 2000]
+DEFAULT_PARITY = 20000
+DEFAULT_SEED = 1337
+# Messages timed per size (each one is checked several times)
+SAMPLES = 200
+# Seconds to spend timing each implementation and size
+TIME_BUDGET = 0.5
+
+WORDS = ("the quick brown fox jumps over a lazy dog while nano keeps the server tidy and "
+         "everyone talks about games music code memes weather and weekend plans").split()
+MASH = "asdfghjklqwertzuiopyxcvbnm"
+NOISE = string.ascii_letters + string.digits + string.punctuation + " \n\tčšžéñ\N{GRINNING FACE}"
+
+
+def reference(detector: GibberishDetector, message: str):
+    """
+    The original implementation
+    """
+    if not message:
+        return
+
+    th = len(message) / 1.8
+    c = float(0)
+    for ca, cb in two_chars(message):
+
+        if detector.data[detector.char_positions[ca]][detector.char_positions[cb]] < detector.threshold[detector.char_positions[ca]]:
+            c += 1
+
+    return bool(c >= th)
+
+
+# MESSAGES
+
+def sentence(rng: random.Random, length: int) -> str:
+    words = []
+    size = 0
+    while size < length:
+        word = rng.choice(WORDS)
+        words.append(word.upper() if rng.random() < 0.05 else word)
+        size += len(word) + 1
+
+    return " ".join(words)[:length]
+
+
+def mash(rng: random.Random, length: int) -> str:
+    return "".join(rng.choice(MASH) for _ in range(length))
+
+
+def noise(rng: random.Random, length: int) -> str:
+    return "".join(rng.choice(NOISE) for _ in range(length))
+
+
+def mixed(rng: random.Random, length: int) -> str:
+    parts = []
+    size = 0
+    while size < length:
+        part = rng.choice((sentence, mash, noise))(rng, rng.randint(1, 40))
+        parts.append(part)
+        size += len(part)
+
+    return "".join(parts)[:length]
+
+
+KINDS = (sentence, mash, noise, mixed)
+
+
+def message(rng: random.Random, length: int) -> str:
+    return rng.choice(KINDS)(rng, length)
+
+
+# MEASUREMENT
+
+def check_parity(detector: GibberishDetector, rng: random.Random, amount: int) -> int:
+    """
+    Compares both implementations on random messages, shorter and longer than VECTORIZE_FROM
+    """
+    mismatches = 0
+    gibberish = 0
+
+    for number in range(amount):
+        length = rng.choice((0, 1, 2, 3, rng.randint(1, 40), rng.randint(40, 400), rng.randint(400, 2500)))
+        text = message(rng, length)
+
+        expected = reference(detector, text)
+        got = detector.is_gibberish(text)
+        gibberish += bool(expected)
+
+        if got != expected:
+            mismatches += 1
+            if mismatches <= 5:
+                print("  MISMATCH: expected {}, got {} for {!r}".format(expected, got, text[:80]))
+
+    print("Parity: {} messages, {} gibberish, {} mismatches".format(amount, gibberish, mismatches))
+    return mismatches
+
+
+def per_message(function, messages: list) -> float:
+    """
+    Mean microseconds per call
+    """
+    calls = 0
+    started = time.perf_counter()
+
+    while True:
+        for text in messages:
+            function(text)
+        calls += len(messages)
+
+        elapsed = time.perf_counter() - started
+        if elapsed >= TIME_BUDGET:
+            return elapsed / calls * 1e6
+
+
+def run_timings(detector: GibberishDetector, rng: random.Random, sizes: list):
+    implementations = [("original", lambda text: reference(detector, text))]
+    implementations.append(("python", detector.is_gibberish))
+    if moderator.numpy is not None:
+        implementations.append(("numpy", detector.is_gibberish))
+
+    print("\n{:<8} {}  (us per message)".format("chars", " ".join("{:>12}".format(a) for a, _ in implementations)))
+
+    original_split = moderator.VECTORIZE_FROM
+    for size in sizes:
+        messages = [message(rng, size) for _ in range(SAMPLES)]
+
+        results = []
+        for name, function in implementations:
+            # Force one path or the other
+            moderator.VECTORIZE_FROM = 0 if name == "numpy" else 10 ** 9
+            results.append(per_message(function, messages))
+
+        moderator.VECTORIZE_FROM = original_split
+
+        print("{:<8} {}".format(size, " ".join("{:>12.2f}".format(a) for a in results)))
+
+    if moderator.numpy is None:
+        print("\nnumpy is not installed, only the python path was timed")
+
+
+def main(args) -> int:
+    rng = random.Random(args.seed)
+    detector = GibberishDetector()
+
+    if args.parity and check_parity(detector, rng, args.parity):
+        return 1
+
+    run_timings(detector, rng, args.sizes)
+    return 0
+
+
+if __name__ == "__main__":
+    arguments = argparse.ArgumentParser(description="Checks and benchmarks the gibberish detector")
+    arguments.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="message lengths to time")
+    arguments.add_argument("--parity", type=int, default=DEFAULT_PARITY,
+                           help="random messages to compare with the original implementation (0 = skip)")
+    arguments.add_argument("--seed", type=int, default=DEFAULT_SEED)
+
+    sys.exit(main(arguments.parse_args()))
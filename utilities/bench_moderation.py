@@ -0,0 +1,166 @@
+# coding=utf-8
+import argparse
+import os
+import random
+import string
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from core.offline import OfflineGuild, OfflineMessage
+from plugins import moderator
+from plugins.moderator import NanoModerator, PendingCheck, WordAutomaton
+
+#########################################
+# Batched moderation benchmark
+# Checks that NanoModerator.check_batch gives the same verdicts as check_spam, check_swearing and check_invite
+# called one message at a time, then times both on a raid-like stream (repeats, pastes from many accounts,
+# caps, mention spam, invites, swearing, gibberish and normal chat) for several batch sizes.
+#
+# Run from the repository root:
+#   python utilities/bench_moderation.py
+#   python utilities/bench_moderation.py --messages 20000 --batches 16 64 256 1024
+#########################################
+
+DEFAULT_MESSAGES = 10000
+DEFAULT_BATCHES = [16, 64, 256]
+DEFAULT_SEED = 1337
+AUTHORS = 40
+
+WORDS = ("the quick brown fox jumps over a lazy dog while nano keeps the server tidy and "
+         "everyone talks about games music code memes weather and weekend plans").split()
+SWEARING = ["ass", "a$$", "b00bs", "blow job", "bastard"]
+GUILD_WORDS = ["pineapple", "no pizza"]
+LINKS = ["https://example.com/a?b=c", "http://discord.gg/nano", "discord.gg/abc123"]
+MASH = "asdfghjklqwertzuiopyxcvbnm"
+RAIDS = ["free nitro giveaway click the link below to claim your gift before it expires",
+         "this server is getting raided join our server instead we have better memes and events"]
+
+
+class Stream:
+    def __init__(self, seed: int):
+        self.rng = random.Random(seed)
+
+        self.guild = OfflineGuild("bench")
+        self.channel = self.guild.add_channel("general")
+        self.members = [self.guild.add_member("member{}".format(a)) for a in range(AUTHORS)]
+        self.roles = [self.guild.add_role("role{}".format(a)) for a in range(8)]
+
+        self.last = {}
+
+    def text(self) -> str:
+        rng = self.rng
+        kind = rng.random()
+
+        if kind < 0.25:
+            words = [rng.choice(WORDS) for _ in range(rng.randint(1, 30))]
+        elif kind < 0.35:
+            # The same text with a mention or a number added
+            words = rng.choice(RAIDS).split() + [rng.choice(["<@{}>".format(rng.choice(self.members).id),
+                                                             str(rng.randint(0, 9999)), ""])]
+        elif kind < 0.5:
+            words = ["".join(rng.choice(MASH) for _ in range(rng.randint(3, 40))) for _ in range(rng.randint(1, 8))]
+        elif kind < 0.6:
+            words = [rng.choice(WORDS).upper() for _ in range(rng.randint(1, 10))]
+        elif kind < 0.7:
+            words = [rng.choice(WORDS) for _ in range(rng.randint(1, 10))] + [rng.choice(SWEARING + GUILD_WORDS)]
+        elif kind < 0.8:
+            words = [rng.choice(WORDS) for _ in range(rng.randint(0, 10))] + [rng.choice(LINKS)]
+        else:
+            words = ["".join(rng.choice(string.printable + "čšž") for _ in range(rng.randint(1, 300)))]
+
+        rng.shuffle(words)
+        return " ".join(words)
+
+    def message(self) -> OfflineMessage:
+        rng = self.rng
+        author = rng.choice(self.members)
+
+        # Raiders repeat themselves
+        if author.id in self.last and rng.random() < 0.3:
+            content = self.last[author.id]
+        else:
+            content = self.text()
+        self.last[author.id] = content
+
+        mentions = rng.sample(self.members, rng.randint(0, 8)) if rng.random() < 0.1 else None
+        role_mentions = rng.sample(self.roles, rng.randint(0, 4)) if rng.random() < 0.05 else None
+
+        return OfflineMessage(content, self.channel, author, mentions=mentions, role_mentions=role_mentions)
+
+
+def pending(messages: list, automaton: WordAutomaton) -> list:
+    return [PendingCheck(message, True, True, True, automaton) for message in messages]
+
+
+def one_by_one(checker: NanoModerator, checks: list) -> list:
+    return [(checker.check_spam(check.message.author.id, check.message.content, check.message),
+             checker.check_swearing(check.message.content, check.guild_automaton),
+             checker.check_invite(check.message.content)) for check in checks]
+
+
+def batched(checker: NanoModerator, checks: list, size: int) -> list:
+    verdicts = []
+    for start in range(0, len(checks), size):
+        verdicts += checker.check_batch(checks[start:start + size])
+
+    return verdicts
+
+
+def check_parity(checks: list, sizes: list) -> int:
+    expected = one_by_one(NanoModerator(), checks)
+    flagged = sum([1 for verdict in expected if any(verdict)])
+
+    mismatches = 0
+    for size in sizes:
+        got = batched(NanoModerator(), checks, size)
+
+        for check, want, verdict in zip(checks, expected, got):
+            if want != verdict:
+                mismatches += 1
+                if mismatches <= 5:
+                    print("  MISMATCH (batch {}): expected {}, got {} for {!r}".format(
+                        size, want, verdict, check.message.content[:80]))
+
+    print("Parity: {} messages, {} flagged, {} mismatches".format(len(checks), flagged, mismatches))
+    return mismatches
+
+
+def timed(function) -> float:
+    started = time.perf_counter()
+    function()
+    return time.perf_counter() - started
+
+
+def main(args) -> int:
+    stream = Stream(args.seed)
+    checks = pending([stream.message() for _ in range(args.messages)], WordAutomaton(GUILD_WORDS))
+
+    if check_parity(checks, args.batches):
+        return 1
+
+    print("\n{:<12} {:>10} {:>12}".format("batch", "msg/s", "us/message"))
+
+    checker = NanoModerator()
+    elapsed = timed(lambda: one_by_one(checker, checks))
+    print("{:<12} {:>10.0f} {:>12.2f}".format("none", len(checks) / elapsed, elapsed / len(checks) * 1e6))
+
+    for size in args.batches:
+        checker = NanoModerator()
+        elapsed = timed(lambda: batched(checker, checks, size))
+        print("{:<12} {:>10.0f} {:>12.2f}".format(size, len(checks) / elapsed, elapsed / len(checks) * 1e6))
+
+    if moderator.numpy is None:
+        print("\nnumpy is not installed, caps and gibberish were scored in Python")
+
+    return 0
+
+
+if __name__ == "__main__":
+    arguments = argparse.ArgumentParser(description="Checks and benchmarks batched moderation")
+    arguments.add_argument("--messages", type=int, default=DEFAULT_MESSAGES)
+    arguments.add_argument("--batches", type=int, nargs="+", default=DEFAULT_BATCHES, help="batch sizes to time")
+    arguments.add_argument("--seed", type=int, default=DEFAULT_SEED)
+
+    sys.exit(main(arguments.parse_args()))
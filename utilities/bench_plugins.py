@@ -0,0 +1,367 @@
+# coding=utf-8
+import argparse
+import json
+import logging
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from core.expiring import ExpiringMap
+from core.offline import OfflineGuild, OfflineMessage, use_offline_settings, connect_offline, setup_guild, outbox
+
+#########################################
+# Plugin stack benchmark
+# Feeds synthetic message streams through Nano.dispatch_event without Discord or Redis:
+# storage uses the in-memory backend and messages come from the stand-ins in core/offline.py.
+# Reports messages/sec, per-plugin latency and per-call allocations for every workload.
+#
+# Run from the repository root (needs data/settings.ini, a copy of the example works):
+#   python utilities/bench_plugins.py
+#   python utilities/bench_plugins.py --workload spam --messages 5000
+#   python utilities/bench_plugins.py --save bench.json
+#   python utilities/bench_plugins.py --baseline bench.json   (exits with 1 on a regression)
+#########################################
+
+# Must be set before nano.py creates the handlers
+use_offline_settings()
+
+import nano as bot_module
+from nano import ON_MESSAGE
+
+# Keep the output readable, plugin errors are counted in the latency histograms
+# (the reporter plugin still prints their tracebacks to stderr)
+logging.disable(logging.CRITICAL)
+
+nano = bot_module.nano
+handler = bot_module.handler
+loop = bot_module.loop
+
+PREFIX = "!"
+
+GUILDS = 4
+CHANNELS = 3
+MEMBERS = 60
+CUSTOM_COMMANDS = 300
+
+DEFAULT_MESSAGES = 2000
+DEFAULT_SEED = 1337
+# A workload counts as regressed when its throughput drops by more than this (--baseline)
+DEFAULT_TOLERANCE = 0.2
+
+COMMANDS = [
+    "ping", "roll 100", "dice 3d6", "decide pizza|pasta|salad", "8ball will this ship?",
+    "quote", "hello", "uptime", "kappa", "help", "cmds", "stats",
+]
+
+WORDS = ("the quick brown fox jumps over a lazy dog while nano keeps the server tidy and "
+         "everyone talks about games music code memes weather and weekend plans").split()
+
+
+class World:
+    """
+    Offline guilds the workloads post in, set up in the in-memory database like real ones
+    """
+    def __init__(self, rng: random.Random):
+        self.rng = rng
+        self.bot_user = connect_offline(bot_module.client)
+        self.guilds = []
+
+        for number in range(GUILDS):
+            guild = OfflineGuild("Guild {}".format(number), bot_user=self.bot_user)
+            mod = guild.add_role("Nano Mod")
+
+            for channel in range(CHANNELS):
+                guild.add_channel("channel-{}".format(channel))
+            for member in range(MEMBERS):
+                guild.add_member("member-{}".format(member), roles=[mod] if member == 0 else None)
+
+            setup_guild(handler, bot_module.client, guild, PREFIX)
+            self.guilds.append(guild)
+
+        # The first guild is the custom-command-heavy one
+        self.triggers = ["trigger{}".format(a) for a in range(CUSTOM_COMMANDS)]
+        for trigger in self.triggers:
+            handler.set_command(self.guilds[0], trigger, "Response to {} for {{author|mention}}".format(trigger))
+
+    def place(self, guild=None):
+        guild = guild or self.rng.choice(self.guilds)
+        channel = self.rng.choice(guild.channels)
+        # guild.members[0] is the bot
+        author = self.rng.choice(guild.members[1:])
+
+        return guild, channel, author
+
+    def sentence(self, words: int=8) -> str:
+        return " ".join(self.rng.choice(WORDS) for _ in range(words))
+
+
+# WORKLOADS
+# Each one builds its messages up front, so generating them isn't measured
+
+def chatter(world: World, amount: int) -> list:
+    messages = []
+    for _ in range(amount):
+        guild, channel, author = world.place()
+        messages.append(channel_message(channel, author, world.sentence(world.rng.randint(3, 20))))
+
+    return messages
+
+
+def command_mix(world: World, amount: int) -> list:
+    messages = []
+    for _ in range(amount):
+        guild, channel, author = world.place()
+
+        if world.rng.random() < 0.7:
+            content = PREFIX + world.rng.choice(COMMANDS)
+        else:
+            content = world.sentence()
+
+        messages.append(channel_message(channel, author, content))
+
+    return messages
+
+
+def spam_bursts(world: World, amount: int) -> list:
+    messages = []
+    while len(messages) < amount:
+        guild, channel, author = world.place()
+
+        # A user repeating themselves quickly, then some normal chatter
+        text = world.sentence(5)
+        for _ in range(world.rng.randint(4, 10)):
+            messages.append(channel_message(channel, author, text))
+
+        messages.extend(chatter(world, world.rng.randint(1, 5)))
+
+    return messages[:amount]
+
+
+def custom_commands(world: World, amount: int) -> list:
+    guild = world.guilds[0]
+
+    messages = []
+    for _ in range(amount):
+        guild, channel, author = world.place(guild)
+
+        roll = world.rng.random()
+        if roll < 0.6:
+            content = world.rng.choice(world.triggers)
+        elif roll < 0.8:
+            content = "{} {}".format(world.rng.choice(world.triggers), world.sentence(3))
+        else:
+            content = world.sentence()
+
+        messages.append(channel_message(channel, author, content))
+
+    return messages
+
+
+def mentions(world: World, amount: int) -> list:
+    messages = []
+    for _ in range(amount):
+        guild, channel, author = world.place()
+
+        users = world.rng.sample(guild.members[1:], world.rng.randint(1, 15))
+        roles = world.rng.sample(guild.roles, world.rng.randint(0, len(guild.roles)))
+        # Some talk to Nano directly (conversation plugin)
+        if world.rng.random() < 0.2:
+            users.insert(0, guild.me)
+
+        content = " ".join([a.mention for a in users] + [a.mention for a in roles] + [world.sentence(4)])
+        messages.append(channel_message(channel, author, content, mentions=users, role_mentions=roles))
+
+    return messages
+
+
+WORKLOADS = {
+    "chatter": chatter,
+    "commands": command_mix,
+    "spam": spam_bursts,
+    "custom": custom_commands,
+    "mentions": mentions,
+}
+
+
+def channel_message(channel, author, content: str, **kwargs) -> OfflineMessage:
+    return OfflineMessage(content, channel, author, **kwargs)
+
+
+# MEASUREMENT
+
+def reset_plugin_state():
+    # Rate limit buckets and caches fill up during a run, start every workload from the same state
+    nano.latency.reset()
+    outbox.reset()
+
+    for plugin in nano.plugins.values():
+        buckets = getattr(plugin.instance, "buckets", None)
+        if isinstance(buckets, (dict, ExpiringMap)):
+            buckets.clear()
+
+
+async def run_throughput(messages: list) -> dict:
+    reset_plugin_state()
+
+    started = time.perf_counter()
+    for message in messages:
+        await nano.dispatch_event(ON_MESSAGE, message)
+    elapsed = time.perf_counter() - started
+
+    plugins = {}
+    for (plugin, event), hist in nano.latency.histograms.items():
+        if event == ON_MESSAGE and hist.calls:
+            plugins[plugin] = hist.to_dict()
+
+    return {
+        "messages": len(messages),
+        "seconds": round(elapsed, 4),
+        "per_second": round(len(messages) / elapsed, 1),
+        "sent": outbox.count,
+        "deleted": outbox.deleted,
+        "errors": sum(a["errors"] for a in plugins.values()),
+        "plugins": plugins,
+    }
+
+
+def measured(plugin: str, callback, allocations: dict):
+    async def wrapper(*args, **kwargs):
+        # Restarting resets the peak and the traced size to 0 (tracemalloc.reset_peak needs Python 3.9)
+        tracemalloc.stop()
+        tracemalloc.start()
+
+        try:
+            return await callback(*args, **kwargs)
+        finally:
+            current, peak = tracemalloc.get_traced_memory()
+
+            entry = allocations.setdefault(plugin, [0, 0, 0])
+            entry[0] += 1
+            entry[1] += peak
+            entry[2] += current
+
+    return wrapper
+
+
+async def run_allocations(messages: list) -> dict:
+    """
+    Peak memory a plugin allocates while handling one message, and what it still holds afterwards.
+    Stages run one by one offline, so the numbers don't mix between plugins.
+    """
+    reset_plugin_state()
+
+    allocations = {}
+    pipeline = nano.pipelines[ON_MESSAGE]
+    stages = list(pipeline)
+    originals = [stage.callback for stage in stages]
+
+    for stage in stages:
+        stage.callback = measured(stage.plugin, stage.callback, allocations)
+
+    tracemalloc.start()
+    try:
+        for message in messages:
+            await nano.dispatch_event(ON_MESSAGE, message)
+    finally:
+        tracemalloc.stop()
+
+        for stage, callback in zip(stages, originals):
+            stage.callback = callback
+
+    return {plugin: {"peak_kib": round(peak / calls / 1024, 2), "retained_b": round(retained / calls, 1)}
+            for plugin, (calls, peak, retained) in allocations.items()}
+
+
+def print_results(name: str, result: dict):
+    print("\n== {} ==".format(name))
+    print("{} messages in {}s: {} msg/s, {} replies, {} deleted, {} errors".format(
+        result["messages"], result["seconds"], result["per_second"], result["sent"], result["deleted"],
+        result["errors"]))
+
+    print("{:<14} {:>7} {:>6} {:>9} {:>7} {:>7} {:>8} {:>9} {:>11}".format(
+        "plugin", "calls", "errors", "mean(us)", "p50", "p99", "max", "peak KiB", "retained B"))
+
+    allocations = result.get("allocations", {})
+    for plugin, summary in sorted(result["plugins"].items(), key=lambda a: a[1]["total"], reverse=True):
+        alloc = allocations.get(plugin, {})
+        print("{:<14} {:>7} {:>6} {:>9} {:>7} {:>7} {:>8} {:>9} {:>11}".format(
+            plugin, summary["calls"], summary["errors"], summary["mean"], summary["p50"], summary["p99"],
+            summary["max"], alloc.get("peak_kib", "-"), alloc.get("retained_b", "-")))
+
+
+def compare(results: dict, baseline_path: str, tolerance: float) -> bool:
+    with open(baseline_path) as file:
+        baseline = json.load(file)
+
+    ok = True
+    print("\n== compared to {} ==".format(baseline_path))
+    for name, result in results.items():
+        before = baseline.get(name)
+        if before is None:
+            continue
+
+        change = result["per_second"] / before["per_second"] - 1
+        regressed = change < -tolerance
+        ok = ok and not regressed
+
+        print("{:<10} {:>9} -> {:>9} msg/s ({:+.1%}){}".format(
+            name, before["per_second"], result["per_second"], change, "  REGRESSION" if regressed else ""))
+
+    return ok
+
+
+async def main(args) -> int:
+    rng = random.Random(args.seed)
+    # Plugins that pick random replies (8ball, quotes, ...) should be repeatable too
+    random.seed(args.seed)
+
+    world = World(rng)
+    names = args.workload or list(WORKLOADS)
+
+    # Warm up caches (guild settings, command tries, translations)
+    for message in chatter(world, 100) + command_mix(world, 100):
+        await nano.dispatch_event(ON_MESSAGE, message)
+
+    results = {}
+    for name in names:
+        messages = WORKLOADS[name](world, args.messages)
+
+        result = await run_throughput(messages)
+        if not args.no_alloc:
+            result["allocations"] = await run_allocations(messages)
+
+        # Total time spent in a plugin, for sorting
+        for summary in result["plugins"].values():
+            summary["total"] = round(summary["mean"] * summary["calls"])
+
+        results[name] = result
+        print_results(name, result)
+
+    if args.save:
+        with open(args.save, "w") as file:
+            json.dump(results, file, indent=2)
+        print("\nResults saved to {}".format(args.save))
+
+    if args.baseline and not compare(results, args.baseline, args.tolerance):
+        return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    arguments = argparse.ArgumentParser(description="Offline benchmark of Nano's plugin stack")
+    arguments.add_argument("--workload", action="append", choices=list(WORKLOADS),
+                           help="workload to run (repeatable), defaults to all")
+    arguments.add_argument("--messages", type=int, default=DEFAULT_MESSAGES, help="messages per workload")
+    arguments.add_argument("--seed", type=int, default=DEFAULT_SEED)
+    arguments.add_argument("--no-alloc", action="store_true", help="skip the (slower) allocation pass")
+    arguments.add_argument("--save", help="write the results as JSON")
+    arguments.add_argument("--baseline", help="JSON from an earlier --save to compare throughput with")
+    arguments.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                           help="allowed throughput drop before failing (0.2 = 20%%)")
+
+    sys.exit(loop.run_until_complete(main(arguments.parse_args())))
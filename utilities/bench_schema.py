@@ -0,0 +1,78 @@
+# coding=utf-8
+import os
+import sys
+import timeit
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from core.utils import decode
+from core.schema import SERVER_SCHEMA, COMMANDS_SCHEMA, BLACKLIST_SCHEMA, MUTES_SCHEMA
+
+#########################################
+# Redis reply decoding benchmark
+# Compares decode() with the schemas from core/schema.py on get_server_data-like replies
+# (raw redis-py replies: bytes everywhere)
+# Run from the repository root: python utilities/bench_schema.py
+#########################################
+
+ROUNDS = 20000
+
+settings = {
+    b"name": b"Some Guild", b"owner": b"171633949532094464", b"prefix": b"!",
+    b"lang": b"en", b"sleeping": b"False", b"wordfilter": b"True", b"spamfilter": b"True",
+    b"invitefilter": b"False", b"logchannel": b"264376548239425536",
+    b"welcomemsg": b"Welcome to :server, :user!", b"leavemsg": b"**:username** has left",
+    b"dchan": b"264376548239425537",
+}
+
+commands = {"cmd{}".format(i).encode(): "response number {} with {{author|mention}}".format(i).encode()
+            for i in range(40)}
+# Numeric triggers, decode() turns these into ints
+commands[b"1337"] = b"leet"
+commands[b"404"] = b"not found"
+
+blacklist = {str(264376548239425540 + i).encode() for i in range(10)}
+mutes = {str(171633949532094470 + i).encode() for i in range(25)}
+
+PAYLOADS = {
+    "settings": (settings, decode, SERVER_SCHEMA.hash),
+    "commands": (commands, decode, COMMANDS_SCHEMA.hash),
+    "blacklist": (blacklist, decode, BLACKLIST_SCHEMA.members),
+    "mutes": (mutes, decode, MUTES_SCHEMA.members),
+}
+
+
+def server_data_untyped():
+    return {"settings": decode(settings), "commands": decode(commands),
+            "blacklist": list(decode(blacklist)), "mutes": list(decode(mutes))}
+
+
+def server_data_typed():
+    return {"settings": SERVER_SCHEMA.hash(settings), "commands": COMMANDS_SCHEMA.hash(commands),
+            "blacklist": list(BLACKLIST_SCHEMA.members(blacklist)), "mutes": list(MUTES_SCHEMA.members(mutes))}
+
+
+print("{:<12} {:>12} {:>12} {:>8}".format("payload", "decode (us)", "schema (us)", "speedup"))
+
+for name, (raw, untyped, typed) in PAYLOADS.items():
+    old = timeit.timeit(lambda: untyped(raw), number=ROUNDS) / ROUNDS * 1e6
+    new = timeit.timeit(lambda: typed(raw), number=ROUNDS) / ROUNDS * 1e6
+
+    print("{:<12} {:>12.2f} {:>12.2f} {:>7.1f}x".format(name, old, new, old / new))
+
+old = timeit.timeit(server_data_untyped, number=ROUNDS) / ROUNDS * 1e6
+new = timeit.timeit(server_data_typed, number=ROUNDS) / ROUNDS * 1e6
+print("{:<12} {:>12.2f} {:>12.2f} {:>7.1f}x".format("all", old, new, old / new))
+
+# Entries where decode() guessed a different type than the schema declares
+print("\nDifferences:")
+for name, (raw, untyped, typed) in PAYLOADS.items():
+    old, new = untyped(raw), typed(raw)
+    if not isinstance(old, dict):
+        old, new = dict.fromkeys(old), dict.fromkeys(new)
+
+    by_name = {str(k): (k, v) for k, v in new.items()}
+    for key, value in old.items():
+        new_key, new_value = by_name[str(key)]
+        if type(key) is not type(new_key) or type(value) is not type(new_value) or value != new_value:
+            print("  {}: {!r}: {!r} (decode: {!r}: {!r})".format(name, new_key, new_value, key, value))
@@ -0,0 +1,46 @@
+# coding=utf-8
+import os
+import sys
+import timeit
+from types import SimpleNamespace
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from core.templates import Parser, compile_template, render_template
+
+#########################################
+# Custom command template benchmark
+# Compares the interpreted Parser.parse with compiled templates (core/templates.py)
+# Run from the repository root: python utilities/bench_templates.py
+#########################################
+
+ROUNDS = 20000
+
+TEMPLATES = {
+    "static": "Welcome to the server! Read the rules in #rules.",
+    "author": "Hi {author|mention}, your id is {author|id}",
+    "mixed": "{onfail|Something went wrong} {author|name} rolled {rnd|1|6} and chose {choose|tea|coffee|water} "
+             "at {time|format|%H:%M}, poking {mentions|0|mention}",
+    "many": " ".join("{rnd|1|100}" for _ in range(20)),
+}
+
+
+def _member(name, user_id):
+    return SimpleNamespace(name=name, display_name=name.title(), id=user_id, mention="<@{}>".format(user_id),
+                           discriminator="0001", avatar_url=None, default_avatar_url="https://example.com/a.png")
+
+
+message = SimpleNamespace(author=_member("nano", 1), mentions=[_member("someone", 2)])
+parser = Parser()
+
+print("{:<8} {:>12} {:>12} {:>8}".format("template", "parse (us)", "compiled (us)", "speedup"))
+
+for name, text in TEMPLATES.items():
+    compiled = compile_template(text)
+
+    interpreted = timeit.timeit(lambda: parser.parse(text, message), number=ROUNDS) / ROUNDS * 1e6
+    rendered = timeit.timeit(lambda: render_template(compiled, message), number=ROUNDS) / ROUNDS * 1e6
+    compile_cost = timeit.timeit(lambda: compile_template(text), number=ROUNDS) / ROUNDS * 1e6
+
+    print("{:<8} {:>12.2f} {:>12.2f} {:>7.1f}x   (compiling once: {:.2f}us)".format(
+        name, interpreted, rendered, interpreted / rendered, compile_cost))
@@ -0,0 +1,222 @@
+# coding=utf-8
+import os
+import sys
+import tempfile
+import timeit
+
+import redis
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from core.serverhandler import ServerHandler
+from core.localstore import SQLiteRedis
+
+#########################################
+# Storage backend conformance check
+# Runs the same commands against Redis (from settings.ini) and a temporary sqlite store
+# (core/localstore.py) and compares the replies. Only keys under "conformance:" are touched.
+# Run from the repository root: python utilities/check_backends.py
+#########################################
+
+PREFIX = "conformance:"
+ROUNDS = 5000
+
+
+def k(name):
+    return PREFIX + name
+
+
+# (method, args, kwargs, unordered)
+# Unordered replies (sets, hash fields, scans) are sorted before comparing
+CASES = [
+    # Strings and keys
+    ("set", (k("str"), "value"), {}, False),
+    ("get", (k("str"), ), {}, False),
+    ("set", (k("str"), 1), {"nx": True}, False),
+    ("set", (k("str"), 2), {"xx": True}, False),
+    ("get", (k("str"), ), {}, False),
+    ("get", (k("missing"), ), {}, False),
+    ("set", (k("temp"), 0), {"ex": 100}, False),
+    ("ttl", (k("temp"), ), {}, False),
+    ("ttl", (k("str"), ), {}, False),
+    ("ttl", (k("missing"), ), {}, False),
+    ("expire", (k("str"), 50), {}, False),
+    ("expire", (k("missing"), 50), {}, False),
+    ("exists", (k("str"), k("temp"), k("missing")), {}, False),
+    ("type", (k("str"), ), {}, False),
+
+    # Hashes
+    ("hset", (k("hash"), "a", "1"), {}, False),
+    ("hset", (k("hash"), ), {"mapping": {"b": 2, "c": "three", "a": "one"}}, False),
+    ("hget", (k("hash"), "a"), {}, False),
+    ("hget", (k("hash"), "zzz"), {}, False),
+    ("hmget", (k("hash"), ["a", "zzz", "c"]), {}, False),
+    ("hgetall", (k("hash"), ), {}, True),
+    ("hgetall", (k("missing"), ), {}, True),
+    ("hkeys", (k("hash"), ), {}, True),
+    ("hlen", (k("hash"), ), {}, False),
+    ("hexists", (k("hash"), "b"), {}, False),
+    ("hexists", (k("hash"), "zzz"), {}, False),
+    ("hincrby", (k("hash"), "b", 5), {}, False),
+    ("hincrby", (k("hash"), "new", 1), {}, False),
+    ("hdel", (k("hash"), "a", "zzz"), {}, False),
+    ("hdel", (k("hash"), "b", "c", "new"), {}, False),
+    ("exists", (k("hash"), ), {}, False),
+
+    # Sets
+    ("sadd", (k("set"), 1, 2, 3, "x"), {}, False),
+    ("sadd", (k("set"), 1), {}, False),
+    ("smembers", (k("set"), ), {}, True),
+    ("sismember", (k("set"), 2), {}, False),
+    ("sismember", (k("set"), 9), {}, False),
+    ("sismember", (k("missing"), 9), {}, False),
+    ("scard", (k("set"), ), {}, False),
+    ("srem", (k("set"), 1, 9), {}, False),
+    ("smembers", (k("missing"), ), {}, True),
+
+    # Lists
+    ("lpush", (k("list"), "a", "b", "c"), {}, False),
+    ("rpush", (k("list"), "d", "a"), {}, False),
+    ("lrange", (k("list"), 0, -1), {}, False),
+    ("lrange", (k("list"), 1, 2), {}, False),
+    ("lrange", (k("list"), -2, -1), {}, False),
+    ("lrange", (k("list"), 5, 10), {}, False),
+    ("llen", (k("list"), ), {}, False),
+    ("lrem", (k("list"), 1, "a"), {}, False),
+    ("lrange", (k("list"), 0, -1), {}, False),
+    ("lpop", (k("list"), ), {}, False),
+    ("rpop", (k("list"), ), {}, False),
+    ("lpop", (k("missing"), ), {}, False),
+
+    # Scans and deletes
+    ("scan_iter", (), {"match": PREFIX + "*"}, True),
+    ("keys", (PREFIX + "h*", ), {}, True),
+    ("delete", (k("str"), k("missing"), k("set")), {}, False),
+    ("unlink", (k("temp"), ), {}, False),
+    ("scan_iter", (), {"match": PREFIX + "*"}, True),
+
+    # Wrong types
+    ("hget", (k("list"), "a"), {}, False),
+    ("sadd", (k("list"), "a"), {}, False),
+]
+
+# Commands sent through execute_command and pipelines (what the handlers and the batcher do)
+RAW_CASES = [
+    ("HSET", k("raw"), "prefix", "!", "lang", "en"),
+    ("HGETALL", k("raw")),
+    ("SISMEMBER", k("raw:set"), "1"),
+    ("SET", k("raw:str"), "x", "EX", "10"),
+    ("TTL", k("raw:str")),
+    ("DEL", k("raw"), k("raw:str")),
+]
+
+
+def normalize(result, unordered: bool):
+    if isinstance(result, Exception):
+        return "error: {}".format(type(result).__name__)
+
+    if unordered:
+        if isinstance(result, dict):
+            return sorted(result.items())
+        if isinstance(result, (list, set)):
+            return sorted(result)
+
+    return result
+
+
+def run(client, method, args, kwargs, unordered):
+    try:
+        result = getattr(client, method)(*args, **kwargs)
+        if method.endswith("_iter"):
+            result = list(result)
+    except redis.RedisError as e:
+        result = e
+
+    return normalize(result, unordered)
+
+
+def cleanup(client):
+    keys = list(client.scan_iter(match=PREFIX + "*"))
+    if keys:
+        client.delete(*keys)
+
+
+def compare(reference, local) -> int:
+    failures = 0
+
+    for method, args, kwargs, unordered in CASES:
+        expected = run(reference, method, args, kwargs, unordered)
+        got = run(local, method, args, kwargs, unordered)
+
+        if expected != got:
+            failures += 1
+            print("MISMATCH {}{}: redis {!r}, sqlite {!r}".format(method, args, expected, got))
+
+    for client in (reference, local):
+        client.sadd(k("raw:set"), 1)
+
+    for command in RAW_CASES:
+        expected = normalize(reference.execute_command(*command), True)
+        got = normalize(local.execute_command(*command), True)
+
+        if expected != got:
+            failures += 1
+            print("MISMATCH {}: redis {!r}, sqlite {!r}".format(command, expected, got))
+
+    # Pipelines run every command and return the errors in place with raise_on_error=False
+    results = []
+    for client in (reference, local):
+        pipe = client.pipeline(transaction=False)
+        pipe.hset(k("pipe"), "a", 1)
+        pipe.execute_command("HGET", k("pipe"), "a")
+        pipe.sadd(k("pipe"), "wrong type")
+        pipe.hgetall(k("pipe"))
+        results.append([normalize(a, False) for a in pipe.execute(raise_on_error=False)])
+
+    if results[0] != results[1]:
+        failures += 1
+        print("MISMATCH pipeline: redis {!r}, sqlite {!r}".format(*results))
+
+    return failures
+
+
+def benchmark(client, name):
+    client.hset(k("bench"), mapping={"prefix": "!", "lang": "en", "sleeping": "False", "logchannel": "1234"})
+    client.sadd(k("bench:set"), 1, 2, 3)
+
+    hgetall = timeit.timeit(lambda: client.hgetall(k("bench")), number=ROUNDS) / ROUNDS * 1e6
+    sismember = timeit.timeit(lambda: client.sismember(k("bench:set"), 2), number=ROUNDS) / ROUNDS * 1e6
+    hset = timeit.timeit(lambda: client.hset(k("bench"), "lang", "en"), number=ROUNDS) / ROUNDS * 1e6
+
+    print("{:<8} HGETALL {:>8.1f}us  SISMEMBER {:>8.1f}us  HSET {:>8.1f}us".format(name, hgetall, sismember, hset))
+
+
+print("-------------------------")
+print("STORAGE BACKEND CONFORMANCE")
+print("-------------------------")
+
+redis_ip, redis_port, redis_pass = ServerHandler.get_redis_credentials()
+reference = redis.StrictRedis(connection_pool=ServerHandler.make_pool(redis_ip, redis_port, redis_pass, db=0))
+
+try:
+    reference.ping()
+except redis.ConnectionError:
+    print("Could not connect to Redis at {}:{}, it is needed as the reference.".format(redis_ip, redis_port))
+    sys.exit(1)
+
+with tempfile.TemporaryDirectory() as directory:
+    local = SQLiteRedis(os.path.join(directory, "conformance.db"))
+
+    cleanup(reference)
+    try:
+        failed = compare(reference, local)
+
+        print("\n{} of {} checks differ".format(failed, len(CASES) + len(RAW_CASES) + 1))
+        print()
+        benchmark(reference, "redis")
+        benchmark(local, "sqlite")
+    finally:
+        cleanup(reference)
+        local.close()
+
+sys.exit(1 if failed else 0)
@@ -0,0 +1,173 @@
+# coding=utf-8
+import os
+import sys
+import time
+import random
+
+import redis
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from core.serverhandler import ServerHandler, SETTINGS_CHANNEL, par, run_commands
+from core.keyspace import make_layout, LAYOUT_COMPACT, DEFAULT_BUCKETS, LEGACY_PREFIX, COMPACT_PREFIX, \
+    COMPACT_VALUE_BYTES
+
+#########################################
+# Keyspace migration
+# Moves guild settings from server:{id} hashes into the compact layout (see core/keyspace.py)
+# It works on a live database: guilds are migrated one SCAN page at a time with the same
+# script Nano uses, so it can be stopped and restarted at any point.
+#
+# Migrated guilds lose their server:{id} hash, which is the only key the legacy layout reads.
+# A process still on "layout = legacy" would take them for new guilds and reset their settings,
+# so set "layout = compact" under [Redis] in settings.ini and restart EVERY process before running this.
+# The compact layout reads both, so guilds that aren't migrated yet keep working in the meantime.
+#########################################
+
+# Keys per SCAN page (and per pipeline)
+SCAN_COUNT = 500
+# Keys sampled with MEMORY USAGE for the report
+SAMPLE_SIZE = 1000
+
+
+def scan_keys(client, match):
+    return [key.decode() for key in client.scan_iter(match=match, count=SCAN_COUNT)]
+
+
+def listpack_value_limit(client):
+    """
+    Returns hash-max-listpack-value (or None if CONFIG is disabled, like on some hosted Redis instances)
+    """
+    try:
+        config = client.config_get("hash-max-ziplist-value")
+    except redis.ResponseError:
+        return None
+
+    value = config.get("hash-max-ziplist-value") or config.get("hash-max-listpack-value")
+    return int(value) if value is not None else None
+
+
+def memory_report(client, layout):
+    """
+    Estimates how much memory guild settings take in both layouts (MEMORY USAGE sampling)
+    """
+    legacy = scan_keys(client, LEGACY_PREFIX + "*")
+    buckets = scan_keys(client, COMPACT_PREFIX + "*")
+
+    report = {}
+
+    if legacy:
+        sample = random.sample(legacy, min(SAMPLE_SIZE, len(legacy)))
+        pipe = client.pipeline(transaction=False)
+        for key in sample:
+            pipe.memory_usage(key, samples=0)
+
+        per_guild = sum(a or 0 for a in pipe.execute()) / len(sample)
+        report["legacy"] = (len(legacy), per_guild, per_guild * len(legacy))
+
+    limit = listpack_value_limit(client)
+    if limit is None:
+        print("Could not read hash-max-listpack-value (CONFIG GET is disabled)")
+    else:
+        print("hash-max-listpack-value: {}".format(limit))
+        if limit < COMPACT_VALUE_BYTES:
+            print("  Compact buckets can't be listpack-encoded, set hash-max-ziplist-value to at least {} "
+                  "in redis.conf (see data/redis.conf.example)".format(COMPACT_VALUE_BYTES))
+
+    if buckets:
+        # There are only a few buckets, measure all of them
+        pipe = client.pipeline(transaction=False)
+        for key in buckets:
+            pipe.memory_usage(key, samples=0)
+            pipe.hlen(key)
+            pipe.object("encoding", key)
+            pipe.hvals(key)
+
+        results = pipe.execute()
+        total = sum(a or 0 for a in results[::4])
+        guilds = sum(results[1::4])
+        listpacks = sum(1 for a in results[2::4] if a in (b"listpack", b"ziplist"))
+        lengths = [len(record) for records in results[3::4] for record in records]
+
+        report["compact"] = (guilds, total / guilds if guilds else 0, total)
+        print("Compact buckets: {} ({} listpack encoded, {} buckets configured)".format(
+            len(buckets), listpacks, layout.buckets))
+
+        if lengths:
+            print("Records: longest {} bytes, mean {:.0f} bytes".format(max(lengths), sum(lengths) / len(lengths)))
+            if limit is not None:
+                print("  {} records are longer than hash-max-listpack-value".format(
+                    sum(1 for a in lengths if a > limit)))
+
+    print("\n{:<10} {:>10} {:>16} {:>14}".format("layout", "guilds", "bytes per guild", "total (MB)"))
+    for name, (guilds, per_guild, total) in report.items():
+        print("{:<10} {:>10} {:>16.1f} {:>14.2f}".format(name, guilds, per_guild, total / 1024 / 1024))
+
+    if "legacy" in report and "compact" in report and report["compact"][1]:
+        print("\nCompact records are {:.1f}x smaller".format(report["legacy"][1] / report["compact"][1]))
+
+    print("used_memory: {}\n".format(client.info("memory").get("used_memory_human")))
+    return report
+
+
+def migrate(client, layout, pause: float):
+    started = time.monotonic()
+    migrated = 0
+
+    for source in layout.scripts:
+        client.script_load(source)
+
+    cursor = 0
+    while True:
+        cursor, keys = client.scan(cursor, match=LEGACY_PREFIX + "*", count=SCAN_COUNT)
+
+        if keys:
+            guild_ids = [key.decode()[len(LEGACY_PREFIX):] for key in keys]
+            run_commands(client, [layout.migrate(guild_id) for guild_id in guild_ids])
+
+            # Let other processes drop their cached copy
+            pipe = client.pipeline(transaction=False)
+            for guild_id in guild_ids:
+                pipe.publish(SETTINGS_CHANNEL, guild_id)
+            pipe.execute()
+            migrated += len(keys)
+
+            print("Migrated {} guilds (cursor {}, {:.1f}s)".format(migrated, cursor, time.monotonic() - started))
+
+            if pause:
+                time.sleep(pause)
+
+        if cursor == 0:
+            break
+
+    print("Done: migrated {} guilds in {:.1f}s".format(migrated, time.monotonic() - started))
+
+
+print("-------------------------")
+print("KEYSPACE MIGRATION UTILITY")
+print("-------------------------")
+
+if par.get("Redis", "layout", fallback="legacy") != LAYOUT_COMPACT:
+    print("Set \"layout = compact\" under [Redis] in settings.ini and restart every Nano process first:\n"
+          "processes on the legacy layout can't see migrated guilds and would reset their settings.")
+    sys.exit(1)
+
+redis_ip, redis_port, redis_pass = ServerHandler.get_redis_credentials()
+red = redis.StrictRedis(connection_pool=ServerHandler.make_pool(redis_ip, redis_port, redis_pass, db=0))
+
+compact = make_layout(LAYOUT_COMPACT, par.getint("Redis", "buckets", fallback=DEFAULT_BUCKETS))
+
+print("Measuring memory usage...")
+memory_report(red, compact)
+
+if input("Are ALL Nano processes running with \"layout = compact\"? (y/n) ").lower() != "y":
+    sys.exit(0)
+
+if input("Migrate every guild to the compact layout? (y/n) ").lower() != "y":
+    sys.exit(0)
+
+throttle = input("Pause between pages in seconds (empty for none): ").strip()
+migrate(red, compact, float(throttle) if throttle else 0)
+
+print("\nMeasuring memory usage again...")
+memory_report(red, compact)
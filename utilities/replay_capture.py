@@ -0,0 +1,333 @@
+# coding=utf-8
+import argparse
+import asyncio
+import logging
+import os
+import random
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from core.capture import read_capture, command_hash, CLASS_COMMAND, CLASS_LINK, CLASS_INVITE, CLASS_MENTIONS, \
+    CLASS_EMPTY, CLASS_BOT, CONTENT_CLASSES
+from core.metrics import LatencyHistogram, LatencyRegistry, clock
+from core.offline import OfflineGuild, OfflineMessage, OfflineReaction, use_offline_settings, connect_offline, \
+    setup_guild, outbox
+
+#########################################
+# Capture replay
+# Feeds a capture from core/capture.py ([Capture] in settings.ini) back through Nano.dispatch_event,
+# on the in-memory backend with the stand-ins from core/offline.py. Every hashed guild, channel and user
+# becomes a stand-in, messages get synthetic content of the recorded class and length.
+#
+# Run from the repository root:
+#   python utilities/replay_capture.py data/captures/capture-....ncap             (real time)
+#   python utilities/replay_capture.py capture.ncap --speed 3                      (3x the recorded rate)
+#   python utilities/replay_capture.py capture.ncap --speed 0 --concurrency 128    (as fast as possible)
+#########################################
+
+# Must be set before nano.py creates the handlers
+use_offline_settings()
+
+import nano as bot_module
+
+# Keep the output readable, plugin errors are counted in the latency histograms
+logging.disable(logging.CRITICAL)
+
+nano = bot_module.nano
+handler = bot_module.handler
+loop = bot_module.loop
+
+PREFIX = "!"
+DEFAULT_CONCURRENCY = 64
+DEFAULT_SEED = 1337
+# Progress line every this many events
+PROGRESS_EVERY = 10000
+
+WORDS = ("the quick brown fox jumps over a lazy dog while nano keeps the server tidy and "
+         "everyone talks about games music code memes weather and weekend plans").split()
+
+
+class Stage:
+    """
+    Turns hashed ids into stand-ins (created on first sight) and records into event arguments
+    """
+    def __init__(self, rng: random.Random):
+        self.rng = rng
+        self.bot_user = connect_offline(bot_module.client)
+
+        self.guilds = {}
+        self.channels = {}
+        self.members = {}
+
+        # command_hash: command key, for the commands that exist in this version
+        self.commands = {command_hash(key): key for key in nano.router}
+        self.unknown_commands = 0
+
+    def guild(self, hashed: int) -> OfflineGuild:
+        guild = self.guilds.get(hashed)
+        if guild is None:
+            guild = OfflineGuild("Guild {}".format(len(self.guilds)), bot_user=self.bot_user)
+            setup_guild(handler, bot_module.client, guild, PREFIX)
+
+            self.guilds[hashed] = guild
+
+        return guild
+
+    def channel(self, guild: OfflineGuild, hashed: int):
+        channel = self.channels.get(hashed)
+        if channel is None:
+            channel = guild.add_channel("channel-{}".format(len(guild.channels)))
+            self.channels[hashed] = channel
+
+        return channel
+
+    def member(self, guild: OfflineGuild, hashed: int, bot: bool=False):
+        key = (guild.id, hashed)
+
+        member = self.members.get(key)
+        if member is None:
+            member = guild.add_member("member-{}".format(len(guild.members)), bot=bot)
+            self.members[key] = member
+
+        return member
+
+    def text(self, length: int) -> str:
+        words = []
+        size = 0
+        while size < length:
+            word = self.rng.choice(WORDS)
+            words.append(word)
+            size += len(word) + 1
+
+        return " ".join(words)[:length]
+
+    def content(self, record, guild: OfflineGuild) -> tuple:
+        """
+        Returns (content, mentioned members) resembling the recorded message
+        """
+        cls = record.content_class
+        mentions = self.rng.sample(guild.members, min(record.mentions, len(guild.members)))
+
+        if cls == CLASS_EMPTY:
+            return "", mentions
+
+        if cls == CLASS_COMMAND:
+            command = self.commands.get(record.command)
+            if command is None:
+                # Removed since the capture was made
+                self.unknown_commands += 1
+                return self.text(record.length), mentions
+
+            command = PREFIX + command[1:] if command.startswith("_") else command
+            rest = record.length - len(command) - 1
+            return command + (" " + self.text(rest) if rest > 0 else ""), mentions
+
+        if cls == CLASS_INVITE:
+            head = "discord.gg/nano"
+        elif cls == CLASS_LINK:
+            head = "https://example.com/page"
+        elif cls == CLASS_MENTIONS:
+            head = " ".join(a.mention for a in mentions)
+        else:
+            head = ""
+
+        rest = record.length - len(head) - 1
+        return (head + " " + self.text(rest)).strip() if rest > 0 else head, mentions
+
+    def message(self, record) -> OfflineMessage:
+        guild = self.guild(record.guild)
+        channel = self.channel(guild, record.channel)
+        author = self.member(guild, record.user, bot=record.content_class == CLASS_BOT)
+
+        content, mentions = self.content(record, guild)
+        return OfflineMessage(content, channel, author, mentions=mentions)
+
+    def arguments(self, record):
+        """
+        Returns the arguments for Nano.dispatch_event or None if the event can't be rebuilt
+        """
+        event = record.event
+
+        if event in ("on_message", "on_message_delete"):
+            return self.message(record),
+
+        if event == "on_message_edit":
+            after = self.message(record)
+            before = OfflineMessage(self.text(record.length), after.channel, after.author)
+            return before, after
+
+        if not record.guild:
+            return None
+        guild = self.guild(record.guild)
+
+        if event == "on_reaction_add":
+            channel = self.channel(guild, record.channel)
+            message = OfflineMessage(self.text(20), channel, self.rng.choice(guild.members))
+            return OfflineReaction(message, "\N{THUMBS UP SIGN}"), self.member(guild, record.user)
+
+        if event in ("on_member_join", "on_member_remove"):
+            return self.member(guild, record.user),
+        if event == "on_member_update":
+            member = self.member(guild, record.user)
+            return member, member
+        if event in ("on_member_ban", "on_member_unban"):
+            return guild, self.member(guild, record.user)
+
+        if event in ("on_guild_join", "on_guild_remove"):
+            return guild,
+
+        if event in ("on_channel_create", "on_channel_delete"):
+            return self.channel(guild, record.channel),
+        if event == "on_channel_update":
+            channel = self.channel(guild, record.channel)
+            return channel, channel
+
+        return None
+
+
+async def replay(events: list, speed: float, concurrency: int) -> dict:
+    """
+    Dispatches (offset in seconds, event, arguments) like discord.py does: one task per event.
+    speed 0 dispatches as fast as the concurrency limit allows.
+    """
+    lag = LatencyHistogram()
+    dispatch = LatencyRegistry()
+    limit = asyncio.Semaphore(concurrency) if not speed else None
+
+    async def run(event, args):
+        started = clock()
+        failed = True
+        try:
+            await nano.dispatch_event(event, *args)
+            failed = False
+        finally:
+            dispatch.get("dispatch", event).record(clock() - started, failed)
+            if limit is not None:
+                limit.release()
+
+    tasks = set()
+    started = time.monotonic()
+
+    for number, (offset, event, args) in enumerate(events, 1):
+        if speed:
+            due = started + offset / speed
+            wait = due - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+
+            # How far behind the recorded schedule the loop is
+            lag.record(int(max(0, time.monotonic() - due) * 1e9))
+        else:
+            await limit.acquire()
+
+        task = loop.create_task(run(event, args))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+
+        if number % PROGRESS_EVERY == 0:
+            print("  {} events, {} in flight".format(number, len(tasks)))
+
+    if tasks:
+        await asyncio.wait(tasks)
+
+    return {
+        "seconds": time.monotonic() - started,
+        "lag": lag.to_dict(),
+        "dispatch": dispatch,
+    }
+
+
+async def main(args) -> int:
+    rng = random.Random(args.seed)
+    random.seed(args.seed)
+
+    recorded_start, records = read_capture(args.capture)
+    stage = Stage(rng)
+
+    # Build every stand-in up front, so replaying doesn't include it
+    events = []
+    skipped = {}
+    classes = {}
+    offset = 0
+
+    for record in records:
+        offset += record.delta / 1e6
+
+        arguments = stage.arguments(record)
+        if arguments is None:
+            skipped[record.event] = skipped.get(record.event, 0) + 1
+            continue
+
+        if record.event == "on_message":
+            name = CONTENT_CLASSES.get(record.content_class)
+            classes[name] = classes.get(name, 0) + 1
+
+        events.append((offset, record.event, arguments))
+
+        if args.limit and len(events) >= args.limit:
+            break
+
+    if not events:
+        print("Nothing to replay")
+        return 1
+
+    duration = events[-1][0] or 1e-6
+    print("Capture from {}: {} events over {:.1f}s ({:.1f} events/s)".format(
+        time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(recorded_start)), len(events), duration,
+        len(events) / duration))
+    print("Stand-ins: {} guilds, {} channels, {} members".format(
+        len(stage.guilds), len(stage.channels), len(stage.members)))
+    print("Messages by class: {}".format(", ".join("{} {}".format(v, k) for k, v in sorted(classes.items()))))
+    if skipped:
+        print("Skipped: {}".format(", ".join("{} {}".format(v, k) for k, v in skipped.items())))
+    if stage.unknown_commands:
+        print("Commands that no longer exist (replayed as text): {}".format(stage.unknown_commands))
+
+    print("\nReplaying at {}...".format("{}x".format(args.speed) if args.speed else "max speed"))
+
+    nano.latency.reset()
+    outbox.reset()
+    nano.watchdog.start()
+
+    result = await replay(events, args.speed, args.concurrency)
+    nano.watchdog.stop()
+
+    seconds = result["seconds"]
+    print("\n{} events in {:.2f}s: {:.1f} events/s ({:.2f}x the recorded rate)".format(
+        len(events), seconds, len(events) / seconds, duration / seconds))
+    print("{} replies, {} reactions, {} deleted".format(outbox.count, outbox.reactions, outbox.deleted))
+    print("Event loop: max lag {:.1f}ms, {} stalls".format(nano.watchdog.max_lag * 1000, len(nano.watchdog.stalls)))
+
+    if args.speed:
+        lag = result["lag"]
+        print("Behind schedule (us): p50 {} p95 {} p99 {} max {}".format(lag["p50"], lag["p95"], lag["p99"], lag["max"]))
+
+    print("\n{:<20} {:>8} {:>6} {:>9} {:>8} {:>8} {:>9}".format("event", "count", "errors", "mean(us)", "p50",
+                                                                  "p99", "max"))
+    for _, event, summary in result["dispatch"].slowest(len(events), key="calls"):
+        print("{:<20} {:>8} {:>6} {:>9} {:>8} {:>8} {:>9}".format(
+            event, summary["calls"], summary["errors"], summary["mean"], summary["p50"], summary["p99"], summary["max"]))
+
+    print("\n{:<14} {:<20} {:>8} {:>6} {:>9} {:>8} {:>8}".format("plugin", "event", "calls", "errors", "mean(us)",
+                                                                  "p99", "max"))
+    for plugin, event, summary in nano.latency.slowest(args.top, key="p99"):
+        print("{:<14} {:<20} {:>8} {:>6} {:>9} {:>8} {:>8}".format(
+            plugin, event, summary["calls"], summary["errors"], summary["mean"], summary["p99"], summary["max"]))
+
+    return 0
+
+
+if __name__ == "__main__":
+    arguments = argparse.ArgumentParser(description="Replays a Nano event capture offline")
+    arguments.add_argument("capture", help="capture file (.ncap)")
+    arguments.add_argument("--speed", type=float, default=1.0,
+                           help="multiple of the recorded rate (1, 10, ...), 0 = as fast as possible")
+    arguments.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY,
+                           help="events in flight at max speed")
+    arguments.add_argument("--limit", type=int, help="replay only the first N events")
+    arguments.add_argument("--top", type=int, default=15, help="plugins to list (by p99)")
+    arguments.add_argument("--seed", type=int, default=DEFAULT_SEED)
+
+    sys.exit(loop.run_until_complete(main(arguments.parse_args())))